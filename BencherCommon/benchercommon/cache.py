@@ -0,0 +1,215 @@
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import urllib.parse
+import urllib.request
+from contextlib import contextmanager
+from typing import Optional
+
+# environment variable pointing to the persistent cache shared by all benchmark services
+CACHE_DIR_ENV = "BENCHER_CACHE_DIR"
+# environment variable replacing the host of all download URLs, e.g., file:///data/mirror or http://localhost:8000
+MIRROR_URL_ENV = "BENCHER_MIRROR_URL"
+# environment variable that, if set to 1, allows downloading files without a pinned checksum
+ALLOW_UNPINNED_ENV = "BENCHER_ALLOW_UNPINNED"
+
+
+def cache_root() -> str:
+    """
+    Returns the root directory of the persistent cache, creating it if necessary.
+
+    The root is taken from the `BENCHER_CACHE_DIR` environment variable and defaults to `~/.cache/bencher`.
+
+    Returns:
+        The path of the cache root.
+    """
+    root = os.environ.get(CACHE_DIR_ENV, os.path.join(os.path.expanduser("~"), ".cache", "bencher"))
+    os.makedirs(root, exist_ok=True)
+    return root
+
+
+def cache_dir(
+        name: str
+) -> str:
+    """
+    Returns a named subdirectory of the cache root, creating it if necessary.
+
+    Args:
+        name: The name of the subdirectory.
+
+    Returns:
+        The path of the subdirectory.
+    """
+    path = os.path.join(cache_root(), name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+@contextmanager
+def file_lock(
+        name: str
+):
+    """
+    Holds an exclusive lock that is shared by all processes using the same cache root.
+
+    Args:
+        name: The name of the lock.
+    """
+    with open(os.path.join(cache_dir("locks"), f"{name}.lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@contextmanager
+def atomic_write(
+        path: str
+):
+    """
+    Opens a temporary file next to `path` for binary writing and moves it to `path` once the block succeeds.
+
+    Readers therefore either see no file or the complete file.
+
+    Args:
+        path: The final path of the file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+    # mkstemp creates files only readable by the owner, but the cache may be shared
+    os.fchmod(fd, 0o644)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def sha256sum(
+        path: str
+) -> str:
+    """
+    Computes the SHA-256 hex digest of a file.
+
+    Args:
+        path: Path to the file.
+
+    Returns:
+        The hex digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def resolve_url(
+        url: str
+) -> str:
+    """
+    Replaces everything but the file name of `url` by the mirror in `BENCHER_MIRROR_URL`, if set.
+
+    Args:
+        url: The original download URL.
+
+    Returns:
+        The URL to download from.
+    """
+    mirror = os.environ.get(MIRROR_URL_ENV)
+    if mirror is None:
+        return url
+    return f"{mirror.rstrip('/')}/{os.path.basename(urllib.parse.urlparse(url).path)}"
+
+
+def fetch(
+        url: str,
+        sha256: Optional[str] = None
+) -> str:
+    """
+    Downloads a file into the content-addressed store of the cache and returns its path.
+
+    Files are stored under `blobs/<sha256>` and an index maps the file name to its digest. The stored file is verified
+    against `sha256` and downloaded again if the verification fails. Concurrent calls from several processes download
+    the file only once.
+
+    A file without a pinned `sha256` is only downloaded if `BENCHER_ALLOW_UNPINNED=1` is set. Its first download is
+    then trusted, its digest is logged so that it can be pinned, and the digest recorded in the index acts as its pin
+    from then on.
+
+    Args:
+        url: The download URL, `http(s)://` or `file://`.
+        sha256: The expected SHA-256 hex digest of the file, or None for a file that is not pinned.
+
+    Returns:
+        The path of the verified file in the cache.
+
+    Raises:
+        ValueError: If the downloaded file does not match `sha256` or the recorded digest, or if the file is not pinned
+            and unpinned downloads are not allowed.
+    """
+    name = os.path.basename(urllib.parse.urlparse(url).path)
+    blob_dir = cache_dir("blobs")
+    index_path = os.path.join(cache_dir("index"), name)
+
+    with file_lock(f"download-{name}"):
+        digest = sha256
+        if digest is None and os.path.exists(index_path):
+            with open(index_path, "r") as f:
+                digest = f.read().strip()
+        if digest is not None:
+            blob_path = os.path.join(blob_dir, digest)
+            if os.path.exists(blob_path) and sha256sum(blob_path) == digest:
+                return blob_path
+
+        if digest is None and os.environ.get(ALLOW_UNPINNED_ENV) != "1":
+            raise ValueError(
+                f"No checksum pinned for {name}, set {ALLOW_UNPINNED_ENV}=1 to trust its first download"
+            )
+
+        download_url = resolve_url(url)
+        print(f"Downloading {download_url}")
+        hasher = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=blob_dir, suffix=".part")
+        os.fchmod(fd, 0o644)
+        try:
+            with os.fdopen(fd, "wb") as out, urllib.request.urlopen(download_url) as response:
+                for block in iter(lambda: response.read(1 << 20), b""):
+                    hasher.update(block)
+                    out.write(block)
+            downloaded_digest = hasher.hexdigest()
+            if digest is not None and downloaded_digest != digest:
+                raise ValueError(f"Checksum mismatch for {download_url}: expected {digest}, got {downloaded_digest}")
+            if digest is None:
+                logging.warning(f"No checksum pinned for {name}, trusting the download with sha256 {downloaded_digest}")
+            blob_path = os.path.join(blob_dir, downloaded_digest)
+            os.replace(tmp_path, blob_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        with atomic_write(index_path) as f:
+            f.write(downloaded_digest.encode())
+        print(f"Downloaded {name}")
+        return blob_path
+
+
+def copy_to(
+        src,
+        path: str
+):
+    """
+    Atomically writes the content of a binary file object to `path`.
+
+    Args:
+        src: The file object to read from.
+        path: The destination path.
+    """
+    with atomic_write(path) as out:
+        shutil.copyfileobj(src, out)
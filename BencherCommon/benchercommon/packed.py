@@ -0,0 +1,147 @@
+import struct
+from typing import Tuple
+
+import numpy as np
+
+# a packed request is the header, the UTF-8 benchmark name, zero padding to a multiple of 8 bytes, and the row-major
+# matrix of points; a packed response is the little-endian float64 array of the values, one per row
+# shared by the router and all benchmark services
+PACKED_MAGIC = b"BNCH"
+# magic, encoding, number of rows, number of columns, length of the benchmark name
+PACKED_HEADER = struct.Struct("<4sB3xIIH")
+
+ENCODING_FLOAT64 = 0
+ENCODING_INT64 = 1
+# binary points, eight coordinates per byte (little bit order), each row starting at a new byte
+ENCODING_BITS = 2
+
+ENCODING_DTYPES = {
+    ENCODING_FLOAT64: np.dtype("<f8"),
+    ENCODING_INT64: np.dtype("<i8"),
+}
+
+
+def _data_offset(
+        name_length: int
+) -> int:
+    return -(-(PACKED_HEADER.size + name_length) // 8) * 8
+
+
+def encode_points(
+        benchmark_name: str,
+        x: np.ndarray,
+        encoding: int = ENCODING_FLOAT64
+) -> bytes:
+    """
+    Packs a matrix of points into the bytes of a packed request.
+
+    Args:
+        benchmark_name: The name of the benchmark.
+        x: Matrix of shape (n_points, dimension), or a single point of shape (dimension,).
+        encoding: `ENCODING_FLOAT64`, `ENCODING_INT64`, or `ENCODING_BITS` for points with only zeros and ones.
+
+    Returns:
+        The packed request.
+    """
+    x = np.atleast_2d(x)
+    name = benchmark_name.encode("utf-8")
+    header = PACKED_HEADER.pack(PACKED_MAGIC, encoding, x.shape[0], x.shape[1], len(name))
+    padding = bytes(_data_offset(len(name)) - len(header) - len(name))
+    if encoding == ENCODING_BITS:
+        data = np.packbits(x != 0, axis=1, bitorder="little").tobytes()
+    else:
+        data = np.ascontiguousarray(x, dtype=ENCODING_DTYPES[encoding]).tobytes()
+    return header + name + padding + data
+
+
+def _unpack_header(
+        buffer: bytes
+) -> Tuple[int, int, int, str, int]:
+    if len(buffer) < PACKED_HEADER.size:
+        raise ValueError("Packed request is shorter than its header")
+    magic, encoding, n_rows, n_cols, name_length = PACKED_HEADER.unpack_from(buffer)
+    if magic != PACKED_MAGIC:
+        raise ValueError("Not a packed request")
+    if encoding not in ENCODING_DTYPES and encoding != ENCODING_BITS:
+        raise ValueError(f"Unknown point encoding {encoding}")
+    name = bytes(buffer[PACKED_HEADER.size:PACKED_HEADER.size + name_length]).decode("utf-8")
+    return encoding, n_rows, n_cols, name, _data_offset(name_length)
+
+
+def packed_benchmark_name(
+        buffer: bytes
+) -> str:
+    """
+    Reads only the benchmark name of a packed request.
+
+    Args:
+        buffer: The packed request.
+
+    Returns:
+        The benchmark name.
+
+    Raises:
+        ValueError: If `buffer` does not start with a valid header.
+    """
+    return _unpack_header(buffer)[3]
+
+
+def decode_points(
+        buffer: bytes
+) -> Tuple[str, np.ndarray]:
+    """
+    Unpacks a packed request. float64 and int64 points are not copied.
+
+    Args:
+        buffer: The packed request.
+
+    Returns:
+        The benchmark name and a matrix of shape (n_points, dimension). For `ENCODING_BITS`, the matrix is a new uint8
+        array of zeros and ones; otherwise, it is a read-only view of `buffer`.
+
+    Raises:
+        ValueError: If `buffer` is not a valid packed request.
+    """
+    encoding, n_rows, n_cols, name, offset = _unpack_header(buffer)
+    if encoding == ENCODING_BITS:
+        row_bytes = -(-n_cols // 8)
+        if len(buffer) != offset + n_rows * row_bytes:
+            raise ValueError("Size of the packed request does not match its header")
+        bits = np.frombuffer(buffer, dtype=np.uint8, count=n_rows * row_bytes, offset=offset)
+        x = np.unpackbits(bits.reshape(n_rows, row_bytes), axis=1, count=n_cols, bitorder="little")
+        return name, x
+    dtype = ENCODING_DTYPES[encoding]
+    if len(buffer) != offset + n_rows * n_cols * dtype.itemsize:
+        raise ValueError("Size of the packed request does not match its header")
+    x = np.frombuffer(buffer, dtype=dtype, count=n_rows * n_cols, offset=offset)
+    return name, x.reshape(n_rows, n_cols)
+
+
+def encode_values(
+        values: np.ndarray
+) -> bytes:
+    """
+    Packs the values of the points into the bytes of a packed response.
+
+    Args:
+        values: Array of shape (n_points,).
+
+    Returns:
+        The packed response.
+    """
+    return np.ascontiguousarray(values, dtype="<f8").tobytes()
+
+
+def decode_values(
+        buffer: bytes
+) -> np.ndarray:
+    """
+    Unpacks a packed response without copying.
+
+    Args:
+        buffer: The packed response.
+
+    Returns:
+        A read-only array of shape (n_points,) viewing `buffer`.
+    """
+    return np.frombuffer(buffer, dtype="<f8")
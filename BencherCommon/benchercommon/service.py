@@ -0,0 +1,270 @@
+import logging
+import os
+import signal
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import grpc
+from bencherscaffold.protoclasses import second_level_services_pb2_grpc
+from bencherscaffold.protoclasses.bencher_pb2 import BenchmarkRequest, EvaluationResult
+from bencherscaffold.protoclasses.grcp_service import GRCPService
+
+# a serialized grpc.health.v1.HealthCheckResponse with status SERVING
+HEALTH_SERVING = b"\x08\x01"
+# environment variable with the largest message in bytes that the services and the router send and receive
+MAX_MESSAGE_LENGTH_ENV = "BENCHER_MAX_MESSAGE_LENGTH"
+# gRPC's default of 4 MB holds only a few points of high-dimensional benchmarks in a packed request
+DEFAULT_MAX_MESSAGE_LENGTH = 256 * 1024 * 1024
+
+
+def max_message_length() -> int:
+    """
+    Returns the largest message in bytes that the services and the router send and receive, taken from the
+    `BENCHER_MAX_MESSAGE_LENGTH` environment variable and defaulting to 256 MiB.
+
+    Returns:
+        The largest message length in bytes.
+    """
+    return int(os.environ.get(MAX_MESSAGE_LENGTH_ENV, DEFAULT_MAX_MESSAGE_LENGTH))
+
+
+def message_length_options(
+        length: Optional[int] = None
+) -> List[Tuple[str, int]]:
+    """
+    Returns the options of a gRPC server or channel that send and receive messages of up to `length` bytes.
+
+    Args:
+        length: The largest message length in bytes. If None, `max_message_length()` is used.
+
+    Returns:
+        The options, to be passed as `options` to a gRPC server or channel.
+    """
+    length = max_message_length() if length is None else length
+    return [
+        ('grpc.max_receive_message_length', length),
+        ('grpc.max_send_message_length', length),
+    ]
+
+
+class BenchmarkService(GRCPService):
+    """
+    Base class of the benchmark services.
+
+    Besides `evaluate_point`, it serves the streaming `evaluate_batch` RPC and the packed `evaluate_packed` RPC (see
+    `benchercommon.packed`) under the `SecondLevelBencher` service. Subclasses implement both methods and can serve
+    more methods by extending `method_handlers`.
+
+    It also answers the `Check` RPC of the standard gRPC health service, which the router uses to probe it. The check
+    runs on the same threads as the evaluations, so a service whose threads are all stuck does not answer it.
+    """
+
+    def method_handlers(
+            self
+    ) -> Dict[str, grpc.RpcMethodHandler]:
+        """
+        Returns the handlers of the methods served next to `evaluate_point`.
+
+        Returns:
+            The handler of each method name of the `SecondLevelBencher` service.
+        """
+        return {
+            'evaluate_batch': grpc.stream_stream_rpc_method_handler(
+                self.evaluate_batch,
+                request_deserializer=BenchmarkRequest.FromString,
+                response_serializer=EvaluationResult.SerializeToString,
+            ),
+            # requests and responses are raw bytes
+            'evaluate_packed': grpc.unary_unary_rpc_method_handler(
+                self.evaluate_packed,
+            ),
+        }
+
+    def check_health(
+            self,
+            request: bytes,
+            context
+    ) -> bytes:
+        """
+        Answers the `grpc.health.v1.Health/Check` RPC.
+
+        Args:
+            request: The serialized `HealthCheckRequest`, ignored.
+            context: The gRPC context.
+
+        Returns:
+            The serialized `HealthCheckResponse` with status SERVING.
+        """
+        return HEALTH_SERVING
+
+    def start(
+            self
+    ) -> grpc.Server:
+        """
+        Starts serving all methods on the configured port.
+
+        Returns:
+            The started server.
+        """
+        server = grpc.server(ThreadPoolExecutor(max_workers=self.n_cores), options=message_length_options())
+        second_level_services_pb2_grpc.add_SecondLevelBencherServicer_to_server(self, server)
+        server.add_generic_rpc_handlers(
+            (
+                grpc.method_handlers_generic_handler('SecondLevelBencher', self.method_handlers()),
+                # requests and responses are raw bytes, so the service does not depend on grpcio-health-checking
+                grpc.method_handlers_generic_handler(
+                    'grpc.health.v1.Health',
+                    {'Check': grpc.unary_unary_rpc_method_handler(self.check_health)}
+                ),
+            )
+        )
+        server.add_insecure_port(f"{self.host}:{self.port}")
+        server.start()
+        return server
+
+    def close(
+            self
+    ):
+        """
+        Releases the resources of the service that outlive its process otherwise, such as worker processes or shared
+        memory. Called by `serve` when the server terminates. Does nothing by default.
+        """
+
+    def serve(
+            self,
+            grace: float = 5.0
+    ):
+        """
+        Serves all methods on the configured port and blocks until the server terminates.
+
+        SIGTERM, which the entrypoint and docker use to stop services, stops the server and lets calls in flight finish
+        for `grace` seconds. Its default action would skip all cleanup, so `close` is called before returning, on
+        SIGTERM as well as on SIGINT.
+
+        Args:
+            grace: The time in seconds that calls in flight get to finish after SIGTERM.
+        """
+        server = self.start()
+        print(f"Server started, listening on {self.port}")
+        previous_handler = signal.signal(signal.SIGTERM, lambda signum, frame: server.stop(grace))
+        try:
+            server.wait_for_termination()
+        finally:
+            signal.signal(signal.SIGTERM, previous_handler)
+            self.close()
+
+
+class WorkerPool:
+    """
+    A `ProcessPoolExecutor` that is started on first use and replaced when one of its workers dies.
+
+    A worker that dies, e.g., from a segfault of a simulator, breaks its executor for good: all its pending and future
+    tasks fail with `BrokenProcessPool`, while the gRPC process and its health check stay fine. The pool shuts a broken
+    executor down and starts a new one, and every task lost with the broken executor is submitted again, up to
+    `retries` times, before it fails its request.
+    """
+
+    def __init__(
+            self,
+            create_executor: Callable[[], ProcessPoolExecutor],
+            retries: int = 1
+    ):
+        """
+        Args:
+            create_executor: Starts a new executor, including any resources its workers depend on.
+            retries: The number of times a task lost with a broken executor is submitted again.
+        """
+        self.create_executor = create_executor
+        self.retries = retries
+        # the number of broken executors that were replaced
+        self.restarts = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def executor(
+            self
+    ) -> ProcessPoolExecutor:
+        """
+        Returns the current executor, starting it if necessary.
+
+        Returns:
+            The executor.
+        """
+        executor = self._executor
+        if executor is None:
+            with self._lock:
+                executor = self._executor
+                if executor is None:
+                    executor = self.create_executor()
+                    self._executor = executor
+        return executor
+
+    def _replace(
+            self,
+            broken: ProcessPoolExecutor
+    ):
+        with self._lock:
+            # other tasks of the same executor may have noticed it first
+            if self._executor is broken:
+                logging.warning("A worker process died, starting new worker processes")
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                self.restarts += 1
+
+    def _submit(
+            self,
+            fn: Callable,
+            args: Tuple
+    ) -> Tuple[ProcessPoolExecutor, Future]:
+        for attempt in range(self.retries + 1):
+            executor = self.executor()
+            try:
+                return executor, executor.submit(fn, *args)
+            except BrokenProcessPool:
+                self._replace(executor)
+                if attempt == self.retries:
+                    raise
+
+    def submit(
+            self,
+            fn: Callable,
+            *args
+    ) -> Callable[[], Any]:
+        """
+        Submits a task to the worker processes.
+
+        Args:
+            fn: The function to run, which must be picklable.
+            *args: The arguments of the function.
+
+        Returns:
+            A function that waits for the task and returns its result. It raises `BrokenProcessPool` if the task was
+            lost with more than `retries` broken executors.
+        """
+        executor, future = self._submit(fn, args)
+
+        def result():
+            nonlocal executor, future
+            for attempt in range(self.retries + 1):
+                try:
+                    return future.result()
+                except BrokenProcessPool:
+                    self._replace(executor)
+                    if attempt == self.retries:
+                        raise
+                    executor, future = self._submit(fn, args)
+
+        return result
+
+    def shutdown(
+            self
+    ):
+        """
+        Shuts the current executor down, if it was started, and waits for its workers to exit.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
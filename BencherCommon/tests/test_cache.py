@@ -0,0 +1,134 @@
+import hashlib
+import os
+import stat
+import threading
+import time
+
+import pytest
+
+from benchercommon import cache
+
+
+@pytest.fixture(autouse=True)
+def cache_root(tmp_path, monkeypatch):
+    root = tmp_path / "cache"
+    monkeypatch.setenv(cache.CACHE_DIR_ENV, str(root))
+    monkeypatch.delenv(cache.MIRROR_URL_ENV, raising=False)
+    monkeypatch.delenv(cache.ALLOW_UNPINNED_ENV, raising=False)
+    return root
+
+
+def test_atomic_write_moves_complete_file(tmp_path):
+    path = str(tmp_path / "data.bin")
+    with cache.atomic_write(path) as f:
+        f.write(b"abc")
+        assert not os.path.exists(path)
+
+    with open(path, "rb") as f:
+        assert f.read() == b"abc"
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
+    assert os.listdir(tmp_path) == ["data.bin"]
+
+
+def test_atomic_write_leaves_nothing_on_failure(tmp_path):
+    path = str(tmp_path / "data.bin")
+    with pytest.raises(RuntimeError):
+        with cache.atomic_write(path) as f:
+            f.write(b"partial")
+            raise RuntimeError("interrupted")
+    assert os.listdir(tmp_path) == []
+
+
+def test_file_lock_is_exclusive():
+    events = []
+    holding = threading.Event()
+
+    def hold():
+        with cache.file_lock("shared"):
+            holding.set()
+            time.sleep(0.2)
+            events.append("released")
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    holding.wait()
+    # flock locks of separate open files conflict even within one process
+    with cache.file_lock("shared"):
+        events.append("acquired")
+    thread.join()
+    assert events == ["released", "acquired"]
+
+
+def test_file_lock_names_are_independent():
+    with cache.file_lock("a"):
+        with cache.file_lock("b"):
+            pass
+
+
+def source_file(
+        tmp_path,
+        content: bytes
+):
+    path = tmp_path / "source" / "data.txt"
+    path.parent.mkdir(exist_ok=True)
+    path.write_bytes(content)
+    return path, path.as_uri(), hashlib.sha256(content).hexdigest()
+
+
+def test_fetch_downloads_once_and_verifies_the_blob(tmp_path, monkeypatch):
+    monkeypatch.setenv(cache.ALLOW_UNPINNED_ENV, "1")
+    path, url, digest = source_file(tmp_path, b"benchmark data")
+    blob = cache.fetch(url)
+    assert os.path.basename(blob) == digest
+    with open(blob, "rb") as f:
+        assert f.read() == b"benchmark data"
+
+    # served from the cache without the source
+    path.unlink()
+    assert cache.fetch(url) == blob
+    assert cache.fetch(url, sha256=digest) == blob
+
+    # a corrupted blob is downloaded again
+    path.write_bytes(b"benchmark data")
+    os.chmod(blob, 0o644)
+    with open(blob, "wb") as f:
+        f.write(b"corrupted")
+    assert cache.fetch(url) == blob
+    with open(blob, "rb") as f:
+        assert f.read() == b"benchmark data"
+
+
+def test_fetch_rejects_mismatching_pinned_checksum(tmp_path, cache_root):
+    _, url, _ = source_file(tmp_path, b"tampered data")
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        cache.fetch(url, sha256="0" * 64)
+    assert os.listdir(cache_root / "blobs") == []
+    assert os.listdir(cache_root / "index") == []
+
+
+def test_fetch_rejects_unpinned_download(tmp_path, cache_root):
+    _, url, digest = source_file(tmp_path, b"benchmark data")
+    with pytest.raises(ValueError, match="No checksum pinned"):
+        cache.fetch(url)
+    assert os.listdir(cache_root / "blobs") == []
+    assert os.path.basename(cache.fetch(url, sha256=digest)) == digest
+
+
+def test_fetch_rejects_changed_download_of_unpinned_file(tmp_path, monkeypatch):
+    monkeypatch.setenv(cache.ALLOW_UNPINNED_ENV, "1")
+    path, url, _ = source_file(tmp_path, b"benchmark data")
+    blob = cache.fetch(url)
+
+    # the recorded digest pins the file once it is lost from the cache
+    os.unlink(blob)
+    path.write_bytes(b"tampered data")
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        cache.fetch(url)
+
+
+def test_fetch_uses_mirror(tmp_path, monkeypatch):
+    _, _, digest = source_file(tmp_path, b"mirrored data")
+    monkeypatch.setenv(cache.MIRROR_URL_ENV, (tmp_path / "source").as_uri())
+    blob = cache.fetch("http://unreachable.invalid/files/data.txt", sha256=digest)
+    with open(blob, "rb") as f:
+        assert f.read() == b"mirrored data"
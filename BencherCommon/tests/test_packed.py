@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from benchercommon.packed import (
+    ENCODING_BITS,
+    ENCODING_FLOAT64,
+    ENCODING_INT64,
+    decode_points,
+    decode_values,
+    encode_points,
+    encode_values,
+    packed_benchmark_name,
+)
+
+
+@pytest.mark.parametrize("name", ["maxsat60", "lasso-dna", "a", "sixteen-bytes-ab", "ü"])
+@pytest.mark.parametrize("shape", [(1, 1), (3, 7), (5, 8), (2, 125), (0, 4)])
+def test_round_trip(name, shape):
+    rng = np.random.default_rng(0)
+    x_float = rng.uniform(size=shape)
+    x_int = rng.integers(-10, 10, size=shape)
+    x_bits = rng.integers(0, 2, size=shape)
+
+    for x, encoding in [(x_float, ENCODING_FLOAT64), (x_int, ENCODING_INT64), (x_bits, ENCODING_BITS)]:
+        buffer = encode_points(name, x, encoding)
+        # the points start at a multiple of 8 bytes
+        assert len(encode_points(name, x[:0], encoding)) % 8 == 0
+        assert packed_benchmark_name(buffer) == name
+        decoded_name, decoded = decode_points(buffer)
+        assert decoded_name == name
+        assert decoded.shape == shape
+        np.testing.assert_array_equal(decoded, x)
+
+
+def test_single_point():
+    name, x = decode_points(encode_points("ackley", np.arange(4.0)))
+    assert name == "ackley"
+    np.testing.assert_array_equal(x, [[0.0, 1.0, 2.0, 3.0]])
+
+
+def test_float_points_are_not_copied():
+    buffer = encode_points("ackley", np.ones((2, 3)))
+    _, x = decode_points(buffer)
+    assert not x.flags.writeable
+    assert not x.flags.owndata
+
+
+def test_bits_are_packed():
+    x = np.zeros((4, 125), dtype=np.int64)
+    x[:, ::3] = 1
+    header = len(encode_points("maxsat125", x[:0], ENCODING_BITS))
+    # 16 bytes per row
+    assert len(encode_points("maxsat125", x, ENCODING_BITS)) == header + 4 * 16
+
+
+def test_values_round_trip():
+    values = np.array([1.5, -np.inf, np.nan, 0.0])
+    np.testing.assert_array_equal(decode_values(encode_values(values)), values)
+    assert len(decode_values(encode_values(np.zeros(0)))) == 0
+
+
+@pytest.mark.parametrize("mutate", [
+    lambda b: b[:10],
+    lambda b: b"XXXX" + b[4:],
+    lambda b: b[:4] + bytes([9]) + b[5:],
+    lambda b: b[:-8],
+    lambda b: b + bytes(8),
+])
+def test_invalid_requests(mutate):
+    buffer = encode_points("ackley", np.ones((2, 3)))
+    with pytest.raises(ValueError):
+        decode_points(mutate(buffer))
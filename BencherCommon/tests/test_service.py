@@ -0,0 +1,157 @@
+import os
+import signal
+import socket
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import grpc
+import pytest
+from bencherscaffold.protoclasses.bencher_pb2 import BenchmarkRequest, EvaluationResult
+from bencherscaffold.protoclasses.second_level_services_pb2_grpc import SecondLevelBencherStub
+
+from benchercommon.service import HEALTH_SERVING, BenchmarkService, WorkerPool
+
+
+class SumService(BenchmarkService):
+
+    def evaluate_point(
+            self,
+            request,
+            context
+    ):
+        return EvaluationResult(value=sum(v.value for v in request.point.values))
+
+    def evaluate_batch(
+            self,
+            request_iterator,
+            context
+    ):
+        for request in request_iterator:
+            yield self.evaluate_point(request, context)
+
+    def evaluate_packed(
+            self,
+            request,
+            context
+    ):
+        return request[::-1]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def request(
+        values
+) -> BenchmarkRequest:
+    return BenchmarkRequest(
+        benchmark={'name': 'sum'},
+        point={'values': [{'value': v} for v in values]}
+    )
+
+
+def test_serves_all_methods():
+    port = free_port()
+    server = SumService(port=port, n_cores=2).start()
+    try:
+        with grpc.insecure_channel(f"127.0.0.1:{port}") as channel:
+            assert SecondLevelBencherStub(channel).evaluate_point(request([1, 2])).value == 3
+            evaluate_batch = channel.stream_stream(
+                '/SecondLevelBencher/evaluate_batch',
+                request_serializer=BenchmarkRequest.SerializeToString,
+                response_deserializer=EvaluationResult.FromString,
+            )
+            results = evaluate_batch(iter([request([1]), request([2, 3]), request([])]))
+            assert [r.value for r in results] == [1, 5, 0]
+            assert channel.unary_unary('/SecondLevelBencher/evaluate_packed')(b"abc") == b"cba"
+            assert channel.unary_unary('/grpc.health.v1.Health/Check')(b"") == HEALTH_SERVING
+    finally:
+        server.stop(None)
+
+
+class ClosingService(SumService):
+
+    def __init__(
+            self,
+            **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.closed = 0
+
+    def start(
+            self
+    ):
+        server = super().start()
+        # stop the service the way the entrypoint and docker do once it serves
+        threading.Timer(0.5, os.kill, (os.getpid(), signal.SIGTERM)).start()
+        return server
+
+    def close(
+            self
+    ):
+        self.closed += 1
+
+
+def test_serve_closes_the_service_on_sigterm():
+    handler = signal.getsignal(signal.SIGTERM)
+    service = ClosingService(port=free_port(), n_cores=1)
+    service.serve(grace=0)
+    assert service.closed == 1
+    assert signal.getsignal(signal.SIGTERM) is handler
+
+
+def square(
+        x
+):
+    return x * x
+
+
+def crash(
+        marker
+):
+    # dies like a segfaulting simulator, once if a marker file is given and always otherwise
+    if marker is None or not os.path.exists(marker):
+        if marker is not None:
+            open(marker, "w").close()
+        os._exit(1)
+    return "recovered"
+
+
+def test_worker_pool_replaces_broken_executor(tmp_path):
+    pool = WorkerPool(lambda: ProcessPoolExecutor(max_workers=2))
+    try:
+        assert pool.submit(square, 3)() == 9
+        first = pool.executor()
+
+        # the crashing task is retried on a new executor
+        assert pool.submit(crash, str(tmp_path / "crashed"))() == "recovered"
+        assert pool.restarts == 1
+        assert pool.executor() is not first
+
+        # a task that kills every executor fails its own request only
+        with pytest.raises(BrokenProcessPool):
+            pool.submit(crash, None)()
+        assert pool.restarts == 3
+        assert [pool.submit(square, x)() for x in range(4)] == [0, 1, 4, 9]
+    finally:
+        pool.shutdown()
+
+
+def test_worker_pool_starts_on_first_use():
+    created = []
+
+    def create_executor():
+        created.append(ProcessPoolExecutor(max_workers=1))
+        return created[-1]
+
+    pool = WorkerPool(create_executor)
+    assert created == []
+    try:
+        results = [pool.submit(square, x) for x in range(3)]
+        assert [result() for result in results] == [0, 1, 4]
+        assert len(created) == 1
+    finally:
+        pool.shutdown()
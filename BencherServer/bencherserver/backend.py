@@ -0,0 +1,273 @@
+import contextlib
+import itertools
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import TypeVar
+
+import asyncio
+import grpc
+from benchercommon.service import message_length_options
+from bencherscaffold.protoclasses import second_level_services_pb2_grpc
+from bencherscaffold.protoclasses.bencher_pb2 import BenchmarkRequest, EvaluationResult
+
+T = TypeVar('T')
+
+# a serialized grpc.health.v1.HealthCheckResponse with status SERVING, see `benchercommon.service`
+HEALTH_SERVING = b"\x08\x01"
+
+
+class BackendChannel:
+    """
+    One channel to a second level service, with the callables of all RPCs the router forwards.
+    """
+
+    def __init__(
+            self,
+            address: str,
+            max_message_length: int | None = None
+    ):
+        """
+        Args:
+            address: The address of the service, as ``host:port``.
+            max_message_length: The largest message in bytes sent to and received from the service. If None,
+                `benchercommon.service.max_message_length()` is used.
+        """
+        # without a local subchannel pool, channels with the same target share one connection
+        self.channel = grpc.aio.insecure_channel(
+            address,
+            options=[('grpc.use_local_subchannel_pool', 1)] + message_length_options(max_message_length)
+        )
+        self.stub = second_level_services_pb2_grpc.SecondLevelBencherStub(self.channel)
+        self.evaluate_batch = self.channel.stream_stream(
+            '/SecondLevelBencher/evaluate_batch',
+            request_serializer=BenchmarkRequest.SerializeToString,
+            response_deserializer=EvaluationResult.FromString,
+        )
+        self.evaluate_neighbours = self.channel.unary_stream(
+            '/SecondLevelBencher/evaluate_neighbours',
+            request_serializer=BenchmarkRequest.SerializeToString,
+            response_deserializer=EvaluationResult.FromString,
+        )
+        # packed requests and responses are forwarded as raw bytes
+        self.evaluate_packed = self.channel.unary_unary('/SecondLevelBencher/evaluate_packed')
+        # the standard gRPC health check, with an empty request for the overall health of the server
+        self.check_health = self.channel.unary_unary('/grpc.health.v1.Health/Check')
+
+
+class Backend:
+    """
+    A second level service as seen by the router: a small pool of channels and a limit on concurrent calls.
+
+    Calls beyond the limit wait in the router instead of occupying a thread of the service, so slow services cannot
+    starve the others. Must be created inside the event loop of the router.
+    """
+
+    def __init__(
+            self,
+            address: str,
+            n_channels: int = 2,
+            max_concurrency: int = 64,
+            max_message_length: int | None = None
+    ):
+        """
+        Args:
+            address: The address of the service, as ``host:port``.
+            n_channels: The number of channels, each with its own connection. Calls are spread over them round-robin.
+            max_concurrency: The maximum number of calls in flight to the service.
+            max_message_length: The largest message in bytes sent to and received from the service, see
+                `BackendChannel`.
+        """
+        self.address = address
+        self.max_concurrency = max_concurrency
+        self.channels = [BackendChannel(address, max_message_length) for _ in range(n_channels)]
+        self._next_channel = itertools.cycle(self.channels)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # calls in flight, and calls waiting for a slot
+        self.in_flight = 0
+        self.queued = 0
+        self.healthy = True
+
+    @property
+    def outstanding(
+            self
+    ) -> int:
+        """
+        Returns:
+            The number of calls in flight or waiting for a slot.
+        """
+        return self.in_flight + self.queued
+
+    @contextlib.asynccontextmanager
+    async def slot(
+            self,
+            on_queue_wait: Callable[[float], None] | None = None
+    ) -> AsyncIterator[BackendChannel]:
+        """
+        Waits until fewer than ``max_concurrency`` calls are in flight and reserves a slot for one call.
+
+        Args:
+            on_queue_wait: Called with the time in seconds the call waited for the slot.
+
+        Returns:
+            An async context manager yielding the channel to send the call on.
+        """
+        started = time.perf_counter()
+        self.queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+        if on_queue_wait is not None:
+            on_queue_wait(time.perf_counter() - started)
+        self.in_flight += 1
+        try:
+            yield next(self._next_channel)
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    async def check_health(
+            self,
+            timeout: float
+    ) -> bool:
+        """
+        Sends a health check through every channel of the backend, and updates `healthy`.
+
+        The backend is healthy if the service answers all checks with SERVING within the deadline. Unlike waiting for
+        the connection, this also detects services that accept connections but whose threads are all stuck. Services
+        without the health RPC, which answer with UNIMPLEMENTED, count as healthy.
+
+        Args:
+            timeout: The deadline of the checks in seconds.
+
+        Returns:
+            Whether the backend is healthy.
+        """
+        responses = await asyncio.gather(
+            *(backend_channel.check_health(b"", timeout=timeout) for backend_channel in self.channels),
+            return_exceptions=True
+        )
+        for response in responses:
+            if isinstance(response, BaseException) and not isinstance(response, grpc.aio.AioRpcError):
+                raise response
+        healthy = all(
+            response == HEALTH_SERVING
+            or isinstance(response, grpc.aio.AioRpcError) and response.code() == grpc.StatusCode.UNIMPLEMENTED
+            for response in responses
+        )
+        if healthy != self.healthy:
+            print(f"{self.address} is {'healthy' if healthy else 'unreachable, removed from rotation'}")
+        self.healthy = healthy
+        return healthy
+
+    async def close(
+            self
+    ):
+        """
+        Closes all channels of the backend.
+        """
+        for backend_channel in self.channels:
+            await backend_channel.channel.close()
+
+
+class ReplicaSet:
+    """
+    The replicas of a second level service. Calls go to the healthy replica with the fewest outstanding calls.
+
+    Replicas are removed from rotation when a call fails with UNAVAILABLE or a health check fails, and are put back
+    once a health check succeeds again.
+    """
+
+    def __init__(
+            self,
+            backends: list[Backend]
+    ):
+        """
+        Args:
+            backends: One backend per replica.
+        """
+        assert len(backends) > 0, "A replica set needs at least one backend"
+        self.backends = backends
+
+    @property
+    def healthy_backends(
+            self
+    ) -> list[Backend]:
+        """
+        Returns:
+            The replicas currently in rotation.
+        """
+        return [backend for backend in self.backends if backend.healthy]
+
+    def pick(
+            self,
+            exclude: list[Backend] | None = None
+    ) -> Backend | None:
+        """
+        Picks the replica for the next call.
+
+        If all replicas are out of rotation, the least loaded one is picked anyway, since the health information might
+        be outdated.
+
+        Args:
+            exclude: Replicas that must not be picked, e.g., because the call already failed on them.
+
+        Returns:
+            The healthy replica with the fewest outstanding calls, or None if all replicas are excluded.
+        """
+        candidates = [backend for backend in self.backends if backend not in (exclude or [])]
+        if not candidates:
+            return None
+        healthy = [backend for backend in candidates if backend.healthy]
+        return min(healthy or candidates, key=lambda backend: backend.outstanding)
+
+    async def call(
+            self,
+            function: Callable[[BackendChannel], Awaitable[T]],
+            on_queue_wait: Callable[[float], None] | None = None
+    ) -> T:
+        """
+        Runs a call on the least loaded replica. If the replica is unavailable, it is removed from rotation and the call
+        is retried on the next one, so calls must be idempotent.
+
+        Args:
+            function: Sends the call on the given channel and awaits its result.
+            on_queue_wait: Called with the time in seconds the call waited for a slot of a replica.
+
+        Returns:
+            The result of the call.
+
+        Raises:
+            grpc.aio.AioRpcError: If the call fails on all replicas, or fails with a status other than UNAVAILABLE.
+        """
+        tried = []
+        while True:
+            backend = self.pick(exclude=tried)
+            try:
+                async with backend.slot(on_queue_wait) as backend_channel:
+                    return await function(backend_channel)
+            except grpc.aio.AioRpcError as e:
+                if e.code() != grpc.StatusCode.UNAVAILABLE:
+                    raise
+                if backend.healthy:
+                    print(f"{backend.address} is unavailable, removed from rotation")
+                backend.healthy = False
+                tried.append(backend)
+                if len(tried) == len(self.backends):
+                    raise
+
+    async def run_health_checks(
+            self,
+            interval: float,
+            timeout: float
+    ):
+        """
+        Checks the health of all replicas every `interval` seconds, forever.
+
+        Args:
+            interval: The time in seconds between two checks.
+            timeout: The deadline of the health check of a replica in seconds.
+        """
+        while True:
+            await asyncio.gather(*(backend.check_health(timeout) for backend in self.backends))
+            await asyncio.sleep(interval)
@@ -1,16 +1,22 @@
 import json
-from concurrent.futures import ThreadPoolExecutor
+import signal
 
+import asyncio
 import grpc
 import os
-from argparse import ArgumentParser
+from argparse import ArgumentParser, Namespace
 
+from benchercommon.service import max_message_length, message_length_options
 from bencherscaffold.protoclasses import bencher_pb2_grpc
 
-from bencherserver.server import BencherServer
+from bencherserver.metrics import serve_metrics
+from bencherserver.result_cache import ResultCache
+from bencherserver.server import BencherServer, add_streaming_handlers_to_server
 
 
-def serve():
+def parse_args(
+        argv: list[str] | None = None
+):
     argparse = ArgumentParser()
     argparse.add_argument(
         '-p',
@@ -25,39 +31,214 @@ def serve():
         '--cores',
         type=int,
         required=False,
-        help='The number of CPU cores to use. If None, it will use the maximum number of CPU cores available on the system. Default is cpu_count()',
+        help='The number of threads for blocking work of the router, such as the database of the result cache. The router is asynchronous and does not need a thread per request. Default is cpu_count()',
         default=os.cpu_count()
     )
-    args = argparse.parse_args()
+    argparse.add_argument(
+        '--channels-per-backend',
+        type=int,
+        required=False,
+        help='The number of channels (connections) opened to each benchmark service. Default is 2.',
+        default=2
+    )
+    argparse.add_argument(
+        '--max-concurrency-per-backend',
+        type=int,
+        required=False,
+        help='The maximum number of calls in flight to each benchmark service. Further calls wait in the router. Default is 64.',
+        default=64
+    )
+    argparse.add_argument(
+        '--max-message-length',
+        type=int,
+        required=False,
+        help='The largest message in bytes the router sends and receives, from clients and from the benchmark services, e.g., a packed matrix of points. The services take it from the BENCHER_MAX_MESSAGE_LENGTH environment variable. Default is BENCHER_MAX_MESSAGE_LENGTH or 256 MiB.',
+        default=max_message_length()
+    )
+    argparse.add_argument(
+        '--health-check-interval',
+        type=float,
+        required=False,
+        help='The time in seconds between two health checks of each benchmark service replica. Default is 5.',
+        default=5.0
+    )
+    argparse.add_argument(
+        '--health-check-timeout',
+        type=float,
+        required=False,
+        help='The deadline in seconds of the health check of a benchmark service replica. A replica that does not answer in time is taken out of rotation. Default is 1.',
+        default=1.0
+    )
+    argparse.add_argument(
+        '--metrics-port',
+        type=int,
+        required=False,
+        help='Serve metrics in the Prometheus text format on http://<metrics-host>:<port>/metrics. Default is None (disabled).',
+        default=None
+    )
+    argparse.add_argument(
+        '--metrics-host',
+        type=str,
+        required=False,
+        help='The address to serve the metrics on, e.g., 0.0.0.0 for Prometheus running in another container. Default is 127.0.0.1.',
+        default='127.0.0.1'
+    )
+    argparse.add_argument(
+        '--replicas',
+        action='append',
+        default=[],
+        metavar='PORT=ENDPOINT,...',
+        help='Send the calls of the benchmarks registered on port PORT in benchmark-registry.json to the given replicas instead, each a port or host:port, e.g., 50053=50153,50154. Can be given multiple times. The entrypoint sets it for services started with --replicas.',
+    )
+    argparse.add_argument(
+        '--cache',
+        action='store_true',
+        help='Cache the results of deterministic benchmarks in memory. Default is False.',
+    )
+    argparse.add_argument(
+        '--cache-size',
+        type=int,
+        required=False,
+        help='The maximum number of results kept in memory by the result cache. Default is 100000.',
+        default=100000
+    )
+    argparse.add_argument(
+        '--cache-db',
+        type=str,
+        required=False,
+        help='Path to an SQLite database that persists the result cache across restarts. Implies --cache. Default is None.',
+        default=None
+    )
+    return argparse.parse_args(argv)
+
+
+def parse_replicas(
+        specs: list[str]
+) -> dict[int, list[int | str]]:
+    """
+    Parses `--replicas` options of the form ``PORT=ENDPOINT,...``.
+
+    Args:
+        specs (list[str]): The values of the `--replicas` options.
+
+    Returns:
+        dict[int, list[int | str]]: The replicas of the service on each port of the registry, as ports or ``host:port``.
 
-    bencher_server = BencherServer()
+    Raises:
+        ValueError: If a specification is malformed.
+    """
+    replicas = dict()
+    for spec in specs:
+        port, _, endpoints = spec.partition("=")
+        endpoints = [endpoint.strip() for endpoint in endpoints.split(",") if endpoint.strip()]
+        if not port.isdigit() or not endpoints or not all(
+                endpoint.isdigit() or endpoint.rpartition(":")[2].isdigit() for endpoint in endpoints
+        ):
+            raise ValueError(f"Invalid replicas {spec}, expected PORT=ENDPOINT,... with ENDPOINT a port or host:port")
+        replicas[int(port)] = [int(endpoint) if endpoint.isdigit() else endpoint for endpoint in endpoints]
+    return replicas
 
+
+def apply_replicas(
+        benchmark_names_to_properties: dict[str, dict],
+        replicas: dict[int, list[int | str]]
+) -> dict[str, dict]:
+    """
+    Replaces the port of the benchmarks registered on a port with replicas by the list of replicas.
+
+    Args:
+        benchmark_names_to_properties (dict[str, dict]): The content of benchmark-registry.json.
+        replicas (dict[int, list[int | str]]): The replicas of the service on each port, see `parse_replicas`.
+
+    Returns:
+        dict[str, dict]: The registry with the replicas.
+
+    Raises:
+        ValueError: If no benchmark is registered on a port with replicas.
+    """
+    unknown = set(replicas) - {
+        properties['port'] for properties in benchmark_names_to_properties.values()
+        if not isinstance(properties['port'], list)
+    }
+    if unknown:
+        raise ValueError(f"No benchmark is registered on port(s) {sorted(unknown)}")
+    return {
+        benchmark_name: {**properties, 'port': replicas[properties['port']]}
+        if not isinstance(properties['port'], list) and properties['port'] in replicas else properties
+        for benchmark_name, properties in benchmark_names_to_properties.items()
+    }
+
+
+async def serve_async(
+        args: Namespace
+):
     # load relative to this file
     benchmark_names_to_properties = json.load(
         open(os.path.join(os.path.dirname(__file__), 'benchmark-registry.json'), 'r'),
     )
+    benchmark_names_to_properties = apply_replicas(benchmark_names_to_properties, parse_replicas(args.replicas))
+
+    result_cache = None
+    if args.cache or args.cache_db is not None:
+        uncacheable = {
+            benchmark_name for benchmark_name, properties in benchmark_names_to_properties.items()
+            if properties.get('stochastic', False)
+        }
+        result_cache = ResultCache(args.cache_size, db_path=args.cache_db, uncacheable=uncacheable)
 
-    # structure: {benchmark_name: {port: int, dimensions: int}}
+    bencher_server = BencherServer(
+        n_cores=args.cores,
+        result_cache=result_cache,
+        channels_per_backend=args.channels_per_backend,
+        max_concurrency_per_backend=args.max_concurrency_per_backend,
+        max_message_length=args.max_message_length,
+    )
+
+    # structure: {benchmark_name: {port: int | list[int | str], dimensions: int}}, a list holds one port per replica
     ports_to_benchmarks = dict()
 
     for benchmark_name, properties in benchmark_names_to_properties.items():
         port = properties['port']
+        if isinstance(port, list):
+            port = tuple(port)
         if port not in ports_to_benchmarks:
             ports_to_benchmarks[port] = []
         ports_to_benchmarks[port].append(benchmark_name)
 
     for port, benchmarks in ports_to_benchmarks.items():
         print(f"registering {benchmarks} on port {port}")
-        bencher_server.register_stub(benchmarks, port)
+        bencher_server.register_stub(benchmarks, list(port) if isinstance(port, tuple) else port)
+    bencher_server.start_health_checks(interval=args.health_check_interval, timeout=args.health_check_timeout)
 
     port = str(args.port)
-    n_cores = args.cores
-    server = grpc.server(ThreadPoolExecutor(max_workers=n_cores))
+    server = grpc.aio.server(options=message_length_options(args.max_message_length))
     bencher_pb2_grpc.add_BencherServicer_to_server(bencher_server, server)
+    add_streaming_handlers_to_server(bencher_server, server)
     server.add_insecure_port("[::]:" + port)
-    server.start()
+    await server.start()
     print("Server started, listening on " + port)
-    server.wait_for_termination()
+    metrics_server = None
+    if args.metrics_port is not None:
+        metrics_server = await serve_metrics(bencher_server.metrics_text, args.metrics_port, host=args.metrics_host)
+        print(f"Metrics served on {args.metrics_host}:{args.metrics_port}")
+
+    # docker stops containers with SIGTERM, let calls in flight finish
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, lambda: asyncio.ensure_future(server.stop(grace=5.0)))
+    try:
+        await server.wait_for_termination()
+    finally:
+        if metrics_server is not None:
+            metrics_server.close()
+            await metrics_server.wait_closed()
+        await bencher_server.close()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(signum)
+
+
+def serve():
+    asyncio.run(serve_async(parse_args()))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,277 @@
+import bisect
+import math
+from collections.abc import Callable
+
+import asyncio
+
+# upper bounds of the latency buckets in seconds, from 10us to about 84s, doubling
+LATENCY_BUCKETS = tuple(round(0.00001 * 2 ** i, 5) for i in range(24))
+
+
+class Histogram:
+    """
+    Histogram with fixed buckets. Observing a value costs one binary search, and quantiles are interpolated linearly
+    within the bucket they fall into, like Prometheus' ``histogram_quantile``.
+    """
+
+    def __init__(
+            self,
+            buckets: tuple[float, ...] = LATENCY_BUCKETS
+    ):
+        """
+        Args:
+            buckets: The increasing upper bounds of the buckets. Larger values are counted in an overflow bucket.
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(
+            self,
+            value: float
+    ):
+        """
+        Args:
+            value: The value to count.
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(
+            self,
+            q: float
+    ) -> float:
+        """
+        Args:
+            q: The quantile, between 0 and 1.
+
+        Returns:
+            The estimated quantile, NaN if nothing was observed, or the largest bucket bound if it falls into the
+            overflow bucket.
+        """
+        if self.count == 0:
+            return math.nan
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if cumulative + count >= rank and count > 0:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def summary(
+            self
+    ) -> dict[str, float | None]:
+        """
+        Returns:
+            The mean and the 50th, 95th, and 99th percentile, all None if nothing was observed.
+        """
+        if self.count == 0:
+            return {"mean": None, "p50": None, "p95": None, "p99": None}
+        return {
+            "mean": self.sum / self.count,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class RequestMetrics:
+    """
+    The metrics of one RPC for one benchmark.
+    """
+
+    def __init__(
+            self
+    ):
+        self.requests = 0
+        self.errors = 0
+        # time from receiving a request until the backend answered it
+        self.latency = Histogram()
+        # time a backend call waited for a free slot of the backend
+        self.queue_wait = Histogram()
+
+
+class RouterMetrics:
+    """
+    The metrics of the router, per RPC and benchmark.
+
+    All methods are called from the event loop of the router, so no locking is needed.
+    """
+
+    def __init__(
+            self
+    ):
+        # structure: {(rpc, benchmark_name): RequestMetrics}
+        self.requests: dict[tuple[str, str], RequestMetrics] = {}
+
+    def get(
+            self,
+            rpc: str,
+            benchmark_name: str
+    ) -> RequestMetrics:
+        """
+        Args:
+            rpc: The name of the RPC.
+            benchmark_name: The name of the benchmark.
+
+        Returns:
+            The metrics of the RPC for the benchmark, created on first use.
+        """
+        request_metrics = self.requests.get((rpc, benchmark_name))
+        if request_metrics is None:
+            request_metrics = self.requests[(rpc, benchmark_name)] = RequestMetrics()
+        return request_metrics
+
+    def stats(
+            self
+    ) -> dict[str, dict[str, dict[str, int | dict[str, float | None]]]]:
+        """
+        Returns:
+            For each RPC and benchmark, the request and error counts and summaries of the latency and queue wait in
+            seconds.
+        """
+        stats = dict()
+        for (rpc, benchmark_name), request_metrics in self.requests.items():
+            stats.setdefault(rpc, {})[benchmark_name] = {
+                "requests": request_metrics.requests,
+                "errors": request_metrics.errors,
+                "latency": request_metrics.latency.summary(),
+                "queue_wait": request_metrics.queue_wait.summary(),
+            }
+        return stats
+
+
+def _format_labels(
+        labels: dict[str, str]
+) -> str:
+    escaped = (
+        key + '="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for key, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_histogram(
+        lines: list[str],
+        name: str,
+        labels: dict[str, str],
+        histogram: Histogram
+):
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{_format_labels({**labels, 'le': repr(bound)})} {cumulative}")
+    lines.append(f"{name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {histogram.count}")
+    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum!r}")
+    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+
+
+def prometheus_text(
+        metrics: RouterMetrics,
+        backend_gauges: dict[str, dict[str, float]],
+        cache_stats: dict[str, int] | None = None
+) -> str:
+    """
+    Formats the metrics in the Prometheus text exposition format.
+
+    Args:
+        metrics: The request metrics of the router.
+        backend_gauges: For each backend address, the current values of its gauges (``in_flight``, ``queued``,
+            ``healthy``).
+        cache_stats: The counters of the result cache, or None if it is disabled.
+
+    Returns:
+        The exposition text.
+    """
+    lines = [
+        "# HELP bencher_requests_total Requests received, per RPC and benchmark.",
+        "# TYPE bencher_requests_total counter",
+    ]
+    for (rpc, benchmark_name), request_metrics in metrics.requests.items():
+        lines.append(f"bencher_requests_total{_format_labels({'rpc': rpc, 'benchmark': benchmark_name})} {request_metrics.requests}")
+    lines += [
+        "# HELP bencher_errors_total Requests that failed, per RPC and benchmark.",
+        "# TYPE bencher_errors_total counter",
+    ]
+    for (rpc, benchmark_name), request_metrics in metrics.requests.items():
+        lines.append(f"bencher_errors_total{_format_labels({'rpc': rpc, 'benchmark': benchmark_name})} {request_metrics.errors}")
+    lines += [
+        "# HELP bencher_request_latency_seconds Time from receiving a request until it was answered.",
+        "# TYPE bencher_request_latency_seconds histogram",
+    ]
+    for (rpc, benchmark_name), request_metrics in metrics.requests.items():
+        labels = {'rpc': rpc, 'benchmark': benchmark_name}
+        _format_histogram(lines, "bencher_request_latency_seconds", labels, request_metrics.latency)
+    lines += [
+        "# HELP bencher_queue_wait_seconds Time a call waited for a free slot of its backend.",
+        "# TYPE bencher_queue_wait_seconds histogram",
+    ]
+    for (rpc, benchmark_name), request_metrics in metrics.requests.items():
+        labels = {'rpc': rpc, 'benchmark': benchmark_name}
+        _format_histogram(lines, "bencher_queue_wait_seconds", labels, request_metrics.queue_wait)
+    for gauge, help_text in (
+            ("in_flight", "Calls in flight to the backend."),
+            ("queued", "Calls waiting for a free slot of the backend."),
+            ("healthy", "Whether the backend is in rotation."),
+    ):
+        lines += [f"# HELP bencher_backend_{gauge} {help_text}", f"# TYPE bencher_backend_{gauge} gauge"]
+        for address, gauges in backend_gauges.items():
+            lines.append(f"bencher_backend_{gauge}{_format_labels({'backend': address})} {gauges[gauge]}")
+    if cache_stats is not None:
+        lines += [
+            "# HELP bencher_cache_lookups_total Lookups in the result cache, per outcome.",
+            "# TYPE bencher_cache_lookups_total counter",
+        ]
+        for outcome in ("memory_hits", "disk_hits", "misses", "bypassed"):
+            lines.append(f"bencher_cache_lookups_total{_format_labels({'outcome': outcome})} {cache_stats[outcome]}")
+    return "\n".join(lines) + "\n"
+
+
+async def serve_metrics(
+        render: Callable[[], str],
+        port: int,
+        host: str = "127.0.0.1"
+) -> asyncio.Server:
+    """
+    Serves the metrics over HTTP on ``/metrics``, for Prometheus to scrape.
+
+    Args:
+        render: Returns the current metrics in the Prometheus text exposition format.
+        port: The port to listen on.
+        host: The address to listen on. Default is localhost only.
+
+    Returns:
+        The running asyncio server.
+    """
+
+    async def handle(
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter
+    ):
+        try:
+            request_line = await reader.readline()
+            # skip the headers
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/", "/metrics"):
+                status, body = "200 OK", render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -0,0 +1,224 @@
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def point_key(
+        benchmark_name: str,
+        x: np.ndarray
+) -> bytes:
+    """
+    Computes the canonical key of a point of a benchmark.
+
+    The key is the SHA-256 digest of the benchmark name and the little-endian float64 coordinates, so it does not
+    depend on how the point was encoded on the wire.
+
+    Args:
+        benchmark_name: The name of the benchmark.
+        x: The coordinates of the point.
+
+    Returns:
+        The key.
+    """
+    # adding 0.0 turns -0.0 into 0.0
+    x = np.ascontiguousarray(x, dtype="<f8") + 0.0
+    return hashlib.sha256(benchmark_name.encode("utf-8") + b"\0" + x.tobytes()).digest()
+
+
+class ResultCache:
+    """
+    Thread-safe cache of evaluation results of deterministic benchmarks.
+
+    Results are kept in a bounded in-memory LRU and, if a database path is given, in an SQLite database that persists
+    across restarts. Lookups that miss the memory tier fall back to the database and promote the result to memory.
+    Benchmarks listed as uncacheable (the stochastic ones) always miss and are counted as bypassed.
+    """
+
+    def __init__(
+            self,
+            max_entries: int,
+            db_path: str | None = None,
+            uncacheable: set[str] | None = None
+    ):
+        """
+        Args:
+            max_entries: The maximum number of results in the memory tier.
+            db_path: Path to the SQLite database of the disk tier, or None to keep results in memory only.
+            uncacheable: The names of the benchmarks whose results must never be cached.
+        """
+        self.max_entries = max_entries
+        self.uncacheable = uncacheable or set()
+        self._entries: OrderedDict[bytes, float] = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+        self._db = None
+        if db_path is not None:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results (key BLOB PRIMARY KEY, benchmark TEXT NOT NULL, value REAL NOT NULL)"
+            )
+
+    def is_cacheable(
+            self,
+            benchmark_name: str
+    ) -> bool:
+        """
+        Args:
+            benchmark_name: The name of the benchmark.
+
+        Returns:
+            Whether results of the benchmark may be cached. Counts a bypass if not.
+        """
+        if benchmark_name in self.uncacheable:
+            with self._lock:
+                self.bypassed += 1
+            return False
+        return True
+
+    @property
+    def persistent(
+            self
+    ) -> bool:
+        """
+        Returns:
+            Whether the cache has a disk tier. Its lookups and writes block on SQLite, so async callers should run them
+            in a thread.
+        """
+        return self._db is not None
+
+    def get(
+            self,
+            key: bytes
+    ) -> float | None:
+        """
+        Looks up a result.
+
+        Args:
+            key: The key computed by `point_key`.
+
+        Returns:
+            The cached value, or None on a miss.
+        """
+        return self.get_many([key])[0]
+
+    def get_many(
+            self,
+            keys: list[bytes | None]
+    ) -> list[float | None]:
+        """
+        Looks up many results at once, with one database query for all keys that miss the memory tier.
+
+        Args:
+            keys: The keys computed by `point_key`. None entries are skipped and not counted.
+
+        Returns:
+            The cached value of each key, or None on a miss.
+        """
+        values = [None] * len(keys)
+        with self._lock:
+            # structure: {key: [index, ...]} of the keys that miss the memory tier
+            missing = dict()
+            for i, key in enumerate(keys):
+                if key is None:
+                    continue
+                value = self._entries.get(key)
+                if value is not None:
+                    self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                    values[i] = value
+                else:
+                    missing.setdefault(key, []).append(i)
+            if missing and self._db is not None:
+                found = dict()
+                missing_keys = list(missing)
+                # SQLite limits the number of parameters of a statement
+                for start in range(0, len(missing_keys), 500):
+                    chunk = missing_keys[start:start + 500]
+                    found.update(
+                        self._db.execute(
+                            f"SELECT key, value FROM results WHERE key IN ({', '.join('?' * len(chunk))})", chunk
+                        ).fetchall()
+                    )
+                for key, value in found.items():
+                    self._insert(key, value)
+                    for i in missing.pop(key):
+                        self.disk_hits += 1
+                        values[i] = value
+            self.misses += sum(len(indices) for indices in missing.values())
+        return values
+
+    def put(
+            self,
+            benchmark_name: str,
+            key: bytes,
+            value: float
+    ):
+        """
+        Stores a result in all tiers.
+
+        Args:
+            benchmark_name: The name of the benchmark, stored in the database for inspection.
+            key: The key computed by `point_key`.
+            value: The value of the point.
+        """
+        self.put_many([(benchmark_name, key, value)])
+
+    def put_many(
+            self,
+            results: list[tuple[str, bytes, float]]
+    ):
+        """
+        Stores many results in all tiers, with one database transaction.
+
+        Args:
+            results: The benchmark name, key, and value of each result.
+        """
+        with self._lock:
+            for _, key, value in results:
+                self._insert(key, value)
+            if self._db is not None and results:
+                self._db.execute("BEGIN")
+                try:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO results (key, benchmark, value) VALUES (?, ?, ?)",
+                        [(key, benchmark_name, value) for benchmark_name, key, value in results]
+                    )
+                except BaseException:
+                    self._db.execute("ROLLBACK")
+                    raise
+                self._db.execute("COMMIT")
+
+    def _insert(
+            self,
+            key: bytes,
+            value: float
+    ):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(
+            self
+    ) -> dict[str, int]:
+        """
+        Returns:
+            The hit, miss, and bypass counters and the number of results in memory.
+        """
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "memory_entries": len(self._entries),
+            }
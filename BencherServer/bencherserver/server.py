@@ -1,64 +1,154 @@
+import json
+import time
 import traceback
+from collections.abc import AsyncIterator
+from concurrent.futures import ThreadPoolExecutor
+from typing import NoReturn
 
+import asyncio
 import grpc
+import numpy as np
 import os
 
-from bencherscaffold.protoclasses import second_level_services_pb2_grpc
+from benchercommon.packed import packed_benchmark_name
 from bencherscaffold.protoclasses.bencher_pb2 import BenchmarkRequest, EvaluationResult
 from bencherscaffold.protoclasses.bencher_pb2_grpc import BencherServicer
 
+from bencherserver.backend import Backend, BackendChannel, ReplicaSet
+from bencherserver.metrics import RouterMetrics, prometheus_text
+from bencherserver.result_cache import ResultCache, point_key
+
+async def abort_with_traceback(
+        context: grpc.aio.ServicerContext
+) -> NoReturn:
+    """
+    Fails the current call with status INTERNAL, passing the traceback of the exception being handled as details.
+
+    Args:
+        context: The grpc.aio.ServicerContext object of the incoming request.
+    """
+    await context.abort(grpc.StatusCode.INTERNAL, traceback.format_exc())
+
 
 class BencherServer(BencherServicer):
+    """
+    The router. All RPCs are coroutines served by a ``grpc.aio`` server, so a call waiting on a slow service does not
+    hold a thread.
+    """
 
     def __init__(
             self,
             port: int = 50051,
             n_cores: int | None = None,
-            stubs: dict[str, second_level_services_pb2_grpc.SecondLevelBencherStub] | None = None
+            backends: dict[str, ReplicaSet] | None = None,
+            result_cache: ResultCache | None = None,
+            channels_per_backend: int = 2,
+            max_concurrency_per_backend: int = 64,
+            max_message_length: int | None = None
     ):
         """
         Args:
             port (int): The port number to start the server on. Default is 50051.
-            n_cores (int | None): The number of CPU cores to use. If None, it will use the maximum number of CPU cores available on the system. Default is None.
-            stubs (dict[str, second_level_services_pb2_grpc.SecondLevelBencherStub] | None): A dictionary containing the stubs for second level services. Each key is a string representing the
-        * name of the service, and each value is the corresponding stub object. If None, an empty dictionary will be created. Default is None.
+            n_cores (int | None): The number of threads for blocking work, such as the database of the result cache. The RPCs themselves do not need threads. If None, the number of CPU cores is used. Default is None.
+            backends (dict[str, ReplicaSet] | None): A dictionary mapping each benchmark name to the replicas serving it. If None, an empty dictionary will be created. Default is None.
+            result_cache (ResultCache | None): The cache for results of deterministic benchmarks. If None, every request is forwarded. Default is None.
+            channels_per_backend (int): The number of channels opened to each registered replica. Default is 2.
+            max_concurrency_per_backend (int): The maximum number of calls in flight to each registered replica. Default is 64.
+            max_message_length (int | None): The largest message in bytes sent to and received from the replicas. If None, `benchercommon.service.max_message_length()` is used. Default is None.
         """
-        self.stubs = stubs or {}
+        self.backends = backends or {}
+        self.result_cache = result_cache
+        self.channels_per_backend = channels_per_backend
+        self.max_concurrency_per_backend = max_concurrency_per_backend
+        self.max_message_length = max_message_length
         self.port = port
         self.n_cores = n_cores or os.cpu_count()
+        # threads are only started once blocking work is submitted
+        self.executor = ThreadPoolExecutor(max_workers=self.n_cores, thread_name_prefix="bencher-blocking")
         self.server = None
+        self.health_checks: list[asyncio.Task] = []
+        self.metrics = RouterMetrics()
 
     def register_stub(
             self,
             names: list[str],
-            port: int
+            port: int | str | list[int | str],
+            max_concurrency: int | None = None
     ):
         """
-        Registers a stub for a given list of names and port.
+        Registers the replicas of a service for a given list of names. Must be called inside the event loop of the server.
 
         Args:
-            names (list[str]): A list of names to register the stub.
-            port (int): The port on which the stub is running.
+            names (list[str]): A list of names to register the replicas.
+            port (int | str | list[int | str]): The port on which the service is running, or a list with one port per replica. A replica on another host is given as ``host:port``.
+            max_concurrency (int | None): The maximum number of calls in flight to each replica. If None, `max_concurrency_per_backend` is used. Default is None.
 
         Returns:
             None
         """
-        stub = second_level_services_pb2_grpc.SecondLevelBencherStub(
-            grpc.insecure_channel(f"0.0.0.0:{port}")
+        endpoints = port if isinstance(port, list) else [port]
+        replica_set = ReplicaSet(
+            [
+                Backend(
+                    endpoint if isinstance(endpoint, str) else f"0.0.0.0:{endpoint}",
+                    n_channels=self.channels_per_backend,
+                    max_concurrency=max_concurrency or self.max_concurrency_per_backend,
+                    max_message_length=self.max_message_length,
+                )
+                for endpoint in endpoints
+            ]
         )
         for name in names:
-            assert name not in self.stubs, f"Name {name} already registered"
-            self.stubs[name] = stub
+            assert name not in self.backends, f"Name {name} already registered"
+            self.backends[name] = replica_set
+
+    def start_health_checks(
+            self,
+            interval: float = 5.0,
+            timeout: float = 1.0
+    ):
+        """
+        Starts checking the health of all registered replicas in the background. Must be called inside the event loop
+        of the server.
+
+        Args:
+            interval (float): The time in seconds between two checks of a replica. Default is 5.0.
+            timeout (float): The deadline of the health check of a replica in seconds. Default is 1.0.
+
+        Returns:
+            None
+        """
+        for replica_set in set(self.backends.values()):
+            self.health_checks.append(asyncio.create_task(replica_set.run_health_checks(interval, timeout)))
+
+    async def close(
+            self
+    ):
+        """
+        Stops the health checks, closes the channels to all replicas, and shuts down the blocking threads. Must be
+        called inside the event loop of the server.
+
+        Returns:
+            None
+        """
+        for health_check in self.health_checks:
+            health_check.cancel()
+        await asyncio.gather(*self.health_checks, return_exceptions=True)
+        self.health_checks = []
+        for replica_set in set(self.backends.values()):
+            for backend in replica_set.backends:
+                await backend.close()
+        self.executor.shutdown(wait=False)
 
-    def evaluate_point(
+    async def evaluate_point(
             self,
             request: BenchmarkRequest,
-            context: grpc.ServicerContext | None = None
+            context: grpc.aio.ServicerContext | None = None
     ) -> EvaluationResult:
         """
         Args:
             request: The BenchmarkRequest object containing the details of the benchmark evaluation request.
-            context: The grpc.ServicerContext object representing the context of the evaluation request.
+            context: The grpc.aio.ServicerContext object representing the context of the evaluation request.
 
         Returns:
             An EvaluationResult object representing the result of the evaluation.
@@ -66,16 +156,351 @@ class BencherServer(BencherServicer):
         Raises:
             AssertionError: If the specified benchmark name is not valid.
 
+        """
+        started = time.perf_counter()
+        benchmark_name = request.benchmark.name
+
+        assert benchmark_name in self.backends, f"Invalid benchmark name {benchmark_name}, available: {list(self.backends.keys())}"
+        request_metrics = self.metrics.get('evaluate_point', benchmark_name)
+        request_metrics.requests += 1
+        key = self.cache_key(request)
+        if key is not None:
+            value, = await self.cached_values([key])
+            if value is not None:
+                request_metrics.latency.observe(time.perf_counter() - started)
+                return EvaluationResult(value=value)
+        try:
+            response = await self.backends[benchmark_name].call(
+                lambda backend_channel: backend_channel.stub.evaluate_point(request),
+                on_queue_wait=request_metrics.queue_wait.observe
+            )
+        except grpc.RpcError:
+            request_metrics.errors += 1
+            await abort_with_traceback(context)
+        if key is not None:
+            await self.cache_results([(benchmark_name, key, response.value)])
+        request_metrics.latency.observe(time.perf_counter() - started)
+        return response
+
+    def cache_key(
+            self,
+            request: BenchmarkRequest
+    ) -> bytes | None:
+        """
+        Args:
+            request: The BenchmarkRequest object to look up in the result cache.
+
+        Returns:
+            The key of the request in the result cache, or None if caching is disabled or the benchmark is stochastic.
+        """
+        if self.result_cache is None or not self.result_cache.is_cacheable(request.benchmark.name):
+            return None
+        x = np.fromiter((v.value for v in request.point.values), dtype=np.float64, count=len(request.point.values))
+        return point_key(request.benchmark.name, x)
+
+    async def cached_values(
+            self,
+            keys: list[bytes | None]
+    ) -> list[float | None]:
+        """
+        Looks up results in the result cache. Lookups that may hit the database run on the threads of `executor`, so
+        they do not block the event loop.
+
+        Args:
+            keys: The keys returned by `cache_key`, None for requests that are not cached.
+
+        Returns:
+            The cached value of each key, or None on a miss.
+        """
+        if self.result_cache is None or all(key is None for key in keys):
+            return [None] * len(keys)
+        if self.result_cache.persistent:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, self.result_cache.get_many, keys)
+        return self.result_cache.get_many(keys)
+
+    async def cache_results(
+            self,
+            results: list[tuple[str, bytes, float]]
+    ):
+        """
+        Stores results in the result cache. Writes to the database run on the threads of `executor`, so they do not
+        block the event loop.
+
+        Args:
+            results: The benchmark name, key, and value of each result.
+        """
+        if not results:
+            return
+        if self.result_cache.persistent:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.result_cache.put_many, results)
+        else:
+            self.result_cache.put_many(results)
+
+    async def evaluate_batch(
+            self,
+            request_iterator: AsyncIterator[BenchmarkRequest],
+            context: grpc.aio.ServicerContext | None = None
+    ) -> AsyncIterator[EvaluationResult]:
+        """
+        Evaluates a stream of points and streams back one result per point, in request order.
+
+        The requests are grouped by the service serving their benchmark and each group is split evenly over the
+        healthy replicas of the service. Each part is forwarded as a single streaming call, so a batch costs one round
+        trip per replica instead of one per point, and all calls are in flight concurrently. Requests found in the
+        result cache are not forwarded.
+
+        Args:
+            request_iterator: The BenchmarkRequest objects to evaluate. They may target different benchmarks.
+            context: The grpc.aio.ServicerContext object representing the context of the evaluation request.
+
+        Returns:
+            An async iterator over the EvaluationResult objects, in the same order as the requests.
+
+        Raises:
+            AssertionError: If any of the benchmark names is not valid.
+
+        """
+        started = time.perf_counter()
+        requests = [request async for request in request_iterator]
+        results = [None] * len(requests)
+
+        for request in requests:
+            benchmark_name = request.benchmark.name
+            assert benchmark_name in self.backends, f"Invalid benchmark name {benchmark_name}, available: {list(self.backends.keys())}"
+            self.metrics.get('evaluate_batch', benchmark_name).requests += 1
+        keys = [self.cache_key(request) for request in requests]
+        cached = await self.cached_values(keys)
+
+        # structure: {replica_set: [request_index, ...]}, only for requests that miss the result cache
+        backend_to_indices = dict()
+        for i, request in enumerate(requests):
+            if cached[i] is not None:
+                results[i] = EvaluationResult(value=cached[i])
+                continue
+            backend_to_indices.setdefault(self.backends[request.benchmark.name], []).append(i)
+
+        async def evaluate_batch_on(
+                backend_channel: BackendChannel,
+                indices: list[int]
+        ) -> list[EvaluationResult]:
+            call = backend_channel.evaluate_batch(iter([requests[i] for i in indices]))
+            return [response async for response in call]
+
+        async def forward(
+                replica_set: ReplicaSet,
+                indices: list[int]
+        ):
+            part_metrics = [
+                self.metrics.get('evaluate_batch', benchmark_name)
+                for benchmark_name in {requests[i].benchmark.name for i in indices}
+            ]
+
+            def on_queue_wait(
+                    wait: float
+            ):
+                for request_metrics in part_metrics:
+                    request_metrics.queue_wait.observe(wait)
+
+            try:
+                responses = await replica_set.call(
+                    lambda backend_channel: evaluate_batch_on(backend_channel, indices),
+                    on_queue_wait=on_queue_wait
+                )
+            except grpc.RpcError:
+                for i in indices:
+                    self.metrics.get('evaluate_batch', requests[i].benchmark.name).errors += 1
+                raise
+            for i, response in zip(indices, responses):
+                results[i] = response
+            await self.cache_results(
+                [
+                    (requests[i].benchmark.name, keys[i], response.value)
+                    for i, response in zip(indices, responses) if keys[i] is not None
+                ]
+            )
+
+        try:
+            await asyncio.gather(
+                *(
+                    forward(replica_set, part.tolist())
+                    for replica_set, indices in backend_to_indices.items()
+                    for part in np.array_split(indices, max(1, min(len(replica_set.healthy_backends), len(indices))))
+                )
+            )
+        except grpc.RpcError:
+            await abort_with_traceback(context)
+        # every point of the batch waited for the whole batch
+        latency = time.perf_counter() - started
+        for request in requests:
+            self.metrics.get('evaluate_batch', request.benchmark.name).latency.observe(latency)
+        for result in results:
+            yield result
+
+    async def evaluate_neighbours(
+            self,
+            request: BenchmarkRequest,
+            context: grpc.aio.ServicerContext | None = None
+    ) -> AsyncIterator[EvaluationResult]:
+        """
+        Evaluates all points that differ from the given binary point in exactly one variable.
+
+        Only binary benchmarks whose service implements ``evaluate_neighbours`` (maxsat60 and maxsat125) support this.
+
+        Args:
+            request: The BenchmarkRequest object containing the point whose neighbours are evaluated.
+            context: The grpc.aio.ServicerContext object representing the context of the evaluation request.
+
+        Returns:
+            An async iterator over the EvaluationResult objects, the i-th being the value of the point with variable i flipped.
+
+        Raises:
+            AssertionError: If the specified benchmark name is not valid.
+
         """
         benchmark_name = request.benchmark.name
 
-        assert benchmark_name in self.stubs, f"Invalid benchmark name {benchmark_name}, available: {list(self.stubs.keys())}"
-        stub = self.stubs[benchmark_name]
+        assert benchmark_name in self.backends, f"Invalid benchmark name {benchmark_name}, available: {list(self.backends.keys())}"
+        started = time.perf_counter()
+        request_metrics = self.metrics.get('evaluate_neighbours', benchmark_name)
+        request_metrics.requests += 1
+        # streamed responses cannot be retried on another replica once the first has been sent
+        backend = self.backends[benchmark_name].pick()
         try:
-            response = stub.evaluate_point(request)
-        except grpc.RpcError as e:
-            stack_trace = traceback.format_exc()
-            context.set_details(stack_trace)
-            context.set_code(grpc.StatusCode.INTERNAL)
-            raise e
+            async with backend.slot(request_metrics.queue_wait.observe) as backend_channel:
+                async for response in backend_channel.evaluate_neighbours(request):
+                    yield response
+        except grpc.RpcError:
+            request_metrics.errors += 1
+            await abort_with_traceback(context)
+        request_metrics.latency.observe(time.perf_counter() - started)
+
+    async def evaluate_packed(
+            self,
+            request: bytes,
+            context: grpc.aio.ServicerContext | None = None
+    ) -> bytes:
+        """
+        Evaluates a matrix of points in the packed encoding of `benchercommon.packed`.
+
+        Only the header of the request is read; the request and the response are forwarded unchanged.
+
+        Args:
+            request: The packed request holding the benchmark name and the points, as float64, int64, or bits.
+            context: The grpc.ServicerContext object representing the context of the evaluation request.
+
+        Returns:
+            The packed float64 array with the value of each point.
+
+        Raises:
+            AssertionError: If the specified benchmark name is not valid.
+
+        """
+        started = time.perf_counter()
+        try:
+            benchmark_name = packed_benchmark_name(request)
+        except ValueError as e:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+        assert benchmark_name in self.backends, f"Invalid benchmark name {benchmark_name}, available: {list(self.backends.keys())}"
+        request_metrics = self.metrics.get('evaluate_packed', benchmark_name)
+        request_metrics.requests += 1
+        try:
+            response = await self.backends[benchmark_name].call(
+                lambda backend_channel: backend_channel.evaluate_packed(request),
+                on_queue_wait=request_metrics.queue_wait.observe
+            )
+        except grpc.RpcError:
+            request_metrics.errors += 1
+            await abort_with_traceback(context)
+        request_metrics.latency.observe(time.perf_counter() - started)
         return response
+
+    def backend_gauges(
+            self
+    ) -> dict[str, dict[str, float]]:
+        """
+        Returns:
+            For each replica address, the number of calls in flight and waiting for a slot, and whether it is healthy.
+        """
+        gauges = dict()
+        for replica_set in set(self.backends.values()):
+            for backend in replica_set.backends:
+                gauges[backend.address] = {
+                    "in_flight": backend.in_flight,
+                    "queued": backend.queued,
+                    "healthy": int(backend.healthy),
+                }
+        return gauges
+
+    def metrics_text(
+            self
+    ) -> str:
+        """
+        Returns:
+            All metrics of the router in the Prometheus text exposition format.
+        """
+        cache_stats = self.result_cache.stats() if self.result_cache is not None else None
+        return prometheus_text(self.metrics, self.backend_gauges(), cache_stats)
+
+    async def get_stats(
+            self,
+            request: bytes,
+            context: grpc.aio.ServicerContext | None = None
+    ) -> bytes:
+        """
+        Args:
+            request: Ignored.
+            context: The grpc.aio.ServicerContext object representing the context of the request.
+
+        Returns:
+            UTF-8 encoded JSON with the request and error counts and the latency and queue wait percentiles in seconds,
+            per RPC and benchmark, under ``requests``, the gauges of each replica under ``backends``, and the counters
+            of the result cache under ``cache``, an empty object if the cache is disabled.
+        """
+        stats = {
+            "requests": self.metrics.stats(),
+            "backends": self.backend_gauges(),
+            "cache": self.result_cache.stats() if self.result_cache is not None else {},
+        }
+        return json.dumps(stats).encode("utf-8")
+
+
+def add_streaming_handlers_to_server(
+        bencher_server: BencherServer,
+        server: grpc.aio.Server
+):
+    """
+    Registers the streaming ``evaluate_batch`` and ``evaluate_neighbours`` RPCs, the packed ``evaluate_packed`` RPC, and
+    the ``get_stats`` RPC of the given BencherServer on a grpc server.
+
+    The ``Bencher`` service definition only declares ``evaluate_point``, so these RPCs are added as a generic handler
+    under the same service name, using the existing BenchmarkRequest and EvaluationResult messages, or raw bytes for
+    ``evaluate_packed`` and ``get_stats``.
+
+    Args:
+        bencher_server (BencherServer): The server whose methods handle the calls.
+        server (grpc.aio.Server): The grpc server to register the handler on.
+
+    Returns:
+        None
+    """
+    rpc_method_handlers = {
+        'evaluate_batch': grpc.stream_stream_rpc_method_handler(
+            bencher_server.evaluate_batch,
+            request_deserializer=BenchmarkRequest.FromString,
+            response_serializer=EvaluationResult.SerializeToString,
+        ),
+        'evaluate_neighbours': grpc.unary_stream_rpc_method_handler(
+            bencher_server.evaluate_neighbours,
+            request_deserializer=BenchmarkRequest.FromString,
+            response_serializer=EvaluationResult.SerializeToString,
+        ),
+        'evaluate_packed': grpc.unary_unary_rpc_method_handler(
+            bencher_server.evaluate_packed,
+        ),
+        'get_stats': grpc.unary_unary_rpc_method_handler(
+            bencher_server.get_stats,
+        ),
+    }
+    generic_handler = grpc.method_handlers_generic_handler('Bencher', rpc_method_handlers)
+    server.add_generic_rpc_handlers((generic_handler,))
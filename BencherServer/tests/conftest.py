@@ -0,0 +1,84 @@
+import socket
+import threading
+
+import pytest
+from benchercommon.packed import decode_points, encode_values
+from benchercommon.service import BenchmarkService
+from bencherscaffold.protoclasses.bencher_pb2 import BenchmarkRequest, EvaluationResult
+
+
+class SumService(BenchmarkService):
+    """
+    A benchmark service whose value is the sum of the coordinates. Counts the points it evaluates.
+    """
+
+    def __init__(
+            self,
+            port: int
+    ):
+        super().__init__(port=port, n_cores=4)
+        self.evaluated = 0
+        self._lock = threading.Lock()
+
+    def evaluate_point(
+            self,
+            request,
+            context
+    ):
+        with self._lock:
+            self.evaluated += 1
+        return EvaluationResult(value=sum(v.value for v in request.point.values))
+
+    def evaluate_batch(
+            self,
+            request_iterator,
+            context
+    ):
+        for request in request_iterator:
+            yield self.evaluate_point(request, context)
+
+    def evaluate_packed(
+            self,
+            request,
+            context
+    ):
+        _, x = decode_points(request)
+        with self._lock:
+            self.evaluated += len(x)
+        return encode_values(x.sum(axis=1))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def benchmark_request(
+        name,
+        values
+) -> BenchmarkRequest:
+    return BenchmarkRequest(
+        benchmark={'name': name},
+        point={'values': [{'value': v} for v in values]}
+    )
+
+
+@pytest.fixture
+def sum_services():
+    """
+    Starts SumServices on free ports. Yields a function that starts n services and returns them.
+    """
+    started = []
+
+    def start(
+            n: int = 1
+    ) -> list[SumService]:
+        services = [SumService(free_port()) for _ in range(n)]
+        for service in services:
+            started.append(service.start())
+        return services
+
+    yield start
+    for server in started:
+        server.stop(None)
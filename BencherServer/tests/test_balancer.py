@@ -0,0 +1,120 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import grpc
+
+from bencherserver.backend import Backend, ReplicaSet
+from bencherserver.server import BencherServer
+
+from conftest import benchmark_request, free_port
+
+
+def test_least_loaded_healthy_replica_is_picked():
+    async def run():
+        backends = [Backend(f"127.0.0.1:{free_port()}") for _ in range(3)]
+        replica_set = ReplicaSet(backends)
+        backends[0].in_flight = 2
+        backends[1].in_flight = 1
+        backends[2].in_flight = 0
+        backends[2].healthy = False
+        picked = [replica_set.pick(), replica_set.pick(exclude=[backends[1]])]
+        # all replicas out of rotation: the least loaded one is picked anyway
+        backends[0].healthy = backends[1].healthy = False
+        picked.append(replica_set.pick())
+        for backend in backends:
+            await backend.close()
+        return [backends.index(backend) for backend in picked]
+
+    assert asyncio.run(run()) == [1, 0, 2]
+
+
+def test_health_check_probes_the_service(sum_services):
+    service, = sum_services(1)
+
+    async def run():
+        reachable = Backend(f"127.0.0.1:{service.port}")
+        unreachable = Backend(f"127.0.0.1:{free_port()}")
+        results = [await reachable.check_health(1.0), await unreachable.check_health(1.0)]
+        await reachable.close()
+        await unreachable.close()
+        return results, reachable.healthy, unreachable.healthy
+
+    assert asyncio.run(run()) == ([True, False], True, False)
+
+
+def test_health_check_detects_stuck_services():
+    # accepts connections, but its only thread is stuck
+    released = threading.Event()
+
+    def check(
+            request,
+            context
+    ):
+        released.wait(10)
+        return b"\x08\x01"
+
+    port = free_port()
+    server = grpc.server(ThreadPoolExecutor(max_workers=1))
+    server.add_generic_rpc_handlers(
+        (grpc.method_handlers_generic_handler('grpc.health.v1.Health', {'Check': grpc.unary_unary_rpc_method_handler(check)}),)
+    )
+    server.add_insecure_port(f"127.0.0.1:{port}")
+    server.start()
+
+    async def run():
+        backend = Backend(f"127.0.0.1:{port}", n_channels=1)
+        healthy = await backend.check_health(0.5)
+        await backend.close()
+        return healthy
+
+    try:
+        assert not asyncio.run(run())
+    finally:
+        released.set()
+        server.stop(None)
+
+
+def test_services_without_health_check_are_healthy():
+    port = free_port()
+    server = grpc.server(ThreadPoolExecutor(max_workers=1))
+    server.add_insecure_port(f"127.0.0.1:{port}")
+    server.start()
+
+    async def run():
+        backend = Backend(f"127.0.0.1:{port}", n_channels=1)
+        healthy = await backend.check_health(1.0)
+        await backend.close()
+        return healthy
+
+    try:
+        assert asyncio.run(run())
+    finally:
+        server.stop(None)
+
+
+def test_calls_fail_over_to_healthy_replicas(sum_services):
+    services = sum_services(2)
+    dead_port = free_port()
+
+    async def run():
+        bencher_server = BencherServer()
+        bencher_server.register_stub(['sum'], [f"127.0.0.1:{port}" for port in [dead_port, *(s.port for s in services)]])
+        values = [(await bencher_server.evaluate_point(benchmark_request('sum', [i, 1.0]))).value for i in range(4)]
+        healthy = [backend.healthy for backend in bencher_server.backends['sum'].backends]
+
+        async def requests():
+            for i in range(10):
+                yield benchmark_request('sum', [i])
+
+        batch = [result.value async for result in bencher_server.evaluate_batch(requests())]
+        return values, healthy, batch
+
+    values, healthy, batch = asyncio.run(run())
+    assert values == [1.0, 2.0, 3.0, 4.0]
+    # the dead replica was taken out of rotation by the first call
+    assert healthy == [False, True, True]
+    assert batch == [float(i) for i in range(10)]
+    # the batch was split over both live replicas
+    assert all(service.evaluated > 0 for service in services)
+    assert sum(service.evaluated for service in services) == 14
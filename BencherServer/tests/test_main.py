@@ -0,0 +1,85 @@
+import asyncio
+import os
+import signal
+import urllib.request
+
+import grpc
+import pytest
+from bencherscaffold.protoclasses.bencher_pb2_grpc import BencherStub
+
+from bencherserver.main import apply_replicas, parse_args, parse_replicas, serve_async
+
+from conftest import benchmark_request, free_port
+
+
+def test_metrics_server_is_closed_on_shutdown():
+    port = free_port()
+    metrics_port = free_port()
+    args = parse_args(['--port', str(port), '--metrics-port', str(metrics_port), '--metrics-host', '127.0.0.1'])
+
+    def scrape() -> str:
+        with urllib.request.urlopen(f"http://127.0.0.1:{metrics_port}/metrics", timeout=5) as response:
+            return response.read().decode("utf-8")
+
+    async def run():
+        serving = asyncio.create_task(serve_async(args))
+        for _ in range(100):
+            try:
+                metrics = await asyncio.to_thread(scrape)
+                break
+            except OSError:
+                await asyncio.sleep(0.05)
+        else:
+            raise AssertionError("metrics are not served")
+        os.kill(os.getpid(), signal.SIGTERM)
+        await asyncio.wait_for(serving, 10)
+        return metrics
+
+    assert "# TYPE bencher_requests_total counter" in asyncio.run(run())
+    with pytest.raises(OSError):
+        scrape()
+
+
+def test_parse_and_apply_replicas():
+    replicas = parse_replicas(['50053=50153,50154', '50054=remote:50054'])
+    assert replicas == {50053: [50153, 50154], 50054: ['remote:50054']}
+    registry = {
+        'lasso-dna': {'port': 50053, 'dimensions': 180},
+        'mopta08': {'port': 50054, 'dimensions': 124},
+        'maxsat60': {'port': 50055, 'dimensions': 60},
+    }
+    assert apply_replicas(registry, replicas) == {
+        'lasso-dna': {'port': [50153, 50154], 'dimensions': 180},
+        'mopta08': {'port': ['remote:50054'], 'dimensions': 124},
+        'maxsat60': {'port': 50055, 'dimensions': 60},
+    }
+    with pytest.raises(ValueError, match="No benchmark is registered"):
+        apply_replicas(registry, {50099: [50199]})
+    for spec in ['50053', '50053=', 'lasso=50153', '50053=50153,host:', '50053=host']:
+        with pytest.raises(ValueError, match="Invalid replicas"):
+            parse_replicas([spec])
+
+
+def test_replicas_get_the_calls(sum_services):
+    services = sum_services(2)
+    port = free_port()
+    args = parse_args(['--port', str(port), '--replicas', f"50054={services[0].port},{services[1].port}"])
+
+    async def run():
+        serving = asyncio.create_task(serve_async(args))
+        try:
+            async with grpc.aio.insecure_channel(f"127.0.0.1:{port}") as channel:
+                await asyncio.wait_for(channel.channel_ready(), 10)
+                stub = BencherStub(channel)
+                # pestcontrol is registered on port 50054
+                return await asyncio.gather(
+                    *[stub.evaluate_point(benchmark_request('pestcontrol', [i, 1.0])) for i in range(20)]
+                )
+        finally:
+            os.kill(os.getpid(), signal.SIGTERM)
+            await asyncio.wait_for(serving, 10)
+
+    results = asyncio.run(run())
+    assert [result.value for result in results] == [i + 1.0 for i in range(20)]
+    assert services[0].evaluated > 0 and services[1].evaluated > 0
+    assert services[0].evaluated + services[1].evaluated == 20
@@ -0,0 +1,40 @@
+import numpy as np
+
+from bencherserver.result_cache import ResultCache, point_key
+
+
+def test_point_key():
+    assert point_key("a", np.array([0.0, 1.0])) == point_key("a", np.array([-0.0, 1]))
+    assert point_key("a", np.array([0.0, 1.0])) != point_key("b", np.array([0.0, 1.0]))
+
+
+def test_memory_tier_is_bounded():
+    cache = ResultCache(2)
+    keys = [point_key("a", np.array([i])) for i in range(3)]
+    cache.put_many([("a", key, float(i)) for i, key in enumerate(keys)])
+    assert cache.get_many(keys + [None]) == [None, 1.0, 2.0, None]
+    assert cache.stats() == {"memory_hits": 2, "disk_hits": 0, "misses": 1, "bypassed": 0, "memory_entries": 2}
+
+
+def test_database_survives_restarts(tmp_path):
+    db_path = str(tmp_path / "results.sqlite")
+    keys = [point_key("a", np.array([i])) for i in range(1200)]
+    cache = ResultCache(10, db_path=db_path)
+    assert cache.persistent
+    cache.put_many([("a", key, float(i)) for i, key in enumerate(keys)])
+    cache.put("a", keys[0], -1.0)
+
+    restarted = ResultCache(2000, db_path=db_path)
+    # more keys than one query looks up, and a missing key
+    missing = point_key("a", np.array([-1]))
+    assert restarted.get_many(keys + [missing]) == [-1.0] + [float(i) for i in range(1, 1200)] + [None]
+    assert restarted.get(keys[-1]) == 1199.0
+    stats = restarted.stats()
+    assert (stats["disk_hits"], stats["memory_hits"], stats["misses"]) == (1200, 1, 1)
+
+
+def test_uncacheable_benchmarks_are_bypassed():
+    cache = ResultCache(10, uncacheable={"noisy"})
+    assert not cache.is_cacheable("noisy")
+    assert cache.is_cacheable("a")
+    assert cache.stats()["bypassed"] == 1
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import threading
+
+import grpc
+import numpy as np
+from benchercommon.packed import decode_values, encode_points
+from benchercommon.service import message_length_options
+
+from bencherserver.result_cache import ResultCache
+from bencherserver.server import BencherServer, add_streaming_handlers_to_server
+
+from conftest import benchmark_request, free_port
+
+
+class RecordingResultCache(ResultCache):
+    """
+    Records the threads the database is used from.
+    """
+
+    def __init__(
+            self,
+            *args,
+            **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        self.threads = set()
+
+    def get_many(
+            self,
+            keys
+    ):
+        self.threads.add(threading.current_thread().name)
+        return super().get_many(keys)
+
+    def put_many(
+            self,
+            results
+    ):
+        self.threads.add(threading.current_thread().name)
+        return super().put_many(results)
+
+
+def test_database_is_used_outside_the_event_loop(sum_services, tmp_path):
+    service, = sum_services(1)
+    result_cache = RecordingResultCache(100, db_path=str(tmp_path / "results.sqlite"))
+
+    async def run():
+        bencher_server = BencherServer(n_cores=2, result_cache=result_cache)
+        bencher_server.register_stub(['sum'], f"127.0.0.1:{service.port}")
+        first = await bencher_server.evaluate_point(benchmark_request('sum', [1.0, 2.0]))
+        second = await bencher_server.evaluate_point(benchmark_request('sum', [1.0, 2.0]))
+
+        async def requests():
+            for values in [[1.0, 2.0], [3.0], [4.0, 5.0]]:
+                yield benchmark_request('sum', values)
+
+        batch = [result.value async for result in bencher_server.evaluate_batch(requests())]
+        stats = json.loads(await bencher_server.get_stats(b""))
+        return threading.current_thread().name, first.value, second.value, batch, stats
+
+    loop_thread, first, second, batch, stats = asyncio.run(run())
+    assert (first, second, batch) == (3.0, 3.0, [3.0, 3.0, 9.0])
+    # the point of the first call was evaluated once, the others were looked up
+    assert service.evaluated == 3
+    assert loop_thread not in result_cache.threads
+    # the threads of the router's pool of --cores threads
+    assert all(name.startswith("bencher-blocking") for name in result_cache.threads)
+    assert stats["cache"]["memory_hits"] == 2
+    assert stats["requests"]["evaluate_point"]["sum"]["requests"] == 2
+
+
+def test_stats_without_cache(sum_services):
+    async def run():
+        return json.loads(await BencherServer().get_stats(b""))
+
+    assert asyncio.run(run())["cache"] == {}
+
+
+def test_packed_matrix_larger_than_grpc_default(sum_services):
+    service, = sum_services(1)
+    # requests and responses of more than gRPC's default limit of 4 MB
+    x = np.random.default_rng(0).uniform(size=(700_000, 1))
+    request = encode_points('sum', x)
+    assert len(request) > 4 * 1024 * 1024
+
+    async def run():
+        bencher_server = BencherServer(n_cores=1)
+        bencher_server.register_stub(['sum'], f"127.0.0.1:{service.port}")
+        server = grpc.aio.server(options=message_length_options())
+        add_streaming_handlers_to_server(bencher_server, server)
+        port = free_port()
+        server.add_insecure_port(f"127.0.0.1:{port}")
+        await server.start()
+        try:
+            async with grpc.aio.insecure_channel(f"127.0.0.1:{port}", options=message_length_options()) as channel:
+                return await channel.unary_unary('/Bencher/evaluate_packed')(request)
+        finally:
+            await server.stop(None)
+            await bencher_server.close()
+
+    np.testing.assert_array_equal(decode_values(asyncio.run(run())), x[:, 0])
+    assert service.evaluated == len(x)
@@ -1,71 +1,234 @@
 import logging
+import multiprocessing
+import os
+from argparse import ArgumentParser
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional
 
+import grpc
 import numpy as np
+from benchercommon.packed import decode_points, encode_values
+from benchercommon.service import BenchmarkService, WorkerPool
 from bencherscaffold.protoclasses.bencher_pb2 import EvaluationResult, BenchmarkRequest
-from bencherscaffold.protoclasses.grcp_service import GRCPService
 from ebo.test_functions.push_function import PushReward
 from ebo.test_functions.rover_function import create_large_domain
 from ebo.test_functions.rover_utils import RoverDomain
 
+from ebobenchmarks.rover import RoverBatch
 
-def eval_lasso(
-        x: np.ndarray,
-        benchmark
+
+def l2cost(
+        x,
+        point
 ):
-    return benchmark.evaluate(x)
+    return 10 * np.linalg.norm(x - point, 1)
+
+
+def create_rover_domain() -> RoverDomain:
+    return create_large_domain(
+        force_start=False,
+        force_goal=False,
+        start_miss_cost=l2cost,
+        goal_miss_cost=l2cost,
+    )
+
+
+# simulators of the current worker process, set by `_init_worker`. They hold state and are not thread-safe, so every
+# worker has its own.
+_worker_push_reward: Optional[PushReward] = None
+_worker_rover: Optional[RoverBatch] = None
+
+
+def _init_worker():
+    global _worker_push_reward, _worker_rover
+    _worker_push_reward = PushReward()
+    _worker_rover = RoverBatch(create_rover_domain())
+
+
+def _robotpushing_rewards(
+        x: np.ndarray
+) -> np.ndarray:
+    """
+    :param x: Matrix of shape (batch, 14) in [0, 1] space.
+    :return: Array of shape (batch,) with the negative reward of each point.
+    """
+    lb = np.array(_worker_push_reward.xmin)
+    ub = np.array(_worker_push_reward.xmax)
+    # x is in [0, 1] space, so we need to scale it to the domain
+    x = lb + (ub - lb) * x
+    return np.array([-_worker_push_reward(row) for row in x])
 
 
-class EboServiceServicer(GRCPService):
+def _rover_rewards(
+        x: np.ndarray
+) -> np.ndarray:
+    """
+    :param x: Matrix of shape (batch, 60), the bounds of the rover are [0, 1] so no scaling is needed.
+    :return: Array of shape (batch,) with the cost of each trajectory.
+    """
+    return -_worker_rover(x)
+
+
+class EboServiceServicer(BenchmarkService):
 
     def __init__(
-            self
+            self,
+            port: int = 50056,
+            n_workers: int = os.cpu_count()
     ):
-        super().__init__(port=50056, n_cores=1)
-        self._pr = PushReward()
-
-        def l2cost(
-                x,
-                point
-        ):
-            return 10 * np.linalg.norm(x - point, 1)
-
-        domain: RoverDomain = create_large_domain(
-            force_start=False,
-            force_goal=False,
-            start_miss_cost=l2cost,
-            goal_miss_cost=l2cost,
+        """
+        :param port: The port number to start the service on.
+        :param n_workers: The number of worker processes evaluating points. Each worker holds its own `PushReward` and
+            rover domain. If a worker dies, e.g., from a crash of Box2D, all workers are started again and the lost
+            evaluations are rerun.
+        """
+        super().__init__(port=port, n_cores=n_workers)
+        self.n_workers = n_workers
+        # spawn instead of fork since the workers must not inherit the gRPC threads of the server
+        self.workers = WorkerPool(
+            lambda: ProcessPoolExecutor(
+                max_workers=n_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
         )
-        self._domain = domain
+        self.workers.executor()
+
+    def close(
+            self
+    ):
+        """
+        Stops the worker processes. Called by `serve` when the server terminates, including on SIGTERM.
+        """
+        self.workers.shutdown()
+
+    def submit(
+            self,
+            benchmark_name: str,
+            x: np.ndarray
+    ) -> Callable[[], np.ndarray]:
+        """
+        Submits the evaluation of all rows of a matrix to the worker processes.
+
+        Robot pushing points get one task each. Rover points are split into one chunk per worker, and each worker
+        evaluates the trajectories of its chunk together.
+
+        :param benchmark_name: The name of the benchmark, "robotpushing" or "rover".
+        :param x: Matrix of shape (n_points, dimension) in [0, 1] space.
+        :return: A function that waits for the evaluations and returns the array of shape (n_points,) with the values.
+        """
+        assert benchmark_name in ['robotpushing', 'rover'], "Invalid benchmark name"
+        if len(x) == 0:
+            return lambda: np.zeros(0)
+        if benchmark_name == 'robotpushing':
+            assert x.shape[1] == 14, "Invalid input shape"
+            results = [self.workers.submit(_robotpushing_rewards, x[i:i + 1]) for i in range(len(x))]
+        else:
+            assert x.shape[1] == 60, "Invalid input shape"
+            results = [
+                self.workers.submit(_rover_rewards, x[chunk])
+                for chunk in np.array_split(np.arange(len(x)), min(self.n_workers, len(x)))
+            ]
+        return lambda: np.concatenate([result() for result in results])
 
     def evaluate_point(
             self,
             request: BenchmarkRequest,
             context
     ) -> EvaluationResult:
-        assert request.benchmark.name in ['robotpushing', 'rover'], "Invalid benchmark name"
         x = [v.value for v in request.point.values]
-        x = np.array(x).squeeze()
-
-        if request.benchmark.name == 'robotpushing':
-            lb = np.array(self._pr.xmin)
-            ub = np.array(self._pr.xmax)
-            # x is in [0, 1] space, so we need to scale it to the domain
-            x = lb + (ub - lb) * x
-            assert x.shape[0] == 14, "Invalid input shape"
-            rewards = -self._pr(x)
-        else:
-            # bounds are [0, 1] for the rover, so we don't need to scale
-            assert x.shape[0] == 60, "Invalid input shape"
-            rewards = -self._domain(x)
+        x = np.array(x)
         result = EvaluationResult(
-            value=rewards
+            value=self.evaluate_array(request.benchmark.name, x)
         )
         return result
 
+    def evaluate_array(
+            self,
+            benchmark_name: str,
+            x: np.ndarray
+    ) -> float:
+        """
+        Evaluates a single point given as an array in [0, 1] space.
+        """
+        return float(self.submit(benchmark_name, x.reshape(1, -1))()[0])
+
+    def evaluate_batch(
+            self,
+            request_iterator: Iterator[BenchmarkRequest],
+            context
+    ) -> Iterator[EvaluationResult]:
+        """
+        Evaluates a stream of points and streams back one result per point, in request order.
+
+        The points of all requests are submitted to the worker processes before the first result is awaited, and the
+        rover trajectories of each dimension are evaluated in batches.
+        """
+        requests = list(request_iterator)
+        values = np.zeros(len(requests))
+
+        # structure: {(benchmark_name, dimension): [request_index, ...]}
+        benchmark_to_indices = dict()
+        for i, request in enumerate(requests):
+            key = (request.benchmark.name, len(request.point.values))
+            benchmark_to_indices.setdefault(key, []).append(i)
+
+        pending = [
+            (
+                indices,
+                self.submit(
+                    benchmark_name,
+                    np.array([[v.value for v in requests[i].point.values] for i in indices])
+                )
+            )
+            for (benchmark_name, _), indices in benchmark_to_indices.items()
+        ]
+        for indices, result in pending:
+            values[indices] = result()
+
+        for value in values:
+            yield EvaluationResult(
+                value=value
+            )
+
+    def evaluate_packed(
+            self,
+            request: bytes,
+            context
+    ) -> bytes:
+        """
+        Evaluates the points of a packed request (see `benchercommon.packed`) on the worker processes.
+        """
+        try:
+            benchmark_name, x = decode_points(request)
+        except ValueError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+        return encode_values(self.submit(benchmark_name, x)())
+
 
 def serve():
+    argparse = ArgumentParser()
+    argparse.add_argument(
+        '-p',
+        '--port',
+        type=int,
+        required=False,
+        help='The port number to start the service on. Default is 50056.',
+        default=50056
+    )
+    argparse.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        required=False,
+        help='The number of worker processes evaluating points. Default is cpu_count()',
+        default=os.cpu_count()
+    )
+    args = argparse.parse_args()
+
     logging.basicConfig()
-    ebo = EboServiceServicer()
+    ebo = EboServiceServicer(port=args.port, n_workers=args.workers)
     ebo.serve()
 
 
@@ -0,0 +1,252 @@
+import logging
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+import scipy.interpolate as si
+from ebo.test_functions.rover_utils import RoverDomain
+
+
+class BoxIndex:
+    """
+    Tests which points lie in a union of axis-aligned boxes ``[low, high)``, like `AABoxes` of the rover domain, but
+    only compares each point with the boxes overlapping its cell of a uniform grid instead of with all boxes.
+
+    Rounding is monotonic, so a point inside a box always falls into one of the cells the box is registered in, and the
+    result is exactly the one of the full comparison.
+    """
+
+    def __init__(
+            self,
+            lows: np.ndarray,
+            highs: np.ndarray
+    ):
+        """
+        :param lows: Matrix of shape (n_boxes, dimension) with the lower corner of each box.
+        :param highs: Matrix of shape (n_boxes, dimension) with the upper corner of each box.
+        """
+        lows = np.atleast_2d(np.asarray(lows, dtype=np.float64))
+        highs = np.atleast_2d(np.asarray(highs, dtype=np.float64))
+        n_boxes, dimension = lows.shape
+        self.origin = lows.min(axis=0)
+        self.end = highs.max(axis=0)
+        # cells about half as wide as boxes spread evenly, which keeps the number of candidates per cell small
+        self.n_cells = np.full(dimension, max(1, int(round(2 * n_boxes ** (1 / dimension)))))
+        self.cell_size = np.maximum((self.end - self.origin) / self.n_cells, np.finfo(np.float64).tiny)
+
+        first_cells = self._cells(lows)
+        last_cells = self._cells(highs)
+        cell_boxes = [[] for _ in range(int(np.prod(self.n_cells)))]
+        for box, (first, last) in enumerate(zip(first_cells, last_cells)):
+            ranges = np.meshgrid(*[np.arange(f, l + 1) for f, l in zip(first, last)], indexing='ij')
+            for cell in np.ravel_multi_index([r.ravel() for r in ranges], self.n_cells):
+                cell_boxes[cell].append(box)
+        max_boxes = max(len(boxes) for boxes in cell_boxes)
+        # unused slots point to an empty box after the real ones
+        candidates = np.full((len(cell_boxes), max(1, max_boxes)), n_boxes)
+        for cell, boxes in enumerate(cell_boxes):
+            candidates[cell, :len(boxes)] = boxes
+        lows = np.vstack([lows, np.full(dimension, np.inf)])
+        highs = np.vstack([highs, np.full(dimension, -np.inf)])
+        # one matrix of shape (n_cells, max_boxes) per dimension, with the bounds of the candidates of each cell
+        self.cell_lows = [np.ascontiguousarray(lows[candidates, d]) for d in range(dimension)]
+        self.cell_highs = [np.ascontiguousarray(highs[candidates, d]) for d in range(dimension)]
+
+    def _cells(
+            self,
+            X: np.ndarray
+    ) -> np.ndarray:
+        cells = np.floor((X - self.origin) / self.cell_size).astype(np.int64)
+        return np.clip(cells, 0, self.n_cells - 1)
+
+    def contains(
+            self,
+            X: np.ndarray
+    ) -> np.ndarray:
+        """
+        :param X: Matrix of shape (n_points, dimension).
+        :return: Boolean array of shape (n_points,), True for the points inside at least one box.
+        """
+        cells = np.ravel_multi_index(self._cells(X).T, self.n_cells)
+        inside = np.ones((len(X), self.cell_lows[0].shape[1]), dtype=bool)
+        for d, (cell_lows, cell_highs) in enumerate(zip(self.cell_lows, self.cell_highs)):
+            x = X[:, d, np.newaxis]
+            inside &= (cell_lows[cells] <= x) & (cell_highs[cells] > x)
+        return inside.any(axis=1)
+
+
+def compile_geometry(
+        geometry
+) -> Optional[Callable[[np.ndarray], np.ndarray]]:
+    """
+    Builds a faster equivalent of the `contains` method of a geometry of the rover domain.
+
+    :param geometry: An `AABoxes`, `NegGeom`, or `UnionGeom` of `ebo.test_functions.rover_function`.
+    :return: A function mapping a matrix of points to a boolean array of shape (n_points,), or None if the geometry
+        contains other types.
+    """
+    kind = type(geometry).__name__
+    if kind == 'AABoxes':
+        return BoxIndex(geometry.l, geometry.h).contains
+    if kind == 'NegGeom':
+        inner = compile_geometry(geometry.geom)
+        return None if inner is None else lambda X: ~inner(X)
+    if kind == 'UnionGeom':
+        parts = [compile_geometry(part) for part in geometry.geoms]
+        if any(part is None for part in parts):
+            return None
+        return lambda X: np.logical_or.reduce([part(X) for part in parts])
+    return None
+
+
+def compile_cost(
+        cost_fn
+) -> Optional[Callable[[np.ndarray], np.ndarray]]:
+    """
+    Builds a faster equivalent of the cost function of the rover domain.
+
+    :param cost_fn: An `AdditiveCosts`, `ConstObstacleCost`, or `ConstCost` of `ebo.test_functions.rover_function`.
+    :return: A function mapping a matrix of points to the array of shape (n_points,) with their costs, or None if the
+        cost function contains other types.
+    """
+    kind = type(cost_fn).__name__
+    if kind == 'AdditiveCosts':
+        parts = [compile_cost(part) for part in cost_fn.fns]
+        if any(part is None for part in parts):
+            return None
+        return lambda X: np.sum([part(X) for part in parts], axis=0)
+    if kind == 'ConstObstacleCost':
+        contains = compile_geometry(cost_fn.geom)
+        return None if contains is None else lambda X: cost_fn.c * contains(X)
+    if kind == 'ConstCost':
+        return lambda X: np.full(len(X), float(cost_fn.c))
+    return None
+
+
+def _box_corners(
+        node
+) -> List[np.ndarray]:
+    if hasattr(node, 'l') and hasattr(node, 'h'):
+        return [np.atleast_2d(node.l), np.atleast_2d(node.h)]
+    children = list(getattr(node, 'fns', [])) + list(getattr(node, 'geoms', [])) + [getattr(node, 'geom', None)]
+    return [corners for child in children if child is not None for corners in _box_corners(child)]
+
+
+class RoverBatch:
+    """
+    Evaluates many rover trajectories at once, with the same result as calling the `RoverDomain` on each of them.
+
+    The splines are still fit one by one by the domain, but the points on all trajectories are computed with one matrix
+    product per knot vector, and their costs and the trapezoidal integrals along the trajectories are computed for
+    all trajectories together. The obstacle map is tested through a grid index of its boxes instead of against every
+    box. If the cost function of the domain has an unknown structure, or the compiled one disagrees with it, the
+    domain's own cost function is used for each trajectory.
+    """
+
+    def __init__(
+            self,
+            domain: RoverDomain,
+            n_samples: int = 1000,
+            max_cached_bases: int = 64
+    ):
+        """
+        :param domain: The rover domain. Its trajectory and random state are used, so it must not be used by other
+            threads at the same time.
+        :param n_samples: The number of points per trajectory, like the `n_samples` of `RoverDomain.__call__`.
+        :param max_cached_bases: The number of knot vectors whose B-spline basis matrices are kept.
+        """
+        self.domain = domain
+        self.t = np.linspace(0, 1.0, n_samples, endpoint=True)
+        self.max_cached_bases = max_cached_bases
+        # structure: {(knot vector as bytes, n_coefficients, k): matrix of shape (n_samples, n_coefficients)}
+        self._bases: OrderedDict[Tuple[bytes, int, int], np.ndarray] = OrderedDict()
+        self.cost = compile_cost(domain.cost_fn)
+        if self.cost is not None and not self._check_cost():
+            logging.warning(
+                "The compiled rover cost differs from the domain's, falling back to the domain's cost function"
+            )
+            self.cost = None
+
+    def _check_cost(
+            self
+    ) -> bool:
+        low, high = np.asarray(self.domain.s_range, dtype=np.float64)
+        points = np.concatenate(
+            [np.random.RandomState(0).uniform(low - 0.1, high + 0.1, size=(10000, len(low)))]
+            # the corners of the boxes, where the comparisons flip
+            + _box_corners(self.domain.cost_fn)
+        )
+        return bool(np.array_equal(self.cost(points), np.asarray(self.domain.cost_fn(points)).reshape(-1)))
+
+    def _basis(
+            self,
+            knots: np.ndarray,
+            n_coefficients: int,
+            k: int
+    ) -> np.ndarray:
+        key = (knots.tobytes(), n_coefficients, k)
+        basis = self._bases.get(key)
+        if basis is None:
+            # the i-th column is the spline with only the i-th coefficient set
+            basis = np.stack(
+                [si.splev(self.t, (knots, unit, k)) for unit in np.eye(n_coefficients)],
+                axis=1
+            )
+            self._bases[key] = basis
+            while len(self._bases) > self.max_cached_bases:
+                self._bases.popitem(last=False)
+        else:
+            self._bases.move_to_end(key)
+        return basis
+
+    def trajectory_points(
+            self,
+            x: np.ndarray
+    ) -> np.ndarray:
+        """
+        Fits the spline of each trajectory and computes the points on it.
+
+        :param x: Matrix of shape (batch, 60) with one trajectory per row.
+        :return: Array of shape (batch, n_samples, 2) with the points on each trajectory.
+        """
+        # structure: {(knot vector as bytes, n_coefficients, k): [(row, knots, coefficients), ...]}
+        groups = dict()
+        for i, params in enumerate(x):
+            # adds the same noise and forces the same start and goal as `RoverDomain.__call__`
+            self.domain.set_params(params)
+            knots, coefficients, k = self.domain.traj.tck
+            coefficients = np.array(coefficients, dtype=np.float64).T
+            groups.setdefault((knots.tobytes(), len(coefficients), k), []).append((i, knots, coefficients))
+
+        points = np.empty((len(x), len(self.t), self.domain.start.shape[0]))
+        for (_, n_coefficients, k), members in groups.items():
+            rows = [row for row, _, _ in members]
+            basis = self._basis(members[0][1], n_coefficients, k)
+            points[rows] = basis @ np.stack([coefficients for _, _, coefficients in members])
+        return points
+
+    def __call__(
+            self,
+            x: np.ndarray
+    ) -> np.ndarray:
+        """
+        :param x: Matrix of shape (batch, 60) with one trajectory per row.
+        :return: Array of shape (batch,) with the negative cost of each trajectory, like `RoverDomain.__call__`.
+        """
+        points = self.trajectory_points(x)
+        batch_size, n_samples, dimension = points.shape
+        if self.cost is not None:
+            costs = self.cost(points.reshape(-1, dimension)).reshape(batch_size, n_samples)
+        else:
+            costs = np.stack([np.asarray(self.domain.cost_fn(p)).reshape(-1) for p in points])
+
+        # trapezoidal integral of the cost along each trajectory
+        avg_cost = 0.5 * (costs[:, :-1] + costs[:, 1:])
+        lengths = np.linalg.norm(points[:, 1:] - points[:, :-1], axis=2)
+        total_cost = np.sum(lengths * avg_cost, axis=1)
+
+        if not self.domain.force_start:
+            total_cost += [self.domain.start_miss_cost(p[0], self.domain.start) for p in points]
+        if not self.domain.force_goal:
+            total_cost += [self.domain.goal_miss_cost(p[-1], self.domain.goal) for p in points]
+        return -total_cost
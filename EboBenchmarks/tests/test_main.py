@@ -0,0 +1,17 @@
+import numpy as np
+
+from ebobenchmarks.main import EboServiceServicer
+
+
+def test_workers_are_restarted_when_one_dies():
+    service = EboServiceServicer(port=0, n_workers=2)
+    x = np.random.RandomState(0).uniform(size=(4, 60))
+    try:
+        assert service.submit('rover', x)().shape == (4,)
+        for process in list(service.workers.executor()._processes.values()):
+            process.kill()
+        values = service.submit('rover', x)()
+        assert values.shape == (4,) and np.all(np.isfinite(values))
+        assert service.workers.restarts == 1
+    finally:
+        service.workers.shutdown()
@@ -0,0 +1,34 @@
+import logging
+
+import numpy as np
+import pytest
+
+from ebobenchmarks.main import create_rover_domain
+from ebobenchmarks.rover import RoverBatch
+
+
+def seeded_domain(
+        seed: int
+):
+    domain = create_rover_domain()
+    # the noise that `RoverDomain.set_params` adds to the trajectory
+    domain.rnd_stream = np.random.RandomState(seed)
+    return domain
+
+
+@pytest.mark.parametrize("compiled_cost", [True, False])
+def test_rover_batch_matches_rover_domain(compiled_cost, caplog):
+    x = np.random.RandomState(1).uniform(size=(16, 60))
+    # trajectories leaving the domain and revisiting the same knots
+    x[:4] = np.random.RandomState(2).uniform(-0.2, 1.2, size=(4, 60))
+    x[4] = x[5]
+
+    domain = seeded_domain(0)
+    expected = np.array([domain(row) for row in x])
+
+    with caplog.at_level(logging.WARNING):
+        batch = RoverBatch(seeded_domain(0))
+    assert not caplog.records
+    if not compiled_cost:
+        batch.cost = None
+    np.testing.assert_allclose(batch(x), expected, rtol=1e-9, atol=1e-9)
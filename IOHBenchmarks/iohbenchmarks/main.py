@@ -1,83 +1,157 @@
+import itertools
 import logging
+from argparse import ArgumentParser
+from collections.abc import Iterator
+from functools import lru_cache
 
+import grpc
 import ioh.iohcpp
 import numpy as np
+from benchercommon.packed import decode_points, encode_values
+from benchercommon.service import BenchmarkService
 from bencherscaffold.protoclasses.bencher_pb2 import BenchmarkRequest, EvaluationResult
-from bencherscaffold.protoclasses.grcp_service import GRCPService
 from ioh import get_problem, ProblemClass
 from ioh.iohcpp.problem import OneMaxDummy2, MaxCoverage
 from ioh.iohcpp.suite import RealStarDiscrepancy
 
 
-class IOHServiceServicer(GRCPService):
+logger = logging.getLogger(__name__)
+
+# log only every LOG_EVERY-th evaluation, since a log line costs more than evaluating most IOH problems
+LOG_EVERY = 1000
+
+# benchmark name prefix -> IOH problems and problem class
+PROBLEM_CANDIDATES = {
+    'bbob': ioh.iohcpp.problem.BBOB.problems,
+    'pbo': ioh.iohcpp.problem.PBO.problems,
+    'graph': ioh.iohcpp.problem.GraphProblem.problems,
+}
+
+
+class IOHServiceServicer(BenchmarkService):
 
     def __init__(
-            self
+            self,
+            port: int = 50059
     ):
-        super().__init__(port=50059, n_cores=1)
+        """
+        Args:
+            port: The port number to start the service on.
+        """
+        super().__init__(port=port, n_cores=1)
+        self.evaluation_counter = itertools.count()
+        # structure: {benchmark_name: (problem_name, problem_id, problem_class, point_type)}
+        # filled with the canonical name of every IOH problem, other names are added when first resolved
+        self.resolved_names = dict()
+        for prefix, candidates in PROBLEM_CANDIDATES.items():
+            for name in candidates.values():
+                benchmark_name = f"{prefix}-{name.lower()}"
+                self.resolved_names[benchmark_name] = self._resolve_benchmark(benchmark_name)
 
-    def evaluate_point(
+    def resolve_benchmark(
             self,
-            request: BenchmarkRequest,
-            context
-    ) -> EvaluationResult:
-        x = [v.value for v in request.point.values]
-        x = np.array(x)
-        dimension = x.shape[0]
-        if request.benchmark.name.strip().startswith('bbob-'):
-            print(f"Evaluating {request.benchmark.name} with dimension {dimension}")
-            bname_trunc = request.benchmark.name.split('-')[1]
-            benchmark_candidate = ioh.iohcpp.problem.BBOB.problems
+            benchmark_name: str
+    ) -> tuple[str, int, ProblemClass, type]:
+        """
+        Resolves a bencher benchmark name such as `bbob-sphere` to the IOH problem it refers to.
+
+        Args:
+            benchmark_name: The name of the benchmark.
+
+        Returns:
+            The IOH problem name, the IOH problem id, the problem class and the dtype of the points.
+        """
+        resolved = self.resolved_names.get(benchmark_name)
+        if resolved is None:
+            resolved = self._resolve_benchmark(benchmark_name)
+            self.resolved_names[benchmark_name] = resolved
+        return resolved
 
-            pname_pid = [
-                (name, pid) for pid, name in benchmark_candidate.items() if name.lower().startswith(bname_trunc)
-            ]
-            if len(pname_pid) == 0:
-                raise ValueError(
-                    f"Benchmark {request.benchmark.name} not supported. Supported benchmarks are: {list(benchmark_candidate.values())}"
-                )
-            pname, pid = pname_pid[0]
+    @staticmethod
+    def _resolve_benchmark(
+            benchmark_name: str
+    ) -> tuple[str, int, ProblemClass, type]:
+        if benchmark_name.strip().startswith('bbob-'):
+            benchmark_candidate = ioh.iohcpp.problem.BBOB.problems
             problemclass = ProblemClass.BBOB
             point_type = np.float64
-        elif request.benchmark.name.strip().startswith('pbo-'):
-            print(f"Evaluating {request.benchmark.name} with dimension {dimension}")
-            bname_trunc = request.benchmark.name.split('-')[1]
+        elif benchmark_name.strip().startswith('pbo-'):
             benchmark_candidate = ioh.iohcpp.problem.PBO.problems
-
-            pname_pid = [
-                (name, pid) for pid, name in benchmark_candidate.items() if name.lower().startswith(bname_trunc)
-            ]
-            if len(pname_pid) == 0:
-                raise ValueError(
-                    f"Benchmark {request.benchmark.name} not supported. Supported benchmarks are: {list(benchmark_candidate.values())}"
-                )
-            pname, pid = pname_pid[0]
             problemclass = ProblemClass.PBO
             point_type = np.int64
-        elif request.benchmark.name.strip().startswith('graph-'):
-            print(f"Evaluating {request.benchmark.name} with dimension {dimension}")
-            bname_trunc = request.benchmark.name.split('-')[1]
+        elif benchmark_name.strip().startswith('graph-'):
             benchmark_candidate = ioh.iohcpp.problem.GraphProblem.problems
-
-            pname_pid = [
-                (name, pid) for pid, name in benchmark_candidate.items() if name.lower().startswith(bname_trunc)
-            ]
-            if len(pname_pid) == 0:
-                raise ValueError(
-                    f"Benchmark {request.benchmark.name} not supported. Supported benchmarks are: {list(benchmark_candidate.values())}"
-                )
-            pname, pid = pname_pid[0]
             problemclass = ProblemClass.GRAPH
             point_type = np.int64
-
         else:
             raise ValueError(
-                f"Benchmark {request.benchmark.name} not supported. Supported benchmarks are: {list(ioh.iohcpp.problem.BBOB.problems.values()) + list(ioh.iohcpp.problem.PBO.problems.values())}"
+                f"Benchmark {benchmark_name} not supported. Supported benchmarks are: {list(ioh.iohcpp.problem.BBOB.problems.values()) + list(ioh.iohcpp.problem.PBO.problems.values())}"
             )
 
-        benchmark = get_problem(pname, pid, dimension, problemclass)
+        bname_trunc = benchmark_name.split('-')[1]
+        pname_pid = [
+            (name, pid) for pid, name in benchmark_candidate.items() if name.lower().startswith(bname_trunc)
+        ]
+        if len(pname_pid) == 0:
+            raise ValueError(
+                f"Benchmark {benchmark_name} not supported. Supported benchmarks are: {list(benchmark_candidate.values())}"
+            )
+        pname, pid = pname_pid[0]
+        return pname, pid, problemclass, point_type
+
+    @lru_cache(maxsize=256)
+    def get_problem(
+            self,
+            problem_name: str,
+            instance: int,
+            dimension: int,
+            problemclass: ProblemClass
+    ):
+        """
+        Returns the IOH problem for the given arguments of `ioh.get_problem`, constructing it only on first use.
+
+        Args:
+            problem_name: The IOH problem name.
+            instance: The problem instance.
+            dimension: The dimension of the problem.
+            problemclass: The problem class.
+
+        Returns:
+            The IOH problem.
+        """
+        return get_problem(problem_name, instance, dimension, problemclass)
+
+    def log_evaluations(
+            self,
+            benchmark_name: str,
+            dimension: int,
+            n_points: int
+    ):
+        """
+        Logs an evaluation request, but only for every `LOG_EVERY`-th request.
+
+        Args:
+            benchmark_name: The name of the benchmark.
+            dimension: The dimension of the points.
+            n_points: The number of points evaluated.
+        """
+        n = next(self.evaluation_counter)
+        if n % LOG_EVERY == 0:
+            logger.info(f"Evaluating {n_points} points of {benchmark_name} with dimension {dimension} (request {n})")
+
+    def evaluate_point(
+            self,
+            request: BenchmarkRequest,
+            context
+    ) -> EvaluationResult:
+        x = [v.value for v in request.point.values]
+        x = np.array(x)
+        dimension = x.shape[0]
+        self.log_evaluations(request.benchmark.name, dimension, 1)
+        pname, pid, problemclass, point_type = self.resolve_benchmark(request.benchmark.name)
+
+        benchmark = self.get_problem(pname, pid, dimension, problemclass)
         bounds = benchmark.bounds
-        MaxCoverage
         if bounds is not None:
             x = (x - bounds.lb) / (bounds.ub - bounds.lb)
             y = benchmark(x.astype(point_type))
@@ -86,10 +160,96 @@ class IOHServiceServicer(GRCPService):
         )
         return result
 
+    def evaluate_batch(
+            self,
+            request_iterator: Iterator[BenchmarkRequest],
+            context
+    ) -> Iterator[EvaluationResult]:
+        """
+        Evaluates a stream of points and streams back one result per point, in request order.
+
+        Points of the same benchmark and dimension share a single problem instance and are passed to it as one
+        matrix, so the rows are evaluated by the C++ problem in one call.
+        """
+        requests = list(request_iterator)
+        values = np.zeros(len(requests))
+
+        # structure: {(benchmark_name, dimension): [request_index, ...]}
+        problem_to_indices = dict()
+        for i, request in enumerate(requests):
+            key = (request.benchmark.name, len(request.point.values))
+            problem_to_indices.setdefault(key, []).append(i)
+
+        for (benchmark_name, dimension), indices in problem_to_indices.items():
+            x = np.array([[v.value for v in requests[i].point.values] for i in indices])
+            values[indices] = self.evaluate_matrix(benchmark_name, x)
+
+        for value in values:
+            yield EvaluationResult(
+                value=value
+            )
+
+    def evaluate_matrix(
+            self,
+            benchmark_name: str,
+            x: np.ndarray
+    ) -> np.ndarray:
+        """
+        Evaluates all rows of a matrix with a single problem instance.
+
+        All rows are rescaled in one numpy operation and passed to the C++ problem in one call.
+
+        Args:
+            benchmark_name: The name of the benchmark.
+            x: Matrix of shape (n_points, dimension).
+
+        Returns:
+            Array of shape (n_points,) with the value of each row.
+        """
+        n_points, dimension = x.shape
+        self.log_evaluations(benchmark_name, dimension, n_points)
+        pname, pid, problemclass, point_type = self.resolve_benchmark(benchmark_name)
+        benchmark = self.get_problem(pname, pid, dimension, problemclass)
+        bounds = benchmark.bounds
+        x = (x - bounds.lb) / (bounds.ub - bounds.lb)
+        return np.asarray(benchmark(x.astype(point_type)), dtype=np.float64)
+
+    def evaluate_packed(
+            self,
+            request: bytes,
+            context
+    ) -> bytes:
+        """
+        Evaluates a packed matrix of points, see `benchercommon.packed`.
+
+        Args:
+            request: The packed request holding the benchmark name and a float64 or int64 matrix of points.
+            context: The gRPC context.
+
+        Returns:
+            The packed float64 array with the value of each point.
+        """
+        try:
+            benchmark_name, x = decode_points(request)
+        except ValueError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+        return encode_values(self.evaluate_matrix(benchmark_name, x))
+
 
 def serve():
-    logging.basicConfig()
-    ioh = IOHServiceServicer()
+    argparse = ArgumentParser()
+    argparse.add_argument(
+        '-p',
+        '--port',
+        type=int,
+        required=False,
+        help='The port number to start the service on. Default is 50059.',
+        default=50059
+    )
+    args = argparse.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    ioh = IOHServiceServicer(port=args.port)
     ioh.serve()
 
 
@@ -0,0 +1,193 @@
+import threading
+import types
+from collections import OrderedDict
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+
+import numpy as np
+
+
+def object_nbytes(
+        obj
+) -> int:
+    """
+    Estimates the memory held by an object as the total size of the numpy arrays reachable through its attributes.
+
+    Sparse matrices are covered since their data is stored in numpy arrays. Everything else is treated as negligible.
+
+    Args:
+        obj: The object to measure.
+
+    Returns:
+        The estimated size in bytes.
+    """
+    seen = set()
+    stack = [obj]
+    nbytes = 0
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, (type, types.ModuleType, types.FunctionType, types.MethodType)):
+            continue
+        seen.add(id(o))
+        if isinstance(o, np.ndarray):
+            # views share the memory of their base
+            nbytes += o.nbytes if o.base is None else 0
+            if o.base is not None:
+                stack.append(o.base)
+        elif isinstance(o, dict):
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set)):
+            stack.extend(o)
+        elif hasattr(o, "__dict__"):
+            stack.extend(vars(o).values())
+    return nbytes
+
+
+class _Entry:
+
+    def __init__(
+            self
+    ):
+        # estimated size of one instance, None until the first instance is constructed
+        self.nbytes: int | None = None
+        # LassoBench benchmarks keep state while evaluating, so one instance serves one request at a time. Instances
+        # that are not in use wait here for the next request.
+        self.idle = []
+        self.n_instances = 0
+        self.condition = threading.Condition()
+
+
+class BenchmarkCache:
+    """
+    Thread-safe LRU cache of pools of constructed benchmark objects with a memory budget.
+
+    Each benchmark keeps a pool of up to `max_instances` instances, so that up to that many requests for the same
+    benchmark are evaluated concurrently. A new instance is only constructed when all instances of the benchmark are in
+    use; further requests wait for a free instance once the pool is full or another instance would exceed the budget.
+    When the estimated memory of all cached instances exceeds the budget, the idle instances of the least recently used
+    benchmarks are evicted. Instances in use stay cached, and count towards the budget, until they are returned. The
+    most recently used benchmark always keeps at least one instance, even if it alone exceeds the budget.
+    """
+
+    def __init__(
+            self,
+            factories: dict[str, Callable],
+            max_bytes: int,
+            max_instances: int = 1
+    ):
+        """
+        Args:
+            factories: Maps each benchmark name to a function constructing the benchmark. The function is called with
+                `None`, like the functions in `benchmark_map`.
+            max_bytes: The memory budget in bytes.
+            max_instances: The largest number of instances of one benchmark.
+        """
+        self.factories = factories
+        self.max_bytes = max_bytes
+        self.max_instances = max(1, max_instances)
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(
+            self,
+            name: str
+    ) -> _Entry:
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                entry = self._entries[name] = _Entry()
+            self._entries.move_to_end(name)
+            return entry
+
+    def _may_construct(
+            self,
+            entry: _Entry
+    ) -> bool:
+        if entry.n_instances == 0:
+            return True
+        # wait for the first instance before constructing more, so that its size is known
+        return entry.nbytes is not None and entry.n_instances < self.max_instances and \
+            entry.nbytes * (entry.n_instances + 1) <= self.max_bytes
+
+    def _evict(
+            self
+    ):
+        # called with self._lock held. Entries stay in the cache when all their instances are evicted, so that an
+        # instance in use is always accounted for in its entry and evicted once it is idle.
+        total = sum((e.nbytes or 0) * e.n_instances for e in self._entries.values())
+        names = list(self._entries)
+        for name in names:
+            if total <= self.max_bytes:
+                break
+            entry = self._entries[name]
+            keep = 1 if name == names[-1] else 0
+            with entry.condition:
+                n_evicted = 0
+                while entry.idle and entry.n_instances > keep and total > self.max_bytes:
+                    entry.idle.pop()
+                    entry.n_instances -= 1
+                    total -= entry.nbytes
+                    n_evicted += 1
+                if n_evicted:
+                    # requests waiting for an instance may construct one now
+                    entry.condition.notify_all()
+            if n_evicted:
+                print(f"Evicted {n_evicted} instance(s) of {name} from the benchmark cache")
+
+    @contextmanager
+    def instance(
+            self,
+            name: str
+    ) -> Iterator:
+        """
+        Lends an instance of a benchmark for the duration of a `with` block, constructing it if no instance is free.
+
+        Args:
+            name: The name of the benchmark.
+
+        Returns:
+            A context manager yielding the benchmark, which only the current thread uses until the block exits.
+        """
+        factory = self.factories[name]
+        entry = self._entry(name)
+        with entry.condition:
+            while not entry.idle and not self._may_construct(entry):
+                entry.condition.wait()
+            benchmark = entry.idle.pop() if entry.idle else None
+            if benchmark is None:
+                entry.n_instances += 1
+        if benchmark is None:
+            try:
+                benchmark = factory(None)
+            except BaseException:
+                with entry.condition:
+                    entry.n_instances -= 1
+                    entry.condition.notify()
+                raise
+            nbytes = object_nbytes(benchmark)
+            with entry.condition:
+                entry.nbytes = max(entry.nbytes or 0, nbytes)
+                # other requests may construct another instance now that its size is known
+                entry.condition.notify_all()
+            print(f"Loaded {name} instance {entry.n_instances} ({nbytes / 2 ** 20:.1f} MB)")
+            with self._lock:
+                self._evict()
+        try:
+            yield benchmark
+        finally:
+            with entry.condition:
+                entry.idle.append(benchmark)
+                entry.condition.notify()
+            # the instance may have been kept over the budget while it was in use
+            with self._lock:
+                self._evict()
+
+    def preload(
+            self
+    ):
+        """
+        Constructs one instance of each benchmark, in order, subject to the memory budget.
+        """
+        for name in self.factories:
+            with self.instance(name):
+                pass
@@ -1,9 +1,16 @@
 import logging
+import os
+from argparse import ArgumentParser
+from collections.abc import Iterator
 
 import LassoBench
+import grpc
 import numpy as np
+from benchercommon.packed import decode_points, encode_values
+from benchercommon.service import BenchmarkService
 from bencherscaffold.protoclasses.bencher_pb2 import BenchmarkRequest, EvaluationResult
-from bencherscaffold.protoclasses.grcp_service import GRCPService
+
+from lassobenchmarks.instances import BenchmarkCache
 
 
 def eval_lasso(
@@ -35,35 +42,159 @@ benchmark_map = {
 }
 
 
-class LassoServiceServicer(GRCPService):
+class LassoServiceServicer(BenchmarkService):
 
     def __init__(
-            self
+            self,
+            n_cores: int = os.cpu_count(),
+            cache_memory_mb: int = 8192,
+            max_instances: int = 4,
+            preload: bool = False,
+            port: int = 50053
     ):
-        super().__init__(port=50053, n_cores=1)
+        """
+        Args:
+            n_cores: The number of requests to serve concurrently.
+            cache_memory_mb: The memory budget of the benchmark cache in MB.
+            max_instances: The largest number of instances of one benchmark, and hence of concurrent requests for the
+                same benchmark. Requests for different benchmarks are limited by `n_cores` only.
+            preload: Whether to construct all benchmarks at startup instead of at first use.
+            port: The port number to start the service on.
+        """
+        super().__init__(port=port, n_cores=n_cores)
+        self.benchmarks = BenchmarkCache(
+            benchmark_map,
+            max_bytes=cache_memory_mb * 2 ** 20,
+            max_instances=min(max_instances, n_cores)
+        )
+        if preload:
+            self.benchmarks.preload()
 
     def evaluate_point(
             self,
             request: BenchmarkRequest,
             context
     ) -> EvaluationResult:
-        assert request.benchmark.name in benchmark_map.keys(), "Invalid benchmark name"
         x = [v.value for v in request.point.values]
         x = np.array(x)
-        # lasso benchmarks are in [-1, 1] while x is in [0, 1], so we need to scale it
-        x = 2 * x - 1
-        benchmark = benchmark_map[request.benchmark.name](None)
         result = EvaluationResult(
-            value=eval_lasso(x, benchmark),
+            value=self.evaluate_matrix(request.benchmark.name, x[np.newaxis, :])[0],
         )
         return result
 
+    def evaluate_matrix(
+            self,
+            benchmark_name: str,
+            x: np.ndarray
+    ) -> np.ndarray:
+        """
+        Evaluates all rows of a matrix on a free instance of the benchmark from the cache.
+
+        Args:
+            benchmark_name: The name of the benchmark.
+            x: Matrix of shape (n_points, dimension) in [0, 1] space.
+
+        Returns:
+            Array of shape (n_points,) with the value of each row.
+        """
+        assert benchmark_name in benchmark_map.keys(), "Invalid benchmark name"
+        # lasso benchmarks are in [-1, 1] while x is in [0, 1], so we need to scale it
+        x = 2 * x - 1
+        with self.benchmarks.instance(benchmark_name) as benchmark:
+            return np.array([eval_lasso(row, benchmark) for row in x], dtype=np.float64)
+
+    def evaluate_batch(
+            self,
+            request_iterator: Iterator[BenchmarkRequest],
+            context
+    ) -> Iterator[EvaluationResult]:
+        """
+        Evaluates a stream of points one after the other and streams back one result per point, in request order.
+        """
+        for request in request_iterator:
+            yield self.evaluate_point(request, context)
+
+    def evaluate_packed(
+            self,
+            request: bytes,
+            context
+    ) -> bytes:
+        """
+        Evaluates the points of a packed request, see `benchercommon.packed`.
+
+        Args:
+            request: The packed request.
+            context: The gRPC context.
+
+        Returns:
+            The packed float64 array with the value of each point.
+        """
+        try:
+            benchmark_name, x = decode_points(request)
+        except ValueError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+        return encode_values(self.evaluate_matrix(benchmark_name, x))
+
 
 def serve():
+    argparse = ArgumentParser()
+    argparse.add_argument(
+        '-p',
+        '--port',
+        type=int,
+        required=False,
+        help='The port number to start the service on. Default is 50053.',
+        default=50053
+    )
+    argparse.add_argument(
+        '-c',
+        '--cores',
+        type=int,
+        required=False,
+        help='The number of requests to serve concurrently. Default is cpu_count()',
+        default=os.cpu_count()
+    )
+    argparse.add_argument(
+        '--cache-memory',
+        type=int,
+        required=False,
+        help='The memory budget in MB for constructed benchmarks. Least recently used benchmarks are evicted when the budget is exceeded. Default is 8192',
+        default=8192
+    )
+    argparse.add_argument(
+        '--instances',
+        type=int,
+        required=False,
+        help='The largest number of instances of each benchmark, i.e., of requests for the same benchmark that are served concurrently. Instances are constructed on demand and count towards the cache memory. Default is 4',
+        default=4
+    )
+    argparse.add_argument(
+        '--preload',
+        action='store_true',
+        help='Construct all benchmarks at startup instead of at first use.',
+    )
+    args = argparse.parse_args()
+
     logging.basicConfig()
-    lasso = LassoServiceServicer()
+    lasso = LassoServiceServicer(
+        n_cores=args.cores,
+        cache_memory_mb=args.cache_memory,
+        max_instances=args.instances,
+        preload=args.preload,
+        port=args.port
+    )
     lasso.serve()
 
 
+def prefetch():
+    """
+    Constructs every Lasso benchmark once so that LassoBench downloads its datasets (into LIBSVMDATA_HOME).
+    """
+    logging.basicConfig()
+    for name, benchmark_factory in benchmark_map.items():
+        benchmark_factory(None)
+        print(f"Prefetched {name}")
+
+
 if __name__ == '__main__':
     serve()
\ No newline at end of file
@@ -0,0 +1,165 @@
+import threading
+
+import numpy as np
+import pytest
+
+from lassobenchmarks.instances import BenchmarkCache
+
+
+class FakeBenchmark:
+
+    def __init__(
+            self,
+            n_values: int
+    ):
+        self.values = np.zeros(n_values)
+
+
+def counting_factories(
+        n_values: dict[str, int]
+):
+    constructed = {name: 0 for name in n_values}
+    lock = threading.Lock()
+
+    def factory(name):
+        def construct(_):
+            with lock:
+                constructed[name] += 1
+            return FakeBenchmark(n_values[name])
+
+        return construct
+
+    return {name: factory(name) for name in n_values}, constructed
+
+
+def test_instances_are_reused():
+    factories, constructed = counting_factories({'a': 10})
+    cache = BenchmarkCache(factories, max_bytes=2 ** 20, max_instances=4)
+    with cache.instance('a') as first:
+        pass
+    with cache.instance('a') as second:
+        assert second is first
+    assert constructed['a'] == 1
+
+
+def test_concurrent_requests_use_separate_instances():
+    factories, constructed = counting_factories({'a': 10})
+    cache = BenchmarkCache(factories, max_bytes=2 ** 20, max_instances=3)
+    cache.preload()
+    barrier = threading.Barrier(3, timeout=10)
+    used = []
+
+    def request():
+        with cache.instance('a') as benchmark:
+            used.append(benchmark)
+            # all three requests hold an instance at the same time
+            barrier.wait()
+
+    threads = [threading.Thread(target=request) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(benchmark) for benchmark in used}) == 3
+    assert constructed['a'] == 3
+
+
+def test_pool_size_is_bounded():
+    factories, constructed = counting_factories({'a': 10})
+    cache = BenchmarkCache(factories, max_bytes=2 ** 20, max_instances=2)
+    in_use = 0
+    max_in_use = 0
+    lock = threading.Lock()
+
+    def request():
+        nonlocal in_use, max_in_use
+        with cache.instance('a'):
+            with lock:
+                in_use += 1
+                max_in_use = max(max_in_use, in_use)
+            threading.Event().wait(0.01)
+            with lock:
+                in_use -= 1
+
+    threads = [threading.Thread(target=request) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max_in_use <= 2
+    assert constructed['a'] <= 2
+
+
+def test_memory_budget_limits_the_pool():
+    # one instance holds 8000 bytes, the budget fits only one
+    factories, constructed = counting_factories({'a': 1000})
+    cache = BenchmarkCache(factories, max_bytes=10000, max_instances=4)
+    cache.preload()
+    acquired = threading.Event()
+
+    def request():
+        with cache.instance('a'):
+            acquired.set()
+
+    with cache.instance('a'):
+        thread = threading.Thread(target=request)
+        thread.start()
+        # the second request waits for the instance instead of constructing another one
+        assert not acquired.wait(0.2)
+    thread.join(timeout=10)
+    assert acquired.is_set()
+    assert constructed['a'] == 1
+
+
+def test_least_recently_used_benchmarks_are_evicted():
+    factories, constructed = counting_factories({'a': 1000, 'b': 1000, 'c': 1000})
+    cache = BenchmarkCache(factories, max_bytes=20000)
+    for name in ['a', 'b', 'c', 'b', 'a']:
+        with cache.instance(name):
+            pass
+    # 'c' was evicted to make room for 'a' again
+    assert constructed == {'a': 2, 'b': 1, 'c': 1}
+    with cache.instance('b'):
+        pass
+    assert constructed['b'] == 1
+
+
+def cached_instances(
+        cache: BenchmarkCache
+) -> dict[str, int]:
+    return {name: entry.n_instances for name, entry in cache._entries.items()}
+
+
+def test_instances_in_use_are_not_evicted():
+    # one instance holds 8000 bytes, the budget fits only one
+    factories, constructed = counting_factories({'a': 1000, 'b': 1000})
+    cache = BenchmarkCache(factories, max_bytes=10000)
+    with cache.instance('a') as first:
+        with cache.instance('b'):
+            pass
+        # 'a' is in use and 'b' is the most recently used, so both stay cached over the budget
+        assert cached_instances(cache) == {'a': 1, 'b': 1}
+    # 'a' is evicted once it is returned
+    assert cached_instances(cache) == {'a': 0, 'b': 1}
+    with cache.instance('a') as second:
+        assert second is not first
+    assert cached_instances(cache) == {'b': 0, 'a': 1}
+    assert constructed == {'a': 2, 'b': 1}
+
+
+def test_failed_construction_is_retried():
+    calls = []
+
+    def factory(_):
+        calls.append(None)
+        if len(calls) == 1:
+            raise RuntimeError("download failed")
+        return FakeBenchmark(10)
+
+    cache = BenchmarkCache({'a': factory}, max_bytes=2 ** 20)
+    with pytest.raises(RuntimeError):
+        with cache.instance('a'):
+            pass
+    with cache.instance('a') as benchmark:
+        assert isinstance(benchmark, FakeBenchmark)
+    assert len(calls) == 2
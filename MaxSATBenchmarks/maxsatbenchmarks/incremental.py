@@ -0,0 +1,79 @@
+import numpy as np
+
+from maxsatbenchmarks.wcnf import WCNF
+
+
+class IncrementalMaxSAT:
+    """
+    Scores all 1-flip neighbours of an assignment of a WCNF instance at once.
+
+    The satisfied weight of a neighbour only differs from that of the assignment in the clauses the flipped variable
+    occurs in. These are found through the (variable, clause) pairs of the instance, so scoring all neighbours costs
+    about as much as one full evaluation. The evaluator holds no state between calls and can be shared by all threads.
+
+    Attributes:
+        nv (int): Number of variables.
+    """
+
+    def __init__(
+            self,
+            wcnf: WCNF,
+            weights: np.ndarray
+    ):
+        """
+        Constructor for IncrementalMaxSAT class.
+
+        Args:
+            wcnf: The parsed WCNF instance.
+            weights: The weight of every clause.
+        """
+        self.nv = wcnf.nv
+        self.weights = weights
+
+        self.clause_variables = wcnf.clause_variables
+        self.clause_signs = wcnf.clause_signs
+        self.n_clauses = len(wcnf.clause_offsets) - 1
+        self.literal_clauses = np.repeat(np.arange(self.n_clauses), np.diff(wcnf.clause_offsets))
+
+        # every (variable, clause) pair once, used to score all 1-flip neighbours at the same time
+        pairs, self.literal_pairs = np.unique(
+            self.clause_variables * self.n_clauses + self.literal_clauses,
+            return_inverse=True
+        )
+        self.pair_variables = pairs // self.n_clauses
+        self.pair_clauses = pairs % self.n_clauses
+
+    def _counts(
+            self,
+            literal_satisfied: np.ndarray
+    ) -> np.ndarray:
+        return np.bincount(self.literal_clauses, weights=literal_satisfied, minlength=self.n_clauses).astype(np.int64)
+
+    def evaluate_neighbours(
+            self,
+            x: np.ndarray
+    ) -> np.ndarray:
+        """
+        Scores all assignments that differ from x in exactly one variable.
+
+        Args:
+            x: The assignment, a binary array of shape (nv,).
+
+        Returns:
+            An array of shape (nv,) whose i-th entry is the sum of the weights of the clauses satisfied by x with
+            variable i flipped.
+        """
+        literal_satisfied = np.equal(x[self.clause_variables].astype(np.bool_), self.clause_signs)
+        counts = self._counts(literal_satisfied)
+        weights_sum = float((counts > 0) @ self.weights)
+        # change in the number of satisfied literals of each clause when flipping each of its variables
+        pair_count_changes = np.bincount(
+            self.literal_pairs,
+            weights=np.where(literal_satisfied, -1, 1),
+            minlength=len(self.pair_clauses)
+        )
+        pair_counts = counts[self.pair_clauses]
+        pair_weight_changes = self.weights[self.pair_clauses] * (
+                (pair_counts + pair_count_changes > 0).astype(np.float64) - (pair_counts > 0)
+        )
+        return weights_sum + np.bincount(self.pair_variables, weights=pair_weight_changes, minlength=self.nv)
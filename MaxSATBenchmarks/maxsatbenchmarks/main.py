@@ -1,19 +1,23 @@
 import threading
+from argparse import ArgumentParser
+from collections.abc import Iterator
 
+import grpc
 import logging
 import numpy as np
 import os
-import tempfile
 from functools import lru_cache
 
+from benchercommon.cache import cache_dir
+from benchercommon.packed import decode_points, encode_values
+from benchercommon.service import BenchmarkService
 from bencherscaffold.protoclasses.bencher_pb2 import BenchmarkRequest, EvaluationResult
-from bencherscaffold.protoclasses.grcp_service import GRCPService
 
 from maxsatbenchmarks.data_loading import download_maxsat60_data, download_maxsat125_data
+from maxsatbenchmarks.incremental import IncrementalMaxSAT
 from maxsatbenchmarks.wcnf import WCNF
 
-directory_file_descriptor = tempfile.TemporaryDirectory()
-directory_name = directory_file_descriptor.name
+directory_name = cache_dir("maxsat")
 
 filename_map = {
     'maxsat60' : 'frb10-6-4.wcnf',
@@ -42,28 +46,54 @@ def eval(
         x: np.ndarray,
         weights: np.ndarray,
         total_weight: float,
-        clauseidxs: np.ndarray,
-        clauses: np.ndarray,
+        clause_variables: np.ndarray,
+        clause_signs: np.ndarray,
+        clause_offsets: np.ndarray,
         negative_weights: bool
 
-) -> float:
+) -> float | np.ndarray:
     """
     Evaluate the function with the given input.
 
-    :param x: Input array.
+    :param x: Input array, either a single assignment of shape (nv,) or a batch of assignments of shape (batch, nv).
     :type x: np.ndarray
-    :return: The evaluated result.
-    :rtype: float
+    :param clause_variables: Variable index of every literal, see `WCNF.clause_variables`.
+    :param clause_signs: Sign of every literal, see `WCNF.clause_signs`.
+    :param clause_offsets: Start of every clause in the literal arrays, see `WCNF.clause_offsets`.
+    :return: The evaluated result, a float for a single assignment and an array of shape (batch,) for a batch.
+    :rtype: float | np.ndarray
+    """
+    if x.ndim == 1:
+        return float(
+            eval(
+                x[np.newaxis], weights, total_weight, clause_variables, clause_signs, clause_offsets, negative_weights
+            )[0]
+        )
+    assert x.ndim == 2
+    # (batch, n_literals) matrix of satisfied literals
+    literal_satisfied = np.equal(x[:, clause_variables].astype(np.bool_), clause_signs)
+    # (batch, n_clauses) matrix of satisfied clauses, empty clauses are never satisfied
+    satisfied = np.zeros((x.shape[0], len(clause_offsets) - 1), dtype=np.bool_)
+    nonempty = clause_offsets[1:] > clause_offsets[:-1]
+    if np.any(nonempty):
+        satisfied[:, nonempty] = np.logical_or.reduceat(literal_satisfied, clause_offsets[:-1][nonempty], axis=1)
+    weights_sum = satisfied @ weights
+    return weights_sum_to_fx(weights_sum, total_weight, negative_weights)
+
+
+def weights_sum_to_fx(
+        weights_sum: float | np.ndarray,
+        total_weight: float,
+        negative_weights: bool
+) -> float | np.ndarray:
+    """
+    Turn the sum of the weights of the satisfied clauses into the function value.
+
+    :param weights_sum: Sum of the weights of the satisfied clauses, a float or an array of sums.
+    :param total_weight: The sum of all the (unnormalized) weights.
+    :param negative_weights: Whether the function value is the weight of the unsatisfied clauses.
+    :return: The function value(s), to be minimized.
     """
-    x = x.squeeze()
-    assert x.ndim == 1
-    weights_sum = np.sum(
-        weights
-        * [
-            np.any(np.equal(x[ci], clauses[i, ci]))
-            for i, ci in enumerate(clauseidxs)
-        ]
-    )
     if negative_weights:
         # weights of unsatisfied clauses
         weight_diff = total_weight - weights_sum
@@ -73,7 +103,7 @@ def eval(
     return fx
 
 
-class MaxSATServiceServicer(GRCPService):
+class MaxSATServiceServicer(BenchmarkService):
     """
     MaxSATServiceServicer class for maximum satisfiability problem service.
 
@@ -82,22 +112,25 @@ class MaxSATServiceServicer(GRCPService):
     """
 
     def __init__(
-            self
+            self,
+            port: int = 50055
     ):
-        super().__init__(port=50055)
+        """
+        :param port: The port number to start the service on.
+        """
+        super().__init__(port=port)
 
     @lru_cache(maxsize=2)
-    def get_wcnf_weights_totalweight_clauseidxs_clauses(
+    def get_wcnf_weights_totalweight(
             self,
             benchmark: str
-    ) -> (np.ndarray, float, np.ndarray, np.ndarray):
+    ) -> (WCNF, np.ndarray, float):
         """
         :param benchmark: The name of the benchmark to retrieve the data for.
-        :return: A tuple containing four objects:
-            - weights: An array of weights for each variable in the benchmark.
+        :return: A tuple containing three objects:
+            - wcnf: The parsed WCNF instance, holding the clauses in CSR form.
+            - weights: An array of weights for each clause in the benchmark.
             - total_weight: The sum of all the weights.
-            - clause_idxs: An array of indices indicating which variables are present in each clause.
-            - clauses: A matrix representing the clauses where each row corresponds to a clause and each column corresponds to a variable.
 
         """
         assert benchmark in filename_map.keys(), "Invalid benchmark name"
@@ -112,7 +145,6 @@ class MaxSATServiceServicer(GRCPService):
                 directory_name, fname
             )
         )
-        dim = wcnf.nv
 
         normalize_weights = normalize_weights_map[benchmark]
 
@@ -122,16 +154,20 @@ class MaxSATServiceServicer(GRCPService):
         if normalize_weights:
             weights = (weights - weights.mean()) / weights.std()
 
-        clauses = np.zeros((len(wcnf.clauses), dim), dtype=np.bool_)
-
-        clause_idxs = []
+        return wcnf, weights, total_weight
 
-        for i, clause in enumerate(wcnf.clauses):
-            _clause_idxs = np.abs(np.array(clause)) - 1
-            clauses[i, _clause_idxs] = np.array(clause) > 0
-            clause_idxs.append(_clause_idxs)
-
-        return weights, total_weight, clause_idxs, clauses
+    @lru_cache(maxsize=2)
+    def get_incremental(
+            self,
+            benchmark: str
+    ) -> IncrementalMaxSAT:
+        """
+        :param benchmark: The name of the benchmark.
+        :return: The evaluator of the 1-flip neighbours of the benchmark. It is stateless, so it is shared by all
+            requests.
+        """
+        wcnf, weights, _ = self.get_wcnf_weights_totalweight(benchmark)
+        return IncrementalMaxSAT(wcnf, weights)
 
     def evaluate_point(
             self,
@@ -149,23 +185,153 @@ class MaxSATServiceServicer(GRCPService):
         # check that x is binary
         assert np.all(np.logical_or(x == 0, x == 1)), "Input must be binary"
 
-        weights, total_weight, clauseidxs, clauses = self.get_wcnf_weights_totalweight_clauseidxs_clauses(
-            request.benchmark.name
+        result = EvaluationResult(
+            value=self.evaluate_matrix(request.benchmark.name, x[np.newaxis])[0]
         )
+        return result
+
+    def evaluate_neighbours(
+            self,
+            request: BenchmarkRequest,
+            context
+    ) -> Iterator[EvaluationResult]:
+        """
+        :param request: Instance of the BenchmarkRequest class, containing the benchmark name and point values.
+        :param context: The context in which the evaluation is being performed.
+        :return: Stream of EvaluationResult instances, the i-th being the value of the point with variable i flipped.
+        """
+        assert request.benchmark.name in filename_map.keys(), "Invalid benchmark name"
+        x = [v.value for v in request.point.values]
+        x = np.array(x)
+        # check that x is binary
+        assert np.all(np.logical_or(x == 0, x == 1)), "Input must be binary"
+
+        _, _, total_weight = self.get_wcnf_weights_totalweight(request.benchmark.name)
+        weights_sums = self.get_incremental(request.benchmark.name).evaluate_neighbours(x)
 
         negative_weights = negative_weights_map[request.benchmark.name]
 
-        result = EvaluationResult(
-            value=eval(x, weights, total_weight, clauseidxs, clauses, negative_weights)
+        for value in weights_sum_to_fx(weights_sums, total_weight, negative_weights):
+            yield EvaluationResult(
+                value=value
+            )
+
+    def evaluate_batch(
+            self,
+            request_iterator: Iterator[BenchmarkRequest],
+            context
+    ) -> Iterator[EvaluationResult]:
+        """
+        :param request_iterator: Stream of BenchmarkRequest instances, possibly for different benchmarks.
+        :param context: The context in which the evaluation is being performed.
+        :return: Stream of EvaluationResult instances, one per request and in request order.
+
+        All points of the same benchmark are stacked into one matrix and scored with a single call to `eval`.
+        """
+        requests = list(request_iterator)
+        values = np.zeros(len(requests))
+
+        # structure: {benchmark_name: [request_index, ...]}
+        benchmark_to_indices = dict()
+        for i, request in enumerate(requests):
+            assert request.benchmark.name in filename_map.keys(), "Invalid benchmark name"
+            benchmark_to_indices.setdefault(request.benchmark.name, []).append(i)
+
+        for benchmark, indices in benchmark_to_indices.items():
+            x = np.array([[v.value for v in requests[i].point.values] for i in indices])
+            values[indices] = self.evaluate_matrix(benchmark, x)
+
+        for value in values:
+            yield EvaluationResult(
+                value=value
+            )
+
+    def evaluate_matrix(
+            self,
+            benchmark: str,
+            x: np.ndarray
+    ) -> np.ndarray:
+        """
+        :param benchmark: The name of the benchmark.
+        :param x: Binary matrix of shape (n_points, n_variables).
+        :return: Array of shape (n_points,) with the value of each row, scored with a single call to `eval`.
+        """
+        assert benchmark in filename_map.keys(), "Invalid benchmark name"
+        # check that x is binary
+        assert np.all(np.logical_or(x == 0, x == 1)), "Input must be binary"
+
+        wcnf, weights, total_weight = self.get_wcnf_weights_totalweight(benchmark)
+        return eval(
+            x,
+            weights,
+            total_weight,
+            wcnf.clause_variables,
+            wcnf.clause_signs,
+            wcnf.clause_offsets,
+            negative_weights_map[benchmark]
         )
-        return result
+
+    def evaluate_packed(
+            self,
+            request: bytes,
+            context
+    ) -> bytes:
+        """
+        :param request: A packed request, see `benchercommon.packed`. Points are best sent bit-packed.
+        :param context: The context in which the evaluation is being performed.
+        :return: The packed float64 array with the value of each point.
+        """
+        try:
+            benchmark, x = decode_points(request)
+        except ValueError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+        return encode_values(self.evaluate_matrix(benchmark, x))
+
+    def method_handlers(
+            self
+    ) -> dict[str, grpc.RpcMethodHandler]:
+        """
+        Adds the streaming `evaluate_neighbours` RPC to the methods of `BenchmarkService`.
+
+        :return: The handler of each method name of the `SecondLevelBencher` service.
+        :rtype: dict[str, grpc.RpcMethodHandler]
+        """
+        handlers = super().method_handlers()
+        handlers['evaluate_neighbours'] = grpc.unary_stream_rpc_method_handler(
+            self.evaluate_neighbours,
+            request_deserializer=BenchmarkRequest.FromString,
+            response_serializer=EvaluationResult.SerializeToString,
+        )
+        return handlers
 
 
 def serve():
+    argparse = ArgumentParser()
+    argparse.add_argument(
+        '-p',
+        '--port',
+        type=int,
+        required=False,
+        help='The port number to start the service on. Default is 50055.',
+        default=50055
+    )
+    args = argparse.parse_args()
+
     logging.basicConfig()
-    maxsat = MaxSATServiceServicer()
+    maxsat = MaxSATServiceServicer(port=args.port)
     maxsat.serve()
 
 
+def prefetch():
+    """
+    Downloads and parses the data of all MaxSAT benchmarks into the persistent cache.
+    """
+    logging.basicConfig()
+    for benchmark, fname in filename_map.items():
+        data_loader_map[benchmark](directory_name)
+        WCNF(os.path.join(directory_name, fname))
+        print(f"Prefetched {benchmark}")
+
+
 if __name__ == '__main__':
     serve()
@@ -1,41 +1,143 @@
+import hashlib
+import itertools
+import os
+
+import numpy as np
+from benchercommon.cache import atomic_write
+
+# number of lines parsed at once
+CHUNK_LINES = 1 << 16
+
+
+def file_hash(
+        file_path: str
+) -> str:
+    """
+    Computes the SHA-256 hex digest of a file without reading it into memory at once.
+
+    Args:
+        file_path: Path to the file.
+
+    Returns:
+        The hex digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
 class WCNF:
     """
     Helper class for reading and parsing WCNF files. Works only for weighted CNF without constraints.
 
+    The clauses are stored in compressed sparse row (CSR) form. The parsed arrays are cached in a `.npz` file next to
+    the WCNF file (or in `cache_dir`), keyed by the hash of the WCNF file, so a file is only parsed once.
+
     Attributes:
-        weights (list): List of weights for each clause.
-        clauses (list): List of clauses.
+        weights (np.ndarray): Weight of each clause.
         nv (int): Number of variables.
+        clause_variables (np.ndarray): Flat array of the (0-based) variable index of every literal, clause after clause.
+        clause_signs (np.ndarray): Flat boolean array, True where the corresponding literal is positive.
+        clause_offsets (np.ndarray): Array of length len(weights) + 1; the literals of clause i are at positions
+            clause_offsets[i]:clause_offsets[i + 1] of clause_variables and clause_signs.
     """
 
     def __init__(
             self,
-            file_path: str
+            file_path: str,
+            cache_dir: str | None = None
     ):
         """
         Constructor for WCNF class.
 
         Args:
             file_path: Path to the WCNF file.
+            cache_dir: Directory for the parsed `.npz` cache. Defaults to the directory of the WCNF file.
+        """
+        cache_dir = cache_dir or os.path.dirname(os.path.abspath(file_path))
+        cache_path = os.path.join(cache_dir, f"{os.path.basename(file_path)}.{file_hash(file_path)[:16]}.npz")
+
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as cached:
+                weights = cached["weights"]
+                literals = cached["literals"]
+                clause_offsets = cached["clause_offsets"]
+        else:
+            weights, literals, clause_offsets = self._parse(file_path)
+            # a concurrent reader never sees a partial cache, and a failed write leaves no temporary file behind
+            with atomic_write(cache_path) as f:
+                np.savez(f, weights=weights, literals=literals, clause_offsets=clause_offsets)
+
+        self.weights = weights
+        self.clause_offsets = clause_offsets
+        self.clause_variables = np.abs(literals) - 1
+        self.clause_signs = literals > 0
+        self.nv = int(self.clause_variables.max()) + 1 if len(self.clause_variables) > 0 else 0
+
+    @staticmethod
+    def _parse(
+            file_path: str
+    ) -> (np.ndarray, np.ndarray, np.ndarray):
+        """
+        Parses a WCNF file chunk by chunk.
+
+        Each chunk of clause lines is split into tokens at once and converted with a single `np.array` call. Every
+        clause line is a weight followed by the literals and a terminating 0, so the clause boundaries are the zeros
+        that are not weights. A file without clauses gives empty arrays.
+
+        Args:
+            file_path: Path to the WCNF file.
+
+        Returns:
+            The clause weights, the flat signed literals and the clause offsets.
+        """
+        weights = [np.zeros(0, dtype=np.int64)]
+        literals = [np.zeros(0, dtype=np.int64)]
+        clause_lengths = [np.zeros(0, dtype=np.int64)]
+
+        with open(file_path, "rb") as f:
+            while True:
+                lines = list(itertools.islice(f, CHUNK_LINES))
+                if len(lines) == 0:
+                    break
+                text = b"".join(line for line in lines if line.strip() != b"" and line.lstrip()[:1] not in b"cp")
+                tokens = np.array(text.split(), dtype=np.int64)
+                if len(tokens) == 0:
+                    continue
+
+                zeros = np.flatnonzero(tokens == 0)
+                if tokens[0] == 0 or np.any(np.diff(zeros) == 1):
+                    # some clause has weight 0, walk the zeros to tell weights and terminators apart
+                    terminators = []
+                    weight_position = 0
+                    for z in zeros:
+                        if z != weight_position:
+                            terminators.append(z)
+                            weight_position = z + 1
+                    terminators = np.array(terminators, dtype=np.int64)
+                else:
+                    terminators = zeros
+                starts = np.concatenate(([0], terminators[:-1] + 1))
+
+                weights.append(tokens[starts])
+                is_literal = np.ones(len(tokens), dtype=np.bool_)
+                is_literal[starts] = False
+                is_literal[terminators] = False
+                literals.append(tokens[is_literal])
+                clause_lengths.append(terminators - starts - 1)
+
+        clause_lengths = np.concatenate(clause_lengths)
+        clause_offsets = np.concatenate(([0], np.cumsum(clause_lengths)))
+        return np.concatenate(weights), np.concatenate(literals), clause_offsets
+
+    @property
+    def clauses(
+            self
+    ) -> list[list[int]]:
+        """
+        The clauses as lists of signed, 1-based literals.
         """
-        weights = []
-        clauses = []
-
-        with open(file_path, "r") as f:
-            lines = f.readlines()
-            lines = [line.strip().replace("\n", " ") for line in lines]
-            lines = [
-                line.strip().split(" ")[:-1]
-                for line in lines
-                if line != "" and line[0] != "c" and line[0] != "p"
-            ]
-
-            for line in lines:
-                weight = int(line[0])
-                clause = [int(literal) for literal in line[1:] if len(literal) > 0]
-                weights.append(weight)
-                clauses.append(clause)
-
-            self.weights = weights
-            self.clauses = clauses
-            self.nv = max([abs(literal) for clause in clauses for literal in clause])
+        literals = np.where(self.clause_signs, self.clause_variables + 1, -(self.clause_variables + 1))
+        return [literals[start:end].tolist() for start, end in zip(self.clause_offsets[:-1], self.clause_offsets[1:])]
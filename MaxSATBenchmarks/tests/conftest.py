@@ -0,0 +1,46 @@
+import os
+import tempfile
+
+import numpy as np
+import pytest
+
+# keep the benchmark data cache of the tests away from the user's cache
+os.environ.setdefault("BENCHER_CACHE_DIR", tempfile.mkdtemp(prefix="bencher-test-cache-"))
+
+
+def random_clauses(
+        rng: np.random.Generator,
+        nv: int,
+        n_clauses: int
+) -> list[tuple[int, list[int]]]:
+    clauses = []
+    for _ in range(n_clauses):
+        variables = rng.choice(nv, size=rng.integers(1, 6), replace=False) + 1
+        literals = np.where(rng.random(len(variables)) < 0.5, variables, -variables)
+        clauses.append((int(rng.integers(1, 100)), literals.tolist()))
+    return clauses
+
+
+def write_wcnf(
+        path: str,
+        nv: int,
+        clauses: list[tuple[int, list[int]]]
+):
+    with open(path, "w") as f:
+        f.write("c random instance\n")
+        f.write(f"p wcnf {nv} {len(clauses)}\n")
+        for weight, literals in clauses:
+            f.write(" ".join(str(v) for v in [weight, *literals, 0]) + "\n")
+
+
+@pytest.fixture
+def random_wcnf(tmp_path):
+    """
+    Writes a random WCNF file and returns its path, its number of variables, and its clauses.
+    """
+    rng = np.random.default_rng(0)
+    nv = 60
+    clauses = random_clauses(rng, nv, 400)
+    path = str(tmp_path / "random.wcnf")
+    write_wcnf(path, nv, clauses)
+    return path, nv, clauses
@@ -0,0 +1,38 @@
+import numpy as np
+
+from maxsatbenchmarks.incremental import IncrementalMaxSAT
+from maxsatbenchmarks.main import eval
+from maxsatbenchmarks.wcnf import WCNF
+
+
+def full_weights_sum(
+        wcnf: WCNF,
+        weights: np.ndarray,
+        x: np.ndarray
+) -> float:
+    # with negative_weights=False, eval returns the negative satisfied weight
+    return -eval(x, weights, 0.0, wcnf.clause_variables, wcnf.clause_signs, wcnf.clause_offsets, False)
+
+
+def normalized_weights(
+        wcnf: WCNF
+) -> np.ndarray:
+    weights = np.array(wcnf.weights, dtype=np.float64)
+    return (weights - weights.mean()) / weights.std()
+
+
+def test_neighbours_match_full_evaluation(random_wcnf):
+    path, nv, _ = random_wcnf
+    wcnf = WCNF(path)
+    weights = normalized_weights(wcnf)
+    incremental = IncrementalMaxSAT(wcnf, weights)
+
+    rng = np.random.default_rng(2)
+    for x in rng.integers(0, 2, (5, nv)):
+        neighbours = np.logical_xor(x, np.eye(nv, dtype=np.bool_)).astype(np.int64)
+        np.testing.assert_allclose(
+            incremental.evaluate_neighbours(x),
+            full_weights_sum(wcnf, weights, neighbours),
+            rtol=0,
+            atol=1e-12
+        )
@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+import pytest
+
+from conftest import write_wcnf
+from maxsatbenchmarks.wcnf import WCNF
+
+
+def test_parses_clauses_and_weights(random_wcnf, tmp_path):
+    path, nv, clauses = random_wcnf
+    wcnf = WCNF(path)
+
+    assert wcnf.nv == max(abs(literal) for _, literals in clauses for literal in literals)
+    np.testing.assert_array_equal(wcnf.weights, [weight for weight, _ in clauses])
+    assert wcnf.clauses == [literals for _, literals in clauses]
+
+
+def test_parses_zero_weights_comments_and_chunks(tmp_path, monkeypatch):
+    # chunks of two lines, so clauses, comments, and blank lines end up in different chunks
+    monkeypatch.setattr("maxsatbenchmarks.wcnf.CHUNK_LINES", 2)
+    path = tmp_path / "zeros.wcnf"
+    path.write_text("c comment\np wcnf 3 4\n0 1 -2 0\n\n5 3 0\nc another comment\n0 -1 0\n7 2 -3 1 0\n")
+    wcnf = WCNF(str(path))
+
+    np.testing.assert_array_equal(wcnf.weights, [0, 5, 0, 7])
+    assert wcnf.clauses == [[1, -2], [3], [-1], [2, -3, 1]]
+    assert wcnf.nv == 3
+
+
+def test_file_without_clauses(tmp_path):
+    path = str(tmp_path / "empty.wcnf")
+    write_wcnf(path, 0, [])
+    wcnf = WCNF(path)
+
+    assert len(wcnf.weights) == 0
+    assert wcnf.clauses == []
+    assert wcnf.nv == 0
+    np.testing.assert_array_equal(wcnf.clause_offsets, [0])
+
+
+def test_parsed_arrays_are_cached(random_wcnf, tmp_path, monkeypatch):
+    path, _, clauses = random_wcnf
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    WCNF(path, cache_dir=str(cache_dir))
+    assert [name.endswith(".npz") for name in os.listdir(cache_dir)] == [True]
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the file was parsed again")
+
+    monkeypatch.setattr(WCNF, "_parse", staticmethod(fail))
+    assert WCNF(path, cache_dir=str(cache_dir)).clauses == [literals for _, literals in clauses]
+
+
+def test_failed_cache_write_leaves_no_temporary_file(random_wcnf, tmp_path, monkeypatch):
+    path, _, _ = random_wcnf
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(np, "savez", fail)
+    with pytest.raises(OSError):
+        WCNF(path, cache_dir=str(cache_dir))
+    assert os.listdir(cache_dir) == []
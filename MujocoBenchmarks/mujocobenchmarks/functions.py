@@ -5,7 +5,9 @@
 #
 
 import os
-from typing import Tuple, Optional, ClassVar, Dict, Generic, Type, TypeVar
+import threading
+from functools import lru_cache
+from typing import Tuple, Optional, ClassVar, Dict, Generic, Type, TypeVar, Callable, Any
 
 import gym
 import numpy as np
@@ -42,6 +44,69 @@ class ObjectFactory(Generic[T]):
         return self._kwargs
 
 
+class EnvPool:
+    """
+    Keeps one object per benchmark and thread, so that environments are built once per worker thread and reused.
+
+    Objects are built on the first request of each thread for a benchmark. Users must reset the environments
+    themselves before each episode.
+    """
+
+    def __init__(self, factories: Dict[str, Callable[[Any], Any]]):
+        """
+        :param factories: Maps each benchmark name to a function building the object. The function is called with
+            `None`, like the functions in `func_factory_map`.
+        """
+        self._factories = factories
+        self._local = threading.local()
+
+    def get(self, name: str) -> Any:
+        """
+        Returns the object of the calling thread for a benchmark, building it if necessary.
+
+        :param name: The name of the benchmark.
+        :return: The object for the benchmark.
+        """
+        objects = getattr(self._local, "objects", None)
+        if objects is None:
+            objects = self._local.objects = {}
+        if name not in objects:
+            objects[name] = self._factories[name](None)
+        return objects[name]
+
+
+@lru_cache(maxsize=None)
+def load_policy(policy_file: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Loads a linear policy with its observation mean and standard deviation. Each file is only read once.
+
+    :param policy_file: Path to the `lin_policy_plus.npz` file.
+    :return: The read-only policy matrix, observation mean, and observation standard deviation.
+    """
+    lin_policy = np.load(policy_file, allow_pickle=True)
+    lin_policy = lin_policy['arr_0']
+    arrays = (np.array(lin_policy[0]), np.array(lin_policy[1]), np.array(lin_policy[2]))
+    for array in arrays:
+        # shared by all threads
+        array.setflags(write=False)
+    return arrays
+
+
+def rollout_seeds(num_rollouts: int, seed: Optional[int] = None) -> np.ndarray:
+    """
+    Derives one environment seed per rollout of an evaluation.
+
+    The rollouts of an evaluation are seeded individually so that the result does not depend on which worker runs
+    which rollout.
+
+    :param num_rollouts: The number of rollouts.
+    :param seed: The seed of the evaluation, e.g., the `--seed` of the service. If None, a fresh seed is drawn so that
+        evaluations stay noisy.
+    :return: Array of shape (num_rollouts,) with the seed of each rollout.
+    """
+    return np.random.SeedSequence(seed).generate_state(num_rollouts)
+
+
 class MujucoPolicyFunc:
     ANT_ENV: ClassVar[Tuple[str, float, float, int]] = ('Ant-v2', -1.0, 1.0, 1)
     SWIMMER_ENV: ClassVar[Tuple[str, float, float, int]] = ('Swimmer-v2', -1.0, 1.0, 5)
@@ -60,11 +125,7 @@ class MujucoPolicyFunc:
     }
 
     def __init__(self, policy_file: str, env: str, lb: float, ub: float, num_rollouts):
-        lin_policy = np.load(policy_file, allow_pickle=True)
-        lin_policy = lin_policy['arr_0']
-        self._policy = lin_policy[0]
-        self._mean = lin_policy[1]
-        self._std = lin_policy[2]
+        self._policy, self._mean, self._std = load_policy(policy_file)
         self._dims = len(self._policy.ravel())
         self._lb = np.full(self._dims, lb)
         self._ub = np.full(self._dims, ub)
@@ -89,28 +150,35 @@ class MujucoPolicyFunc:
     def is_minimizing(self) -> bool:
         return False
 
-    def __call__(self, x: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    @property
+    def num_rollouts(self) -> int:
+        return self._num_rollouts
+
+    def rollout(self, x: np.ndarray, seed: Optional[int] = None) -> float:
+        """
+        Runs one episode with the linear policy `x` and returns its total reward.
+
+        :param x: The flattened policy matrix.
+        :param seed: The seed for resetting the environment. If None, the environment continues its random stream.
+        :return: The total reward of the episode.
+        """
+        m = x.reshape(self._policy.shape)
+        obs = self._env.reset() if seed is None else self._env.reset(seed=int(seed))
+        done = False
+        total_reward = 0.
+        while not done:
+            action = np.dot(m, (obs - self._mean) / self._std)
+            obs, r, done, _ = self._env.step(action)
+            total_reward += r
+            if self._render:
+                self._env.render()
+        return total_reward
+
+    def __call__(self, x: np.ndarray, seed: Optional[int] = None) -> Tuple[np.ndarray, Optional[np.ndarray]]:
         fx = np.zeros(len(x))
         for i, actions in enumerate(x):
-            m = actions.reshape(self._policy.shape)
-            rewards = []
-            observations = []
-            actions = []
-            for _ in range(self._num_rollouts):
-                obs = self._env.reset()
-                done = False
-                total_reward = 0.
-                steps = 0
-                while not done:
-                    action = np.dot(m, (obs - self._mean) / self._std)
-                    observations.append(obs)
-                    actions.append(action)
-                    obs, r, done, _ = self._env.step(action)
-                    total_reward += r
-                    steps += 1
-                    if self._render:
-                        self._env.render()
-                rewards.append(total_reward)
+            seeds = rollout_seeds(self._num_rollouts, seed)
+            rewards = [self.rollout(actions, seed) for seed in seeds]
             fx[i] = np.mean(rewards)
         return fx, None
 
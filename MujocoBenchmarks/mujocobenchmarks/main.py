@@ -1,10 +1,19 @@
 import logging
+import multiprocessing
+import os
+from argparse import ArgumentParser
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional
+
+import grpc
 import numpy as np
+from benchercommon.packed import decode_points, encode_values
+from benchercommon.service import BenchmarkService, WorkerPool
 from bencherscaffold.protoclasses.bencher_pb2 import BenchmarkRequest, EvaluationResult
-from bencherscaffold.protoclasses.grcp_service import GRCPService
 from gym.envs.box2d import LunarLander
 
-from mujocobenchmarks.functions import func_factories
+from mujocobenchmarks.functions import EnvPool, MujucoPolicyFunc, func_factories, rollout_seeds
 
 func_factory_map = {
     'mujoco-ant': lambda
@@ -30,82 +39,325 @@ benchmark_bounds = {
     'mujoco-humanoid': (-1, 1),
 }
 
+benchmark_num_rollouts = {
+    'mujoco-ant': MujucoPolicyFunc.ANT_ENV[3],
+    'mujoco-hopper': MujucoPolicyFunc.HOPPER_ENV[3],
+    'mujoco-walker': MujucoPolicyFunc.WALKER_2D_ENV[3],
+    'mujoco-halfcheetah': MujucoPolicyFunc.HALF_CHEETAH_ENV[3],
+    'mujoco-swimmer': MujucoPolicyFunc.SWIMMER_ENV[3],
+    'mujoco-humanoid': MujucoPolicyFunc.HUMANOID_ENV[3],
+}
+
 
-def heuristic_controller(
-        state: np.ndarray,
+def heuristic_controller_batch(
+        states: np.ndarray,
         x: np.ndarray
-) -> int:
-    angle_targ = state[0] * x[0] + state[2] * x[1]
-    if angle_targ > x[2]:
-        angle_targ = x[2]
-    if angle_targ < -x[2]:
-        angle_targ = -x[2]
-    hover_targ = x[3] * np.abs(state[0])
+) -> np.ndarray:
+    """
+    The heuristic LunarLander controller of gym, parameterized by x, for many states and controllers at once.
+
+    :param states: Matrix of shape (batch, 8) with one LunarLander state per row.
+    :param x: Matrix of shape (batch, 12) with the controller parameters for each state.
+    :return: Array of shape (batch,) with the action for each state.
+    """
+    angle_targ = states[:, 0] * x[:, 0] + states[:, 2] * x[:, 1]
+    angle_targ = np.where(angle_targ > x[:, 2], x[:, 2], angle_targ)
+    angle_targ = np.where(angle_targ < -x[:, 2], -x[:, 2], angle_targ)
+    hover_targ = x[:, 3] * np.abs(states[:, 0])
+
+    angle_todo = (angle_targ - states[:, 4]) * x[:, 4] - (states[:, 5]) * x[:, 5]
+    hover_todo = (hover_targ - states[:, 1]) * x[:, 6] - (states[:, 3]) * x[:, 7]
+
+    legs_contact = (states[:, 6] != 0) | (states[:, 7] != 0)
+    angle_todo = np.where(legs_contact, x[:, 8], angle_todo)
+    hover_todo = np.where(legs_contact, -(states[:, 3]) * x[:, 9], hover_todo)
+
+    return np.select(
+        [
+            (hover_todo > np.abs(angle_todo)) & (hover_todo > x[:, 10]),
+            angle_todo < -x[:, 11],
+            angle_todo > +x[:, 11],
+        ],
+        [2, 3, 1],
+        default=0
+    )
+
+
+def run_lunarlander_episodes(
+        envs: List[LunarLander],
+        x: np.ndarray,
+        seeds: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Runs one episode per controller, stepping all environments in lockstep.
+
+    The actions of all running episodes are computed with one call to `heuristic_controller_batch` per step, so the
+    cost of a batch is roughly one pass over the episode horizon.
+
+    :param envs: At least `len(x)` environments, the i-th one is used for the i-th controller.
+    :param x: Matrix of shape (batch, 12) with one controller per row.
+    :param seeds: Optional array of shape (batch,) with the seed for resetting each environment.
+    :return: Array of shape (batch,) with the total reward of each episode.
+    """
+    batch_size = len(x)
+    states = np.stack(
+        [
+            envs[i].reset() if seeds is None else envs[i].reset(seed=int(seeds[i]))
+            for i in range(batch_size)
+        ]
+    )
+    total_rewards = np.zeros(batch_size)
+    running = np.arange(batch_size)
+    while len(running) > 0:
+        actions = heuristic_controller_batch(states[running], x[running])
+        still_running = []
+        for i, a in zip(running, actions):
+            s, r, terminated, info = envs[i].step(int(a))
+            states[i] = s
+            total_rewards[i] += r
+            if not terminated:
+                still_running.append(i)
+        running = np.array(still_running, dtype=int)
+    return total_rewards
+
 
-    angle_todo = (angle_targ - state[4]) * x[4] - (state[5]) * x[5]
-    hover_todo = (hover_targ - state[1]) * x[6] - (state[3]) * x[7]
+# environments of the current worker process, set by `_init_worker`
+_worker_env_pool: Optional[EnvPool] = None
+_worker_lunarlander_envs: List[LunarLander] = []
 
-    if state[6] or state[7]:
-        angle_todo = x[8]
-        hover_todo = -(state[3]) * x[9]
 
-    a = 0
-    if hover_todo > np.abs(angle_todo) and hover_todo > x[10]:
-        a = 2
-    elif angle_todo < -x[11]:
-        a = 3
-    elif angle_todo > +x[11]:
-        a = 1
-    return a
+def _init_worker():
+    global _worker_env_pool
+    # environments are built on the first rollout of each benchmark in this worker and reset before each episode
+    _worker_env_pool = EnvPool(func_factory_map)
 
 
-class MujocoServiceServicer(GRCPService):
+def _mujoco_rollout(
+        name: str,
+        x: np.ndarray,
+        seed: int
+) -> float:
+    return _worker_env_pool.get(name).rollout(x, seed)
+
+
+def _lunarlander_episodes(
+        x: np.ndarray,
+        seeds: np.ndarray,
+        n_episodes: int = 1
+) -> np.ndarray:
+    """
+    Evaluates many LunarLander controllers in lockstep in the current worker.
+
+    :param x: Matrix of shape (batch, 12) with one controller per row.
+    :param seeds: Array of shape (batch * n_episodes,) with the seeds of the episodes, those of the first controller
+        first.
+    :param n_episodes: The number of episodes per controller.
+    :return: Array of shape (batch,) with the mean total reward of each controller.
+    """
+    x = np.repeat(x, n_episodes, axis=0)
+    # add environments until there is one per episode, they are reused by later calls
+    while len(_worker_lunarlander_envs) < len(x):
+        _worker_lunarlander_envs.append(LunarLander())
+    rewards = run_lunarlander_episodes(_worker_lunarlander_envs, x, seeds)
+    return rewards.reshape(-1, n_episodes).mean(axis=1)
+
+
+class MujocoServiceServicer(BenchmarkService):
 
     def __init__(
+            self,
+            n_workers: int = os.cpu_count(),
+            seed: Optional[int] = None,
+            lunarlander_episodes: int = 1,
+            port: int = 50057
+    ):
+        """
+        :param n_workers: The number of worker processes running episodes. Each worker holds its own environments. If
+            a worker dies, e.g., from a crash of MuJoCo, all workers are started again and the lost episodes are rerun.
+        :param seed: If given, every evaluation uses the same episode seeds derived from it, so that each point always
+            gets the same value. If None, every evaluation draws fresh seeds and the benchmarks are noisy.
+        :param lunarlander_episodes: The number of episodes per LunarLander controller, whose rewards are averaged.
+        :param port: The port number to start the service on.
+        """
+        super().__init__(port=port, n_cores=n_workers)
+        self.n_workers = n_workers
+        self.seed = seed
+        self.lunarlander_episodes = lunarlander_episodes
+        # spawn instead of fork since the workers must not inherit the gRPC threads of the server
+        self.workers = WorkerPool(
+            lambda: ProcessPoolExecutor(
+                max_workers=n_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        )
+        self.workers.executor()
+
+    def close(
             self
     ):
-        super().__init__(port=50057, n_cores=1)
+        """
+        Stops the worker processes. Called by `serve` when the server terminates, including on SIGTERM.
+        """
+        self.workers.shutdown()
+
+    def submit(
+            self,
+            benchmark_name: str,
+            x: np.ndarray
+    ) -> Callable[[], np.ndarray]:
+        """
+        Submits the episodes needed to evaluate all rows of a matrix to the worker processes.
+
+        MuJoCo points get one task per rollout. LunarLander points are split into one chunk per worker, and each
+        worker runs the episodes of its chunk in lockstep. The seeds of all episodes are drawn here, so the values do
+        not depend on the number of workers.
+
+        :param benchmark_name: The name of the benchmark.
+        :param x: Matrix of shape (n_points, dimension) in [0, 1] space.
+        :return: A function that waits for the episodes and returns the array of shape (n_points,) with the values.
+        """
+        if len(x) == 0:
+            return lambda: np.zeros(0)
+        if benchmark_name in func_factory_map.keys():
+            # x is in [0, 1] space, we need to map it to the benchmark space
+            lb, ub = benchmark_bounds[benchmark_name]
+            x = lb + (ub - lb) * x
+            # each rollout has its own seed, so results do not depend on the number of workers
+            results = [
+                [
+                    self.workers.submit(_mujoco_rollout, benchmark_name, row, seed)
+                    for seed in rollout_seeds(benchmark_num_rollouts[benchmark_name], self.seed)
+                ]
+                for row in x
+            ]
+            return lambda: np.array(
+                [-float(np.mean([result() for result in row_results])) for row_results in results]
+            )
+        elif benchmark_name == 'lunarlander':
+            n_episodes = self.lunarlander_episodes
+            if self.seed is None:
+                seeds = rollout_seeds(len(x) * n_episodes).reshape(len(x), n_episodes)
+            else:
+                # the same episodes for every controller
+                seeds = np.tile(rollout_seeds(n_episodes, self.seed), (len(x), 1))
+            results = [
+                self.workers.submit(_lunarlander_episodes, x[chunk], seeds[chunk].ravel(), n_episodes)
+                for chunk in np.array_split(np.arange(len(x)), min(self.n_workers, len(x)))
+            ]
+            return lambda: np.concatenate([result() for result in results])
+        else:
+            raise ValueError("Invalid benchmark name")
 
     def evaluate_point(
             self,
             request: BenchmarkRequest,
             context
     ) -> EvaluationResult:
-        x = [v.value for v in request.point.values]
-        x = np.array(x).reshape(1, -1)
-        if request.benchmark.name in func_factory_map.keys():
-            # x is in [0, 1] space, we need to map it to the benchmark space
-            lb, ub = benchmark_bounds[request.benchmark.name]
-            x = lb + (ub - lb) * x
-            func_factory = func_factory_map[request.benchmark.name](None)
-            result = EvaluationResult(
-                value=-float(func_factory(x)[0].squeeze()),
+        x = np.array([v.value for v in request.point.values])
+        values = self.submit(request.benchmark.name, x[np.newaxis, :])()
+        return EvaluationResult(
+            value=float(values[0])
+        )
+
+    def evaluate_batch(
+            self,
+            request_iterator: Iterator[BenchmarkRequest],
+            context
+    ) -> Iterator[EvaluationResult]:
+        """
+        Evaluates a stream of points and streams back one result per point, in request order.
+
+        The episodes of all points are submitted to the worker processes before the first result is awaited.
+        """
+        requests = list(request_iterator)
+        values = np.zeros(len(requests))
+
+        # structure: {(benchmark_name, dimension): [request_index, ...]}
+        benchmark_to_indices = dict()
+        for i, request in enumerate(requests):
+            key = (request.benchmark.name, len(request.point.values))
+            benchmark_to_indices.setdefault(key, []).append(i)
+
+        pending = [
+            (
+                indices,
+                self.submit(
+                    benchmark_name,
+                    np.array([[v.value for v in requests[i].point.values] for i in indices])
+                )
             )
-        elif request.benchmark.name == 'lunarlander':
-            env = LunarLander()
-            total_reward = 0
-            steps = 0
-            s = env.reset()
-            while True:
-                a = heuristic_controller(s, x.squeeze())
-                s, r, terminated, info = env.step(a)
-                total_reward += r
-
-                steps += 1
-                if terminated:
-                    break
-            result = EvaluationResult(
-                value=total_reward
+            for (benchmark_name, _), indices in benchmark_to_indices.items()
+        ]
+        for indices, result in pending:
+            values[indices] = result()
+
+        for value in values:
+            yield EvaluationResult(
+                value=value
             )
-        else:
-            raise ValueError("Invalid benchmark name")
 
-        return result
+    def evaluate_packed(
+            self,
+            request: bytes,
+            context
+    ) -> bytes:
+        """
+        Evaluates the points of a packed request, see `benchercommon.packed`.
+
+        :param request: The packed request.
+        :param context: The gRPC context.
+        :return: The packed float64 array with the value of each point.
+        """
+        try:
+            benchmark_name, x = decode_points(request)
+        except ValueError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+        return encode_values(self.submit(benchmark_name, x)())
 
 
 def serve():
+    argparse = ArgumentParser()
+    argparse.add_argument(
+        '-p',
+        '--port',
+        type=int,
+        required=False,
+        help='The port number to start the service on. Default is 50057.',
+        default=50057
+    )
+    argparse.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        required=False,
+        help='The number of worker processes running episodes. Default is cpu_count()',
+        default=os.cpu_count()
+    )
+    argparse.add_argument(
+        '--seed',
+        type=int,
+        required=False,
+        help='If given, every evaluation uses the same episode seeds derived from it, which makes the benchmarks '
+             'deterministic. Default is None, fresh seeds for every evaluation.',
+        default=None
+    )
+    argparse.add_argument(
+        '--lunarlander-episodes',
+        type=int,
+        required=False,
+        help='The number of episodes per LunarLander controller, whose rewards are averaged. Default is 1.',
+        default=1
+    )
+    args = argparse.parse_args()
+
     logging.basicConfig()
-    mujoco = MujocoServiceServicer()
+    mujoco = MujocoServiceServicer(
+        n_workers=args.workers,
+        seed=args.seed,
+        lunarlander_episodes=args.lunarlander_episodes,
+        port=args.port
+    )
     mujoco.serve()
 
 
@@ -0,0 +1,48 @@
+import numpy as np
+
+from mujocobenchmarks.main import heuristic_controller_batch
+
+
+def heuristic_controller(
+        state: np.ndarray,
+        x: np.ndarray
+) -> int:
+    # the scalar controller the batch controller replaced, kept as its reference
+    angle_targ = state[0] * x[0] + state[2] * x[1]
+    if angle_targ > x[2]:
+        angle_targ = x[2]
+    if angle_targ < -x[2]:
+        angle_targ = -x[2]
+    hover_targ = x[3] * np.abs(state[0])
+
+    angle_todo = (angle_targ - state[4]) * x[4] - (state[5]) * x[5]
+    hover_todo = (hover_targ - state[1]) * x[6] - (state[3]) * x[7]
+
+    if state[6] or state[7]:
+        angle_todo = x[8]
+        hover_todo = -(state[3]) * x[9]
+
+    a = 0
+    if hover_todo > np.abs(angle_todo) and hover_todo > x[10]:
+        a = 2
+    elif angle_todo < -x[11]:
+        a = 3
+    elif angle_todo > +x[11]:
+        a = 1
+    return a
+
+
+def test_batch_controller_matches_scalar_controller():
+    rng = np.random.default_rng(0)
+    n = 20000
+    states = rng.normal(scale=0.5, size=(n, 8))
+    # leg contacts are 0 or 1
+    states[:, 6:] = rng.integers(0, 2, size=(n, 2))
+    states[:n // 2, 6:] = 0
+    x = rng.uniform(size=(n, 12))
+
+    actions = heuristic_controller_batch(states, x)
+    expected = [heuristic_controller(state, row) for state, row in zip(states, x)]
+    np.testing.assert_array_equal(actions, expected)
+    # every action is taken
+    assert set(np.unique(actions)) == {0, 1, 2, 3}
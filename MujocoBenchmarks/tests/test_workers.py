@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from gym.envs.box2d import LunarLander
+
+from mujocobenchmarks.functions import rollout_seeds
+from mujocobenchmarks.main import MujocoServiceServicer, run_lunarlander_episodes
+
+# the controller of the LunarLander heuristic in gym, and random ones
+HEURISTIC = np.array([0.5, 1.0, 0.4, 0.55, 0.5, 1.0, 0.5, 0.5, 0.0, 0.5, 0.05, 0.05])
+
+
+@pytest.fixture(scope="module")
+def services():
+    created = {}
+
+    def service(n_workers, seed):
+        if (n_workers, seed) not in created:
+            created[n_workers, seed] = MujocoServiceServicer(n_workers=n_workers, seed=seed)
+        return created[n_workers, seed]
+
+    yield service
+    for s in created.values():
+        s.workers.shutdown()
+
+
+def test_rollout_seeds():
+    np.testing.assert_array_equal(rollout_seeds(5, 42), rollout_seeds(5, 42))
+    assert len(set(rollout_seeds(5, 42))) == 5
+    assert not np.array_equal(rollout_seeds(5), rollout_seeds(5))
+
+
+def test_seeded_lunarlander_does_not_depend_on_workers(services):
+    x = np.vstack([HEURISTIC, np.random.default_rng(0).uniform(size=(6, 12))])
+    one_worker = services(1, 7).submit('lunarlander', x)()
+    three_workers = services(3, 7).submit('lunarlander', x)()
+    np.testing.assert_array_equal(one_worker, three_workers)
+    # and repeated evaluations agree
+    np.testing.assert_array_equal(services(3, 7).submit('lunarlander', x[::-1])(), three_workers[::-1])
+
+
+def test_unseeded_lunarlander_is_noisy(services):
+    x = np.tile(HEURISTIC, (4, 1))
+    values = services(2, None).submit('lunarlander', x)()
+    assert values.shape == (4,)
+    assert len(np.unique(values)) > 1
+
+
+def test_lunarlander_episodes_are_averaged():
+    x = np.vstack([HEURISTIC, np.random.default_rng(1).uniform(size=(2, 12))])
+    service = MujocoServiceServicer(n_workers=2, seed=3, lunarlander_episodes=4)
+    try:
+        values = service.submit('lunarlander', x)()
+    finally:
+        service.workers.shutdown()
+    envs = [LunarLander() for _ in range(4)]
+    seeds = rollout_seeds(4, 3)
+    expected = [run_lunarlander_episodes(envs, np.tile(row, (4, 1)), seeds).mean() for row in x]
+    np.testing.assert_allclose(values, expected, rtol=1e-12)
+
+
+def test_lunarlander_survives_dead_workers(services):
+    service = services(2, 7)
+    x = np.vstack([HEURISTIC, np.random.default_rng(2).uniform(size=(3, 12))])
+    expected = service.submit('lunarlander', x)()
+    for process in list(service.workers.executor()._processes.values()):
+        process.kill()
+    np.testing.assert_array_equal(service.submit('lunarlander', x)(), expected)
+    assert service.workers.restarts == 1
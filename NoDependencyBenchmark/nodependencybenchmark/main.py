@@ -1,16 +1,26 @@
 import logging
+import threading
+from argparse import ArgumentParser
+from collections.abc import Iterator
+
+import grpc
 import numpy as np
 import os
-import subprocess
 import sys
-import tempfile
 from platform import machine
 
+from benchercommon.cache import cache_dir, copy_to, fetch, file_lock
+from benchercommon.packed import decode_points, encode_values
+from benchercommon.service import BenchmarkService
 from bencherscaffold.protoclasses.bencher_pb2 import BenchmarkRequest, EvaluationResult
-from bencherscaffold.protoclasses.grcp_service import GRCPService
 
-directory_file_descriptor = tempfile.TemporaryDirectory()
-directory_name = directory_file_descriptor.name
+from nodependencybenchmark.mopta import MoptaWorkerPool
+
+directory_name = cache_dir("mopta")
+
+# pinned SHA-256 digests of the MOPTA08 executables by file name, an executable without an entry is only downloaded with
+# BENCHER_ALLOW_UNPINNED=1
+MOPTA_SHA256: dict[str, str] = {}
 
 SUPPORTED_BENCHMARKS = [
     'mopta08',
@@ -37,9 +47,51 @@ def _pest_control_score(
         x: np.ndarray,
         seed=None
 ):
+    return _pest_control_score_batch(np.asarray(x)[np.newaxis, :], seed=seed)[0]
+
+
+def _seeded_beta(
+        seed: int,
+        a: float,
+        b: np.ndarray,
+        size: int
+) -> np.ndarray:
+    """
+    Draws `size` beta samples for every value in `b` from a fresh `RandomState(seed)`, as the seeded simulation does.
+
+    Every draw of the seeded simulation restarts the `RandomState`, so the samples only depend on the parameters and
+    each distinct value of `b` is drawn only once.
+
+    :param seed: The seed of the simulation.
+    :param a: The alpha parameter.
+    :param b: Array of shape (n,) with the beta parameters.
+    :param size: The number of samples per beta parameter.
+    :return: Array of shape (n, size).
+    """
+    unique_b, inverse = np.unique(b, return_inverse=True)
+    draws = np.array([np.random.RandomState(seed).beta(a, _b, size=(size,)) for _b in unique_b])
+    return draws.reshape(len(unique_b), size)[inverse.reshape(-1)]
+
+
+def _pest_control_score_batch(
+        x: np.ndarray,
+        seed=None
+) -> np.ndarray:
+    """
+    Simulate many pesticide schedules at once, with all simulations of all schedules in one array per stage.
+
+    Without a seed, all random numbers are drawn from one `np.random.Generator`. With a seed, the results are
+    bit-identical to the original per-schedule simulation, which draws every sample from a fresh `RandomState(seed)`.
+
+    :param x: Matrix of shape (batch, n_stages) with one pesticide schedule per row.
+    :param seed: Optional seed to make the simulation deterministic.
+    :return: Array of shape (batch,) with the score of each schedule.
+    """
+    x = np.asarray(x).astype(int)
     U = 0.1
-    n_stages = x.size
+    batch_size, n_stages = x.shape
     n_simulations = 100
+    rows = np.arange(batch_size)
 
     init_pest_frac_alpha = 1.0
     init_pest_frac_beta = 30.0
@@ -47,50 +99,66 @@ def _pest_control_score(
     spread_beta = 17.0 / 3.0
 
     control_alpha = 1.0
-    control_price_max_discount = {1: 0.2, 2: 0.3, 3: 0.3, 4: 0.0}
-    tolerance_develop_rate = {1: 1.0 / 7.0, 2: 2.5 / 7.0, 3: 2.0 / 7.0, 4: 0.5 / 7.0}
-    control_price = {1: 1.0, 2: 0.8, 3: 0.7, 4: 0.5}
-    # below two changes over stages according to x
-    control_beta = {1: 2.0 / 7.0, 2: 3.0 / 7.0, 3: 3.0 / 7.0, 4: 5.0 / 7.0}
+    # indexed by pesticide type, index 0 (no control) is unused
+    control_price_max_discount = np.array([0.0, 0.2, 0.3, 0.3, 0.0])
+    tolerance_develop_rate = np.array([0.0, 1.0 / 7.0, 2.5 / 7.0, 2.0 / 7.0, 0.5 / 7.0])
+    control_price = np.array([0.0, 1.0, 0.8, 0.7, 0.5])
+    # one row of control betas per schedule since they change over stages according to x
+    control_beta = np.tile(np.array([1.0, 2.0 / 7.0, 3.0 / 7.0, 3.0 / 7.0, 5.0 / 7.0]), (batch_size, 1))
+
+    # number of stages in which each pesticide type is used, per schedule
+    type_counts = np.stack([np.sum(x == t, axis=1) for t in range(5)], axis=1)
 
-    payed_price_sum = 0
-    above_threshold = 0
+    payed_price_sum = np.zeros(batch_size)
+    above_threshold = np.zeros(batch_size)
 
     if seed is not None:
+        rng = None
         init_pest_frac = np.random.RandomState(seed).beta(
             init_pest_frac_alpha,
             init_pest_frac_beta,
             size=(n_simulations,)
         )
+        curr_pest_frac = np.tile(init_pest_frac, (batch_size, 1))
+        # the same in every stage since the RandomState is reset for each draw
+        seeded_spread_rate = np.tile(
+            np.random.RandomState(seed).beta(spread_alpha, spread_beta, size=(n_simulations,)),
+            (batch_size, 1)
+        )
     else:
-        init_pest_frac = np.random.beta(init_pest_frac_alpha, init_pest_frac_beta, size=(n_simulations,))
-    curr_pest_frac = init_pest_frac
+        rng = np.random.default_rng()
+        curr_pest_frac = rng.beta(init_pest_frac_alpha, init_pest_frac_beta, size=(batch_size, n_simulations))
     for i in range(n_stages):
+        x_i = x[:, i]
+        do_control = x_i > 0
         if seed is not None:
-            spread_rate = np.random.RandomState(seed).beta(spread_alpha, spread_beta, size=(n_simulations,))
-        else:
-            spread_rate = np.random.beta(spread_alpha, spread_beta, size=(n_simulations,))
-        do_control = x[i] > 0
-        if do_control:
-            if seed is not None:
-                control_rate = np.random.RandomState(seed).beta(
-                    control_alpha,
-                    control_beta[x[i]],
-                    size=(n_simulations,)
-                )
-            else:
-                control_rate = np.random.beta(control_alpha, control_beta[x[i]], size=(n_simulations,))
-            next_pest_frac = _pest_spread(curr_pest_frac, spread_rate, control_rate, True)
-            # torelance has been developed for pesticide type 1
-            control_beta[x[i]] += tolerance_develop_rate[x[i]] / float(n_stages)
-            # you will get discount
-            payed_price = control_price[x[i]] * (
-                    1.0 - control_price_max_discount[x[i]] / float(n_stages) * float(np.sum(x == x[i])))
+            spread_rate = seeded_spread_rate
+            control_rate = np.zeros((batch_size, n_simulations))
+            control_rate[do_control] = _seeded_beta(
+                seed,
+                control_alpha,
+                control_beta[rows, x_i][do_control],
+                n_simulations
+            )
         else:
-            next_pest_frac = _pest_spread(curr_pest_frac, spread_rate, 0, False)
-            payed_price = 0
-        payed_price_sum += payed_price
-        above_threshold += np.mean(curr_pest_frac > U)
+            spread_rate = rng.beta(spread_alpha, spread_beta, size=(batch_size, n_simulations))
+            control_rate = rng.beta(
+                control_alpha,
+                control_beta[rows, x_i][:, np.newaxis],
+                size=(batch_size, n_simulations)
+            )
+        next_pest_frac = np.where(
+            do_control[:, np.newaxis],
+            _pest_spread(curr_pest_frac, spread_rate, control_rate, True),
+            _pest_spread(curr_pest_frac, spread_rate, 0, False)
+        )
+        # torelance has been developed for the used pesticide types
+        control_beta[rows, x_i] += np.where(do_control, tolerance_develop_rate[x_i] / float(n_stages), 0.0)
+        # you will get discount
+        payed_price = control_price[x_i] * (
+                1.0 - control_price_max_discount[x_i] / float(n_stages) * type_counts[rows, x_i].astype(float))
+        payed_price_sum += np.where(do_control, payed_price, 0.0)
+        above_threshold += np.mean(curr_pest_frac > U, axis=1)
         curr_pest_frac = next_pest_frac
 
     return payed_price_sum + above_threshold
@@ -105,36 +173,44 @@ def download_mopta_executable(
     :param executable_name: The name of the executable file to be downloaded.
     :return: None
 
-    This method downloads the specified MOPTA executable file from a remote server. If the executable file does not exist in the specified directory, it will be downloaded and saved there
-    *. The file will be downloaded using the provided `executable_name` and stored in the `directory_name` directory.
+    This method downloads the specified MOPTA executable file into the persistent cache if it is not there yet. The
+    download is checksum-verified against `MOPTA_SHA256` and the executable is stored in the `directory_name`
+    directory of the cache.
 
     Example usage:
         download_mopta_executable("mopta.exe")
 
-    This will download the executable file "mopta.exe" and save it in the current working directory.
+    This will download the executable file "mopta.exe" and save it in the cache directory.
     """
-
-    if not os.path.exists(os.path.join(directory_name, executable_name)):
-        print(f"{executable_name} not found. Downloading...")
-        url = f"http://mopta-executables.s3-website.eu-north-1.amazonaws.com/{executable_name}"
-        print(f"Downloading {url}")
-
-        import requests
-        response = requests.get(url, verify=False)
-
-        with open(os.path.join(directory_name, executable_name), "wb") as file:
-            file.write(response.content)
-        # make executable
-        os.chmod(os.path.join(directory_name, executable_name), 0o755)
-        print(f"Downloaded {executable_name}")
-
-
-class NoDependencyServiceServicer(GRCPService):
+    executable_path = os.path.join(directory_name, executable_name)
+    with file_lock(executable_name):
+        if not os.path.exists(executable_path):
+            print(f"{executable_name} not found. Downloading...")
+            blob = fetch(
+                f"http://mopta-executables.s3-website.eu-north-1.amazonaws.com/{executable_name}",
+                sha256=MOPTA_SHA256.get(executable_name)
+            )
+            with open(blob, "rb") as src:
+                copy_to(src, executable_path)
+            # make executable
+            os.chmod(executable_path, 0o755)
+            print(f"Downloaded {executable_name}")
+
+
+class NoDependencyServiceServicer(BenchmarkService):
 
     def __init__(
-            self
+            self,
+            n_workers: int = os.cpu_count(),
+            port: int = 50054
     ):
-        super().__init__(port=50054, n_cores=1)
+        """
+        :param n_workers: The number of MOPTA08 evaluations that may run in parallel.
+        :param port: The port number to start the service on.
+        """
+        # a few extra threads so that pestcontrol requests are not blocked by running MOPTA08 evaluations
+        super().__init__(port=port, n_cores=n_workers + 4)
+        self.n_workers = n_workers
 
         self.sysarch = 64 if sys.maxsize > 2 ** 32 else 32
         self.machine = machine().lower()
@@ -158,8 +234,36 @@ class NoDependencyServiceServicer(GRCPService):
             directory_name, self._mopta_exectutable_basename
         )
 
-        self.directory_file_descriptor = tempfile.TemporaryDirectory()
-        self.directory_name = self.directory_file_descriptor.name
+        # created on first use since it needs the executable
+        self._mopta_pool = None
+        self._mopta_pool_lock = threading.Lock()
+
+    def mopta_pool(
+            self
+    ) -> MoptaWorkerPool:
+        """
+        Returns the MOPTA08 worker pool, downloading the executable and creating the pool on first use.
+
+        :return: The worker pool.
+        :rtype: MoptaWorkerPool
+        """
+        with self._mopta_pool_lock:
+            if self._mopta_pool is None:
+                download_mopta_executable(self._mopta_exectutable_basename)
+                self._mopta_pool = MoptaWorkerPool(self._mopta_exectutable, self.n_workers)
+            return self._mopta_pool
+
+    def close(
+            self
+    ):
+        """
+        Removes the working directories of the MOPTA08 worker pool, which are on tmpfs and outlive the process
+        otherwise. Called by `serve` when the server terminates, including on SIGTERM.
+        """
+        with self._mopta_pool_lock:
+            if self._mopta_pool is not None:
+                self._mopta_pool.close()
+                self._mopta_pool = None
 
     def evaluate_point(
             self,
@@ -187,7 +291,6 @@ class NoDependencyServiceServicer(GRCPService):
 
         match request.benchmark.name:
             case "mopta08":
-                download_mopta_executable(self._mopta_exectutable_basename)
                 # mopta is in [0, 1]^n so we don't need to scale
                 fun = self.eval_mopta08
             case "pestcontrol":
@@ -200,6 +303,93 @@ class NoDependencyServiceServicer(GRCPService):
         )
         return result
 
+    def evaluate_batch(
+            self,
+            request_iterator: Iterator[BenchmarkRequest],
+            context
+    ) -> Iterator[EvaluationResult]:
+        """
+        Evaluate a stream of points and stream back one result per point, in request order.
+
+        All pestcontrol points are simulated together with `_pest_control_score_batch`; mopta08 points are evaluated
+        in parallel by the MOPTA08 worker pool.
+
+        :param request_iterator: The benchmark requests to evaluate, possibly for different benchmarks.
+        :type request_iterator: Iterator[BenchmarkRequest]
+        :param context: The evaluation context.
+        :type context: Any
+        :return: The evaluation results.
+        :rtype: Iterator[EvaluationResult]
+        """
+        requests = list(request_iterator)
+        values = np.zeros(len(requests))
+
+        pestcontrol_indices = []
+        mopta_indices = []
+        for i, request in enumerate(requests):
+            assert request.benchmark.name in SUPPORTED_BENCHMARKS, "Invalid benchmark name"
+            if request.benchmark.name == "pestcontrol":
+                pestcontrol_indices.append(i)
+            else:
+                mopta_indices.append(i)
+
+        if len(mopta_indices) > 0:
+            x = np.array([[v.value for v in requests[i].point.values] for i in mopta_indices])
+            values[mopta_indices] = self.evaluate_matrix("mopta08", x)
+
+        if len(pestcontrol_indices) > 0:
+            x = np.array([[v.value for v in requests[i].point.values] for i in pestcontrol_indices])
+            values[pestcontrol_indices] = self.evaluate_matrix("pestcontrol", x)
+
+        for value in values:
+            yield EvaluationResult(
+                value=value
+            )
+
+    def evaluate_matrix(
+            self,
+            benchmark_name: str,
+            x: np.ndarray
+    ) -> np.ndarray:
+        """
+        Evaluate all rows of a matrix, pestcontrol with `_pest_control_score_batch` and mopta08 with the worker pool.
+
+        :param benchmark_name: The name of the benchmark.
+        :type benchmark_name: str
+        :param x: Matrix of shape (n_points, dimension).
+        :type x: np.ndarray
+        :return: Array of shape (n_points,) with the value of each row.
+        :rtype: np.ndarray
+        """
+        match benchmark_name:
+            case "mopta08":
+                return self.mopta_pool().evaluate_batch(x)
+            case "pestcontrol":
+                return _pest_control_score_batch(x.astype(int))
+            case _:
+                raise ValueError("Invalid benchmark name")
+
+    def evaluate_packed(
+            self,
+            request: bytes,
+            context
+    ) -> bytes:
+        """
+        Evaluate the points of a packed request, see `benchercommon.packed`.
+
+        :param request: The packed request.
+        :type request: bytes
+        :param context: The evaluation context.
+        :type context: Any
+        :return: The packed float64 array with the value of each point.
+        :rtype: bytes
+        """
+        try:
+            benchmark_name, x = decode_points(request)
+        except ValueError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+        return encode_values(self.evaluate_matrix(benchmark_name, x))
+
     def eval_mopta08(
             self,
             x: np.ndarray
@@ -212,38 +402,43 @@ class NoDependencyServiceServicer(GRCPService):
         :return: The evaluated result.
         :rtype: float
         """
-        x = x.squeeze()
-        assert x.ndim == 1
-        # write input to file in dir
-        with open(os.path.join(self.directory_name, "input.txt"), "w+") as tmp_file:
-            for _x in x:
-                tmp_file.write(f"{_x}\n")
-        # pass directory as working directory to process
-        popen = subprocess.Popen(
-            self._mopta_exectutable,
-            stdout=subprocess.PIPE,
-            cwd=self.directory_name,
-        )
-        popen.wait()
-        # read and parse output file
-        output = (
-            open(os.path.join(self.directory_name, "output.txt"), "r")
-            .read()
-            .split("\n")
-        )
-        output = [x.strip() for x in output]
-        output = np.array([float(x) for x in output if len(x) > 0])
-        value = output[0]
-        constraints = output[1:]
-        # see https://arxiv.org/pdf/2103.00349.pdf E.7
-        return float(value + 10 * np.sum(np.clip(constraints, a_min=0, a_max=None)))
+        return self.mopta_pool().evaluate(x)
 
 
 def serve():
+    argparse = ArgumentParser()
+    argparse.add_argument(
+        '-p',
+        '--port',
+        type=int,
+        required=False,
+        help='The port number to start the service on. Default is 50054.',
+        default=50054
+    )
+    argparse.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        required=False,
+        help='The number of MOPTA08 evaluations to run in parallel. Default is cpu_count()',
+        default=os.cpu_count()
+    )
+    args = argparse.parse_args()
+
     logging.basicConfig()
-    nodep = NoDependencyServiceServicer()
+    nodep = NoDependencyServiceServicer(n_workers=args.workers, port=args.port)
     nodep.serve()
 
 
+def prefetch():
+    """
+    Downloads the MOPTA executable for this machine into the persistent cache.
+    """
+    logging.basicConfig()
+    nodep = NoDependencyServiceServicer()
+    download_mopta_executable(nodep._mopta_exectutable_basename)
+    print("Prefetched mopta08")
+
+
 if __name__ == '__main__':
     serve()
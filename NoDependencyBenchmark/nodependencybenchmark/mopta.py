@@ -0,0 +1,101 @@
+import os
+import queue
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class MoptaWorkerPool:
+    """
+    Runs the MOPTA08 executable in a fixed number of isolated working directories.
+
+    The executable reads `input.txt` and writes `output.txt` in its working directory, so two evaluations must never
+    share a directory. The pool creates one directory per worker (on tmpfs if `/dev/shm` is available) and a bounded
+    executor hands out a free directory to every evaluation, so up to `n_workers` MOPTA processes run in parallel.
+    """
+
+    def __init__(
+            self,
+            executable: str,
+            n_workers: int
+    ):
+        """
+        :param executable: Path to the MOPTA08 executable.
+        :param n_workers: Maximum number of MOPTA08 processes running at the same time.
+        """
+        self.executable = executable
+        self.n_workers = n_workers
+        self._root = tempfile.TemporaryDirectory(
+            prefix="mopta08-",
+            dir="/dev/shm" if os.path.isdir("/dev/shm") else None
+        )
+        self._directories = queue.Queue()
+        for i in range(n_workers):
+            directory = os.path.join(self._root.name, f"worker-{i}")
+            os.mkdir(directory)
+            self._directories.put(directory)
+        self._executor = ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix="mopta08")
+
+    def _run(
+            self,
+            x: np.ndarray
+    ) -> float:
+        directory = self._directories.get()
+        try:
+            # write input to file in dir
+            with open(os.path.join(directory, "input.txt"), "w") as tmp_file:
+                tmp_file.write("".join(f"{_x}\n" for _x in x))
+            # pass directory as working directory to process
+            subprocess.run(
+                self.executable,
+                stdout=subprocess.DEVNULL,
+                cwd=directory,
+                check=True,
+            )
+            # read and parse output file
+            output = np.fromfile(os.path.join(directory, "output.txt"), dtype=np.float64, sep=" ")
+            os.remove(os.path.join(directory, "output.txt"))
+        finally:
+            self._directories.put(directory)
+        value = output[0]
+        constraints = output[1:]
+        # see https://arxiv.org/pdf/2103.00349.pdf E.7
+        return float(value + 10 * np.sum(np.clip(constraints, a_min=0, a_max=None)))
+
+    def evaluate(
+            self,
+            x: np.ndarray
+    ) -> float:
+        """
+        Evaluate a single point.
+
+        :param x: Input array of shape (124,).
+        :return: The objective value plus the penalty for the violated constraints.
+        """
+        x = x.squeeze()
+        assert x.ndim == 1
+        return self._executor.submit(self._run, x).result()
+
+    def evaluate_batch(
+            self,
+            x: np.ndarray
+    ) -> np.ndarray:
+        """
+        Evaluate many points, running up to `n_workers` of them in parallel.
+
+        :param x: Input array of shape (batch, 124).
+        :return: Array of shape (batch,) with the value of each point.
+        """
+        assert x.ndim == 2
+        return np.fromiter(self._executor.map(self._run, x), dtype=np.float64, count=len(x))
+
+    def close(
+            self
+    ):
+        """
+        Waits for the running evaluations and removes the working directories.
+        """
+        self._executor.shutdown()
+        self._root.cleanup()
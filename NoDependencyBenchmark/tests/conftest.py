@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# keep the benchmark data cache of the tests away from the user's cache
+os.environ.setdefault("BENCHER_CACHE_DIR", tempfile.mkdtemp(prefix="bencher-test-cache-"))
@@ -0,0 +1,27 @@
+import os
+import stat
+
+import numpy as np
+
+from nodependencybenchmark.mopta import MoptaWorkerPool
+
+
+def fake_executable(
+        tmp_path
+) -> str:
+    # writes the sum of the inputs as value, followed by one satisfied and one violated constraint
+    path = tmp_path / "mopta08"
+    path.write_text("#!/bin/sh\nawk '{s += $1} END {print s, -1, 0.5}' input.txt > output.txt\n")
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def test_pool_evaluates_and_removes_its_directories(tmp_path):
+    pool = MoptaWorkerPool(fake_executable(tmp_path), n_workers=2)
+    root = pool._root.name
+    assert len(os.listdir(root)) == 2
+    x = np.random.RandomState(0).rand(5, 124)
+    np.testing.assert_allclose(pool.evaluate_batch(x), x.sum(axis=1) + 5.0, rtol=1e-5)
+    np.testing.assert_allclose(pool.evaluate(x[:1]), x[0].sum() + 5.0, rtol=1e-5)
+    pool.close()
+    assert not os.path.exists(root)
@@ -0,0 +1,62 @@
+import numpy as np
+
+from nodependencybenchmark.main import _pest_control_score, _pest_control_score_batch
+
+
+def reference_pest_control_score(
+        x: np.ndarray,
+        seed: int
+) -> float:
+    # the original per-schedule simulation, https://github.com/aryandeshwal/BODi/blob/main/bodi/pestcontrol.py
+    U = 0.1
+    n_stages = x.size
+    n_simulations = 100
+    control_price_max_discount = {1: 0.2, 2: 0.3, 3: 0.3, 4: 0.0}
+    tolerance_develop_rate = {1: 1.0 / 7.0, 2: 2.5 / 7.0, 3: 2.0 / 7.0, 4: 0.5 / 7.0}
+    control_price = {1: 1.0, 2: 0.8, 3: 0.7, 4: 0.5}
+    control_beta = {1: 2.0 / 7.0, 2: 3.0 / 7.0, 3: 3.0 / 7.0, 4: 5.0 / 7.0}
+
+    payed_price_sum = 0
+    above_threshold = 0
+    curr_pest_frac = np.random.RandomState(seed).beta(1.0, 30.0, size=(n_simulations,))
+    for i in range(n_stages):
+        spread_rate = np.random.RandomState(seed).beta(1.0, 17.0 / 3.0, size=(n_simulations,))
+        if x[i] > 0:
+            control_rate = np.random.RandomState(seed).beta(1.0, control_beta[x[i]], size=(n_simulations,))
+            next_pest_frac = (1.0 - control_rate) * curr_pest_frac
+            control_beta[x[i]] += tolerance_develop_rate[x[i]] / float(n_stages)
+            payed_price = control_price[x[i]] * (
+                    1.0 - control_price_max_discount[x[i]] / float(n_stages) * float(np.sum(x == x[i])))
+        else:
+            next_pest_frac = spread_rate * (1 - curr_pest_frac) + curr_pest_frac
+            payed_price = 0
+        payed_price_sum += payed_price
+        above_threshold += np.mean(curr_pest_frac > U)
+        curr_pest_frac = next_pest_frac
+    return payed_price_sum + above_threshold
+
+
+def test_seeded_batch_matches_original_simulation():
+    rng = np.random.default_rng(0)
+    x = rng.integers(0, 5, size=(64, 25))
+    # rows without control and with a single pesticide type
+    x[0] = 0
+    x[1] = 3
+
+    for seed in [0, 1, 1234]:
+        batch = _pest_control_score_batch(x, seed=seed)
+        np.testing.assert_array_equal(batch, [reference_pest_control_score(row, seed) for row in x])
+        np.testing.assert_array_equal(batch, [_pest_control_score(row, seed=seed) for row in x])
+
+
+def test_unseeded_batch_matches_scalar_distribution():
+    x = np.random.default_rng(1).integers(0, 5, size=25)
+    n = 400
+    batch = _pest_control_score_batch(np.tile(x, (n, 1)))
+    scalar = np.array([_pest_control_score(x) for _ in range(n)])
+
+    assert batch.shape == (n,)
+    # the rows are independent simulations, not copies of one
+    assert len(np.unique(batch)) > 1
+    standard_error = np.sqrt((batch.var() + scalar.var()) / n)
+    assert abs(batch.mean() - scalar.mean()) < 5 * standard_error
@@ -0,0 +1,63 @@
+import threading
+from typing import Callable, Dict, NamedTuple, Tuple
+
+import numpy as np
+
+
+class SvmDataset(NamedTuple):
+    X_train: np.ndarray
+    y_train: np.ndarray
+    X_test: np.ndarray
+    y_test: np.ndarray
+
+
+class DatasetRegistry:
+    """
+    Keeps the train/test split of every SVM benchmark resident once it has been loaded.
+
+    Each split is loaded at most once, even if several requests ask for it at the same time, and loading one split does
+    not block requests for the other. Once loaded, a split is returned without taking any lock; the arrays must be
+    treated as read-only since all requests share them.
+    """
+
+    def __init__(
+            self,
+            loaders: Dict[str, Callable[[], Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]]
+    ):
+        """
+        :param loaders: Maps each benchmark name to a function returning its split (X_train, y_train, X_test, y_test).
+        """
+        self.loaders = loaders
+        self._datasets: Dict[str, SvmDataset] = {}
+        self._load_locks = {name: threading.Lock() for name in loaders}
+
+    def get(
+            self,
+            name: str
+    ) -> SvmDataset:
+        """
+        Returns the split of a benchmark, loading it if necessary.
+
+        :param name: The name of the benchmark.
+        :return: The split of the benchmark.
+        """
+        # reading a dict is atomic, so the hot path needs no lock
+        dataset = self._datasets.get(name)
+        if dataset is not None:
+            return dataset
+        with self._load_locks[name]:
+            dataset = self._datasets.get(name)
+            if dataset is None:
+                dataset = SvmDataset(*self.loaders[name]())
+                self._datasets[name] = dataset
+                print(f"Loaded {name}: {dataset.X_train.shape[0]} training and {dataset.X_test.shape[0]} test points")
+        return dataset
+
+    def preload(
+            self
+    ):
+        """
+        Loads the splits of all benchmarks.
+        """
+        for name in self.loaders:
+            self.get(name)
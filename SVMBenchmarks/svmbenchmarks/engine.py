@@ -0,0 +1,350 @@
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+import numpy as np
+from sklearn.svm import SVR
+
+from svmbenchmarks.datasets import SvmDataset
+
+
+def svr_hyperparameters(
+        x: np.ndarray
+) -> Tuple[float, float, float]:
+    """
+    Maps the last three coordinates of a point in [0, 1] to the SVR hyperparameters.
+
+    :param x: The point.
+    :return: The tuple (C, gamma, epsilon).
+    """
+    C = 0.01 * (500 ** x[-1])
+    gamma = 0.1 * (30 ** x[-2])
+    epsilon = 0.01 * (100 ** x[-3])
+    return C, gamma, epsilon
+
+
+class ArrayCache:
+    """
+    LRU cache of read-only arrays, bounded by the total number of bytes of the cached arrays.
+    """
+
+    def __init__(
+            self,
+            max_bytes: int
+    ):
+        """
+        :param max_bytes: The largest total size of the cached arrays. Arrays larger than this are not cached.
+        """
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        # the number of lookups that found and did not find their arrays
+        self.hits = 0
+        self.misses = 0
+        self._arrays: OrderedDict[Hashable, Tuple[np.ndarray, ...]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(
+            self,
+            key: Hashable
+    ) -> Optional[Tuple[np.ndarray, ...]]:
+        """
+        :param key: The key of the arrays.
+        :return: The cached arrays, or None if they are not cached.
+        """
+        with self._lock:
+            arrays = self._arrays.get(key)
+            if arrays is not None:
+                self._arrays.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return arrays
+
+    def put(
+            self,
+            key: Hashable,
+            arrays: Tuple[np.ndarray, ...]
+    ):
+        """
+        Caches arrays, evicting the least recently used ones until they fit.
+
+        :param key: The key of the arrays.
+        :param arrays: The arrays, which must not be modified afterwards.
+        """
+        n_bytes = sum(array.nbytes for array in arrays)
+        if n_bytes > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._arrays.pop(key, None)
+            if previous is not None:
+                self.n_bytes -= sum(array.nbytes for array in previous)
+            self._arrays[key] = arrays
+            self.n_bytes += n_bytes
+            while self.n_bytes > self.max_bytes:
+                _, evicted = self._arrays.popitem(last=False)
+                self.n_bytes -= sum(array.nbytes for array in evicted)
+
+    def keys(
+            self
+    ) -> list:
+        """
+        :return: The keys of the cached arrays, from least to most recently used.
+        """
+        with self._lock:
+            return list(self._arrays)
+
+
+class SvmMixedEngine:
+    """
+    Evaluates the `svmmixed` benchmark: fits an RBF SVR on the selected features and returns its test RMSE.
+
+    Bayesian optimization over the feature-selection bits revisits the same subsets, so everything that only depends on
+    the subset is cached under the selection mask: the C-contiguous columns of the subset and, with
+    `precomputed_kernel`, the squared distances of the train points to each other and of the test points to the train
+    points. The kernel of a point then only takes ``exp(-gamma * distances)``. The distances are computed in float64
+    and stored in float32, which halves the cache and changes the kernel values by less than 1e-7. The RMSE of every
+    evaluated point is cached as well, keyed by the mask and the three hyperparameters.
+    """
+
+    def __init__(
+            self,
+            dataset: SvmDataset,
+            precomputed_kernel: bool = True,
+            max_cache_bytes: int = 1024 * 1024 * 1024,
+            max_cached_results: int = 4096,
+            chunk_rows: int = 1024
+    ):
+        """
+        :param dataset: The split of the `svmmixed` benchmark.
+        :param precomputed_kernel: Whether to fit on precomputed kernel matrices. If False, libsvm computes the kernel
+            from the selected columns, as the original benchmark does.
+        :param max_cache_bytes: The largest total size of the cached columns and distances. The distances of a subset
+            of the `svmmixed` split (5000 train and 5000 test points) take 200 MB, so the default holds 5 subsets.
+        :param max_cached_results: The number of RMSEs that are kept.
+        :param chunk_rows: The number of rows of the float64 distance and test kernel matrices that are held in memory
+            at a time.
+        """
+        self.dataset = dataset
+        self.precomputed_kernel = precomputed_kernel
+        self.max_cached_results = max_cached_results
+        self.chunk_rows = chunk_rows
+        self._y_train = np.ascontiguousarray(dataset.y_train)
+        self._y_test = np.ascontiguousarray(dataset.y_test)
+        # keys: ('columns', mask) or ('distances', mask), with mask the bytes of the boolean mask
+        self._arrays = ArrayCache(max_cache_bytes)
+        # structure: {mask and hyperparameters as bytes: RMSE}
+        self._results: OrderedDict[bytes, float] = OrderedDict()
+        self._results_lock = threading.Lock()
+
+    def columns(
+            self,
+            mask: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :param mask: Boolean mask of the selected features.
+        :return: The C-contiguous train and test points restricted to the selected features.
+        """
+        key = ('columns', mask.tobytes())
+        columns = self._arrays.get(key)
+        if columns is None:
+            inds_selected = np.where(mask)[0]
+            columns = (
+                np.ascontiguousarray(self.dataset.X_train[:, inds_selected]),
+                np.ascontiguousarray(self.dataset.X_test[:, inds_selected]),
+            )
+            for array in columns:
+                array.setflags(write=False)
+            self._arrays.put(key, columns)
+        return columns
+
+    def squared_distances(
+            self,
+            mask: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the squared distances of the train and test points to the train points, in the selected features.
+
+        :param mask: Boolean mask of the selected features.
+        :return: The read-only float32 matrices of shape (n_train, n_train) and (n_test, n_train).
+        """
+        key = ('distances', mask.tobytes())
+        distances = self._arrays.get(key)
+        if distances is None:
+            X_train, X_test = self.columns(mask)
+            # scaling the small factor saves a pass over the products, and is exact
+            X_train_T = -2 * X_train.T
+            train_norms = np.einsum('ij,ij->i', X_train, X_train)
+            distances = tuple(self._squared_distances(X, X_train_T, train_norms) for X in (X_train, X_test))
+            for array in distances:
+                array.setflags(write=False)
+            self._arrays.put(key, distances)
+        return distances
+
+    def _squared_distances(
+            self,
+            X: np.ndarray,
+            X_train_T: np.ndarray,
+            train_norms: np.ndarray
+    ) -> np.ndarray:
+        """
+        :param X: The points, restricted to the selected features.
+        :param X_train_T: The train points restricted to the selected features, transposed and multiplied by -2.
+        :param train_norms: The squared norms of the train points.
+        :return: The float32 matrix of shape (len(X), n_train), computed in float64 a chunk of rows at a time.
+        """
+        distances = np.empty((X.shape[0], X_train_T.shape[1]), dtype=np.float32)
+        for start in range(0, X.shape[0], self.chunk_rows):
+            chunk = X[start:start + self.chunk_rows]
+            block = chunk @ X_train_T
+            block += np.einsum('ij,ij->i', chunk, chunk)[:, np.newaxis]
+            block += train_norms[np.newaxis, :]
+            # rounding can make distances of (almost) identical points slightly negative
+            np.maximum(block, 0, out=block)
+            distances[start:start + self.chunk_rows] = block
+        return distances
+
+    def _kernel(
+            self,
+            distances: np.ndarray,
+            gamma: float
+    ) -> np.ndarray:
+        """
+        :param distances: Float32 squared distances.
+        :param gamma: The gamma of the RBF kernel.
+        :return: The float64 matrix ``exp(-gamma * distances)``, as libsvm takes it without a copy.
+        """
+        kernel = distances.astype(np.float64)
+        kernel *= -gamma
+        return np.exp(kernel, out=kernel)
+
+    def evaluate(
+            self,
+            x: np.ndarray
+    ) -> float:
+        """
+        :param x: The point: one binary feature-selection coordinate per feature followed by epsilon, gamma, and C in
+            [0, 1].
+        :return: The RMSE of the SVR model on the test data, or 1.0 if no feature is selected.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        mask = x[:-3] == 1
+        if not mask.any():
+            return 1.0
+        result_key = mask.tobytes() + x[-3:].tobytes()
+        with self._results_lock:
+            error = self._results.get(result_key)
+            if error is not None:
+                self._results.move_to_end(result_key)
+                return error
+
+        C, gamma, epsilon = svr_hyperparameters(x)
+        if self.precomputed_kernel:
+            train_distances, test_distances = self.squared_distances(mask)
+            svr = SVR(kernel='precomputed', epsilon=epsilon, C=C, tol=0.001)
+            svr.fit(self._kernel(train_distances, gamma), self._y_train)
+            pred = np.concatenate([
+                svr.predict(self._kernel(test_distances[start:start + self.chunk_rows], gamma))
+                for start in range(0, test_distances.shape[0], self.chunk_rows)
+            ])
+        else:
+            X_train, X_test = self.columns(mask)
+            svr = SVR(gamma=gamma, epsilon=epsilon, C=C, cache_size=1500, tol=0.001)
+            svr.fit(X_train, self._y_train)
+            pred = svr.predict(X_test)
+        error = float(np.sqrt(np.mean(np.square(pred - self._y_test))))
+
+        if self.max_cached_results > 0:
+            with self._results_lock:
+                self._results[result_key] = error
+                while len(self._results) > self.max_cached_results:
+                    self._results.popitem(last=False)
+        return error
+
+
+class SvrEngine:
+    """
+    Evaluates the `svm` benchmark: fits an RBF SVR with per-feature length scales and returns its test RMSE.
+
+    With `precomputed_kernel`, the SVR is given the kernel matrices instead of the scaled features. The squared
+    distances under the length scales of a point are
+    ``sum_d w_d (a_d - b_d)^2 = a^2 w + b^2 w - 2 (a * w) b``, with ``w = 1 / length_scale^2``, so the squared
+    features are computed once and the distances of all train and test points to the train points take a single
+    matrix product. The distances of the most recent length scales are cached, up to `max_cache_bytes`, so points that
+    only differ in C, gamma, or epsilon skip the product as well. libsvm as wrapped by scikit-learn cannot be initialized with a dual
+    solution, so every fit starts from scratch.
+    """
+
+    def __init__(
+            self,
+            dataset: SvmDataset,
+            precomputed_kernel: bool = True,
+            max_cache_bytes: int = 64 * 1024 * 1024
+    ):
+        """
+        :param dataset: The split of the `svm` benchmark.
+        :param precomputed_kernel: Whether to fit on precomputed kernel matrices. If False, libsvm computes the kernel
+            from the scaled features, as the original benchmark does.
+        :param max_cache_bytes: The largest total size of the cached distance matrices. A matrix of the `svm` split
+            (250 train and 250 test points) takes 1 MB.
+        """
+        self.dataset = dataset
+        self.precomputed_kernel = precomputed_kernel
+        self.n_train = dataset.X_train.shape[0]
+        self._y_train = np.ascontiguousarray(dataset.y_train)
+        self._y_test = np.ascontiguousarray(dataset.y_test)
+        # train points first, then test points
+        self._X_all = np.concatenate([dataset.X_train, dataset.X_test])
+        self._X_all_squared = np.square(self._X_all)
+        self._X_train_T = np.ascontiguousarray(dataset.X_train.T)
+        # keys: length-scale exponents as bytes, values: squared distances of all points to the train points
+        self._distances = ArrayCache(max_cache_bytes)
+
+    def squared_distances(
+            self,
+            exponents: np.ndarray
+    ) -> np.ndarray:
+        """
+        Returns the squared distances under the length scales ``exp(exponents)``.
+
+        :param exponents: The logarithms of the length scales, one per feature.
+        :return: Read-only matrix of shape (n_train + n_test, n_train) with the squared distance of every train and
+            test point to every train point.
+        """
+        key = exponents.tobytes()
+        cached = self._distances.get(key)
+        if cached is not None:
+            return cached[0]
+
+        weights = np.exp(-2 * exponents)
+        norms = self._X_all_squared @ weights
+        distances = (self._X_all * weights) @ self._X_train_T
+        distances *= -2
+        distances += norms[:, np.newaxis]
+        distances += norms[np.newaxis, :self.n_train]
+        # rounding can make distances of (almost) identical points slightly negative
+        np.maximum(distances, 0, out=distances)
+        distances.setflags(write=False)
+        self._distances.put(key, (distances,))
+        return distances
+
+    def evaluate(
+            self,
+            x: np.ndarray
+    ) -> float:
+        """
+        :param x: The point: 385 length-scale coordinates followed by epsilon, gamma, and C, all in [0, 1].
+        :return: The RMSE of the SVR model on the test data.
+        """
+        C, gamma, epsilon = svr_hyperparameters(x)
+        exponents = 4 * x[:-3] - 2
+        if self.precomputed_kernel:
+            kernel = np.exp(-gamma * self.squared_distances(exponents))
+            svr = SVR(kernel='precomputed', epsilon=epsilon, C=C, tol=0.001)
+            svr.fit(kernel[:self.n_train], self._y_train)
+            pred = svr.predict(kernel[self.n_train:])
+        else:
+            length_scales = np.exp(exponents)
+            svr = SVR(gamma=gamma, epsilon=epsilon, C=C, cache_size=1500, tol=0.001)
+            svr.fit(self.dataset.X_train / length_scales, self._y_train)
+            pred = svr.predict(self.dataset.X_test / length_scales)
+        return float(np.sqrt(np.mean(np.square(pred - self._y_test))))
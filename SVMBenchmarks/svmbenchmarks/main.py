@@ -1,60 +1,87 @@
+import atexit
 import logging
 import lzma
+import multiprocessing
 import os
-import tempfile
 import threading
-from typing import Optional, Callable, Tuple
+from argparse import ArgumentParser
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Callable, Tuple, Union
 
+import grpc
 import math
 import numpy as np
+from benchercommon.cache import atomic_write, cache_dir, fetch, file_lock
+from benchercommon.packed import decode_points, encode_values
+from benchercommon.service import BenchmarkService, WorkerPool
 from bencherscaffold.protoclasses.bencher_pb2 import BenchmarkRequest, EvaluationResult
-from bencherscaffold.protoclasses.grcp_service import GRCPService
 from numpy.random import RandomState
 from sklearn.preprocessing import MinMaxScaler
-from sklearn.svm import SVR
 
-directory_file_descriptor = tempfile.TemporaryDirectory()
-directory_name = directory_file_descriptor.name
-lock = threading.Lock()
+from svmbenchmarks.datasets import DatasetRegistry
+from svmbenchmarks.engine import SvmMixedEngine, SvrEngine
+from svmbenchmarks.workers import SharedDatasets, _evaluate, _init_worker
+
+directory_name = cache_dir("svm")
+
+SLICE_URL = "http://mopta-executables.s3-website.eu-north-1.amazonaws.com/slice_localization_data.csv.xz"
+# pinned SHA-256 digest of the archive, if None it is only downloaded with BENCHER_ALLOW_UNPINNED=1
+SLICE_SHA256: Optional[str] = None
+
+# memory of one worker process: the caches of its engines and the kernel matrices of the models it fits
+WORKER_MEMORY_BYTES = 2 * 1024 ** 3
+# the default number of worker processes is at most this
+MAX_DEFAULT_WORKERS = 4
+
+# bump when the preprocessing of a split changes, so that stale splits in the cache are not used
+SPLIT_VERSION = 1
+SPLIT_PARTS = ("X_train", "y_train", "X_test", "y_test")
 
 
 def download_slice_localization_data():
     """
-    Downloads the slice localization data from a specified URL and saves it locally.
+    Downloads the slice localization data into the persistent cache and returns the features and targets.
+
+    The parsed arrays are stored as `.npy` files in the cache, so the CSV is only parsed once.
 
-    :return: None
+    :return: A tuple (X, y) with the 385 features and the target of every sample, as read-only memory-mapped arrays.
     """
-    if not os.path.exists(os.path.join(directory_name, "slice_localization_data.csv")):
-        print(f"{os.path.join(directory_name, 'slice_localization_data.csv')} not found. Downloading...")
-        url = "http://mopta-executables.s3-website.eu-north-1.amazonaws.com/slice_localization_data.csv.xz"
-        print(f"Downloading {url}")
-        import requests
-        response = requests.get(url, verify=False)
-
-        # save the .xz file
-        with open(os.path.join(directory_name, "slice_localization_data.csv.xz"), "wb") as out:
-            out.write(response.content)
-        # unpack the data
-        with lzma.open(os.path.join(directory_name, "slice_localization_data.csv.xz"), "rb") as f, open(
-                os.path.join(directory_name, "slice_localization_data.csv"), "wt"
-        ) as out:
-            out.write(f.read().decode("utf-8"))
-
-        print(f"Downloaded slice_localization_data.csv")
-    if not os.path.exists(os.path.join(directory_name, "CT_slice_X.npy")):
-        data = np.genfromtxt(
-            os.path.join(directory_name, "slice_localization_data.csv"),
-            delimiter=",",
-            skip_header=1,
-        )
-        X = data[:, :385]
-        y = data[:, -1]
-        np.save(os.path.join(directory_name, "CT_slice_X.npy"), X)
-        np.save(os.path.join(directory_name, "CT_slice_y.npy"), y)
-    X = np.load(os.path.join(directory_name, "CT_slice_X.npy"))
-    y = np.load(os.path.join(directory_name, "CT_slice_y.npy"))
-    # return copies of the data
-    return X.copy(), y.copy()
+    X_path = os.path.join(directory_name, "CT_slice_X.npy")
+    y_path = os.path.join(directory_name, "CT_slice_y.npy")
+    with file_lock("CT_slice"):
+        if not os.path.exists(X_path) or not os.path.exists(y_path):
+            print(f"{X_path} not found. Parsing slice_localization_data.csv...")
+            archive = fetch(SLICE_URL, sha256=SLICE_SHA256)
+            with lzma.open(archive, "rt") as f:
+                data = np.genfromtxt(
+                    f,
+                    delimiter=",",
+                    skip_header=1,
+                )
+            X = data[:, :385]
+            y = data[:, -1]
+            with atomic_write(X_path) as out:
+                np.save(out, X)
+            with atomic_write(y_path) as out:
+                np.save(out, y)
+    X = np.load(X_path, mmap_mode="r")
+    y = np.load(y_path, mmap_mode="r")
+    return X, y
+
+
+def default_workers() -> int:
+    """
+    Returns the default number of worker processes: at most `MAX_DEFAULT_WORKERS` and one per CPU, and only as many as
+    fit into the physical memory next to the serving process, with `WORKER_MEMORY_BYTES` each.
+
+    :return: The number of worker processes, at least 1.
+    """
+    try:
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return 1
+    return max(1, min(MAX_DEFAULT_WORKERS, os.cpu_count() or 1, memory // WORKER_MEMORY_BYTES - 1))
 
 
 def load_data_388():
@@ -89,7 +116,7 @@ def load_data_53(
         n_features: Optional[int] = None,
 ):
     X, y = download_slice_localization_data()
-    X -= X.min(axis=0)
+    X = X - X.min(axis=0)
     X = X[:, X.max(axis=0) > 1e-6]  # Throw away constant dimensions
     X = X / (X.max(axis=0) - X.min(axis=0))
     X = 2 * X - 1
@@ -116,17 +143,42 @@ def load_data_53(
     return train_x, train_y, test_x, test_y
 
 
-class SvmServiceServicer(GRCPService):
+def load_split(
+        data_loader: Callable[[], Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]],
+        name: Optional[str] = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the train/test split of a data loader, computing it only if it is not in the persistent cache yet.
+
+    The split is stored as one `.npy` file per array and opened with `mmap_mode='r'`, so all processes using the cache
+    share the same pages and neither the CSV nor the preprocessing is run again.
+
+    :param data_loader: The function computing the split, e.g., `load_data_388`.
+    :param name: The name of the split in the cache. Defaults to the name of `data_loader`. Must be different for
+        loaders called with different arguments.
+    :return: The read-only arrays (X_train, y_train, X_test, y_test).
+    """
+    name = name or data_loader.__name__
+    paths = [os.path.join(directory_name, f"{name}-v{SPLIT_VERSION}-{part}.npy") for part in SPLIT_PARTS]
+    if not all(os.path.exists(path) for path in paths):
+        with file_lock(f"split-{name}"):
+            if not all(os.path.exists(path) for path in paths):
+                print(f"Preprocessing {name} split...")
+                for path, array in zip(paths, data_loader()):
+                    with atomic_write(path) as out:
+                        np.save(out, np.ascontiguousarray(array))
+    return tuple(np.load(path, mmap_mode="r") for path in paths)
+
+
+class SvmServiceServicer(BenchmarkService):
     """
     This class is a GRCP service for SVM evaluation.
 
     Attributes:
-        - X (numpy.ndarray): Input data for training.
-        - y (numpy.ndarray): Target values for training.
-        - _X_train (numpy.ndarray): Input data for training, subset of X.
-        - _X_test (numpy.ndarray): Input data for testing, subset of X.
-        - _y_train (numpy.ndarray): Target values for training, subset of y.
-        - _y_test (numpy.ndarray): Target values for testing, subset of y.
+        - datasets (DatasetRegistry): The train/test splits of the `svm` and `svmmixed` benchmarks, loaded once and
+          shared by all requests.
+        - workers (WorkerPool | None): The worker processes fitting the SVR models, started on first use and again if
+          a worker dies, or None to fit the models in the serving threads.
 
     Methods:
         - __init__(self): Initializes the SVM service.
@@ -135,16 +187,125 @@ class SvmServiceServicer(GRCPService):
     """
 
     def __init__(
+            self,
+            port: int = 50058,
+            preload: bool = False,
+            n_workers: Optional[int] = None
+    ):
+        """
+        :param port: The port number to start the service on.
+        :param preload: Whether to load the data of both benchmarks and start the workers at startup instead of at
+            first use.
+        :param n_workers: The number of worker processes fitting SVR models, and of requests served concurrently. The
+            data of both benchmarks is loaded when the workers start and shared with them through shared memory. If 0,
+            the models are fit in a single serving thread. If None, `default_workers()` is used.
+        """
+        n_workers = default_workers() if n_workers is None else n_workers
+        # more threads than workers would only queue more fits in the workers
+        super().__init__(port=port, n_cores=max(1, n_workers))
+        self.n_workers = n_workers
+        self.datasets = DatasetRegistry(
+            {
+                'svm': lambda: load_split(load_data_388),
+                'svmmixed': lambda: load_split(load_data_53),
+            }
+        )
+        # structure: {benchmark_name: engine}, created on first use
+        self._engines = dict()
+        self._engines_lock = threading.Lock()
+        # the shared memory of the datasets of the current workers
+        self.shared_datasets: Optional[SharedDatasets] = None
+        self.workers = WorkerPool(self._start_workers) if n_workers > 0 else None
+        if self.workers is not None:
+            # `serve` closes the service on SIGTERM, this covers services that are used without `serve`
+            atexit.register(self.close)
+        if preload:
+            if self.workers is not None:
+                self.workers.executor()
+            else:
+                self.datasets.preload()
+                self.engine('svm')
+                self.engine('svmmixed')
+
+    def _start_workers(
+            self
+    ) -> ProcessPoolExecutor:
+        """
+        Loads the data of both benchmarks, copies it into shared memory, and starts the worker processes on it.
+
+        Called on first use, and again when a worker died, in which case the shared memory of the previous workers is
+        replaced as well.
+
+        :return: The worker processes.
+        """
+        if self.shared_datasets is not None:
+            self.shared_datasets.close()
+        self.datasets.preload()
+        self.shared_datasets = SharedDatasets({name: self.datasets.get(name) for name in self.datasets.loaders})
+        # spawn instead of fork since the workers must not inherit the gRPC threads of the server
+        return ProcessPoolExecutor(
+            max_workers=self.n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.shared_datasets.descriptors,),
+        )
+
+    def close(
             self
     ):
-        super().__init__(port=50058)
-        self.data_initialized = None
+        """
+        Stops the worker processes and removes the shared memory of the datasets. Called by `serve` when the server
+        terminates, including on SIGTERM.
+        """
+        if self.workers is not None:
+            self.workers.shutdown()
+        if self.shared_datasets is not None:
+            self.shared_datasets.close()
+            self.shared_datasets = None
 
-    def initialize_data(
+    def engine(
             self,
-            data_loader: Callable[[], Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = load_data_388
-    ):
-        self._X_train, self._y_train, self._X_test, self._y_test = data_loader()
+            benchmark_name: str
+    ) -> Union[SvrEngine, SvmMixedEngine]:
+        """
+        Returns the engine evaluating a benchmark in the serving threads, creating it on first use.
+
+        :param benchmark_name: The name of the benchmark, "svm" or "svmmixed".
+        :return: The engine.
+        """
+        engine = self._engines.get(benchmark_name)
+        if engine is None:
+            with self._engines_lock:
+                engine = self._engines.get(benchmark_name)
+                if engine is None:
+                    if benchmark_name == 'svm':
+                        engine = SvrEngine(self.datasets.get(benchmark_name))
+                    else:
+                        engine = SvmMixedEngine(self.datasets.get(benchmark_name))
+                    self._engines[benchmark_name] = engine
+        return engine
+
+    def submit(
+            self,
+            benchmark_name: str,
+            x: np.ndarray
+    ) -> Callable[[], np.ndarray]:
+        """
+        Submits the evaluation of all rows of a matrix to the worker processes, or evaluates them right away if there
+        are no workers.
+
+        :param benchmark_name: The name of the benchmark, "svm" or "svmmixed".
+        :param x: Matrix of shape (n_points, dimension).
+        :return: A function that waits for the evaluations and returns the array of shape (n_points,) with the RMSE of
+            each point.
+        """
+        valid_benchmark_names = ['svm', 'svmmixed']
+        assert benchmark_name in valid_benchmark_names, f"Invalid benchmark name: {benchmark_name}. Expected one of {valid_benchmark_names}"
+        if self.workers is not None:
+            results = [self.workers.submit(_evaluate, benchmark_name, np.asarray(row)) for row in x]
+            return lambda: np.array([result() for result in results])
+        values = np.array([self.engine(benchmark_name).evaluate(row) for row in x])
+        return lambda: values
 
     def evaluate_point(
             self,
@@ -164,56 +325,106 @@ class SvmServiceServicer(GRCPService):
 
         Please note that this method assumes that the benchmark name in the request is "svm". If the benchmark name is different, an assertion error will occur.
         """
-        valid_benchmark_names = ['svm', 'svmmixed']
-        assert request.benchmark.name in valid_benchmark_names, f"Invalid benchmark name: {request.benchmark.name}. Expected one of {valid_benchmark_names}"
-        if request.benchmark.name == 'svmmixed':
-            loader = load_data_53
-        elif request.benchmark.name == 'svm':
-            loader = load_data_388
-        else:
-            raise ValueError(
-                f"Invalid benchmark name: {request.benchmark.name}. Expected one of {valid_benchmark_names}"
-            )
-
-        with lock:
-            if self.data_initialized is None or self.data_initialized != loader:
-                self.initialize_data(loader)
-                self.data_initialized = loader
-
         x = [v.value for v in request.point.values]
-        x = np.array(x).squeeze()
-        C = 0.01 * (500 ** x[-1])
-        gamma = 0.1 * (30 ** x[-2])
-        epsilon = 0.01 * (100 ** x[-3])
-        if loader == load_data_53:
-            inds_selected = np.where(x[np.arange(len(x) - 3)] == 1)[0]
-            if len(inds_selected) == 0:
-                return EvaluationResult(
-                    value=1.0
-                )
-            else:
-                _x_fit = self._X_train[:, inds_selected]
-                _x_pred = self._X_test[:, inds_selected]
-        elif loader == load_data_388:
-            length_scales = np.exp(4 * x[:-3] - 2)
-            _x_fit = self._X_train / length_scales
-            _x_pred = self._X_test / length_scales
-
-        svr = SVR(gamma=gamma, epsilon=epsilon, C=C, cache_size=1500, tol=0.001)
-        svr.fit(_x_fit, self._y_train)
-        pred = svr.predict(_x_pred)
-        error = np.sqrt(np.mean(np.square(pred - self._y_test)))
+        x = np.array(x)
         result = EvaluationResult(
-            value=float(error)
+            value=self.evaluate_array(request.benchmark.name, x)
         )
         return result
 
+    def evaluate_array(
+            self,
+            benchmark_name: str,
+            x: np.ndarray
+    ) -> float:
+        """
+        Evaluates a single point given as an array.
+
+        :param benchmark_name: The name of the benchmark, "svm" or "svmmixed".
+        :param x: The point.
+        :return: The RMSE of the SVR model on the test data.
+        """
+        return float(self.submit(benchmark_name, x.reshape(1, -1))()[0])
+
+    def evaluate_batch(
+            self,
+            request_iterator: Iterator[BenchmarkRequest],
+            context
+    ) -> Iterator[EvaluationResult]:
+        """
+        Evaluates a stream of points and streams back one result per point, in request order.
+
+        All points are submitted to the worker processes before the first result is awaited.
+        """
+        pending = [
+            self.submit(request.benchmark.name, np.array([[v.value for v in request.point.values]]))
+            for request in request_iterator
+        ]
+        for result in pending:
+            yield EvaluationResult(
+                value=float(result()[0])
+            )
+
+    def evaluate_packed(
+            self,
+            request: bytes,
+            context
+    ) -> bytes:
+        """
+        Evaluates the points of a packed request, in parallel on the worker processes.
+
+        :param request: A packed request, see `benchercommon.packed`.
+        :param context: The context in which the evaluation is being performed.
+        :return: The packed float64 array with the value of each point.
+        """
+        try:
+            benchmark_name, x = decode_points(request)
+        except ValueError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+        return encode_values(self.submit(benchmark_name, x)())
+
 
 def serve():
+    argparse = ArgumentParser()
+    argparse.add_argument(
+        '-p',
+        '--port',
+        type=int,
+        required=False,
+        help='The port number to start the service on. Default is 50058.',
+        default=50058
+    )
+    argparse.add_argument(
+        '--preload',
+        action='store_true',
+        help='Load the data of both benchmarks and start the workers at startup instead of at first use.',
+    )
+    argparse.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        required=False,
+        help='The number of worker processes fitting SVR models, and of requests served concurrently. Each worker may '
+             'use about 2 GB of memory. 0 fits the models in a single serving thread. Default is one per CPU, at most 4 '
+             'and at most as many as fit into the memory.',
+        default=None
+    )
+    args = argparse.parse_args()
+
     logging.basicConfig()
-    svm = SvmServiceServicer()
+    svm = SvmServiceServicer(port=args.port, preload=args.preload, n_workers=args.workers)
     svm.serve()
 
 
+def prefetch():
+    """
+    Downloads the data of the SVM benchmarks and stores their preprocessed splits in the persistent cache.
+    """
+    logging.basicConfig()
+    load_split(load_data_388)
+    load_split(load_data_53)
+    print("Prefetched svm, svmmixed")
+
+
 if __name__ == '__main__':
     serve()
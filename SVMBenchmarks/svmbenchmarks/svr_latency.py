@@ -0,0 +1,114 @@
+"""
+Compares the per-evaluation latency of the `svm` or `svmmixed` benchmark with libsvm's own RBF kernel (the original
+implementation) and with precomputed kernel matrices, and checks that both give the same RMSE.
+
+Run with `python -m svmbenchmarks.svr_latency [--benchmark svmmixed]`.
+"""
+import sys
+import time
+from argparse import ArgumentParser
+from typing import Union
+
+import numpy as np
+
+from svmbenchmarks.datasets import SvmDataset
+from svmbenchmarks.engine import SvmMixedEngine, SvrEngine
+from svmbenchmarks.main import load_data_388, load_data_53, load_split
+
+
+def time_evaluations(
+        engine: Union[SvrEngine, SvmMixedEngine],
+        points: np.ndarray
+) -> tuple:
+    """
+    :param engine: The engine to evaluate the points with.
+    :param points: Matrix of shape (n_points, dimension).
+    :return: The RMSE of every point and the latency of every evaluation in seconds.
+    """
+    values = np.empty(len(points))
+    latencies = np.empty(len(points))
+    for i, x in enumerate(points):
+        started = time.perf_counter()
+        values[i] = engine.evaluate(x)
+        latencies[i] = time.perf_counter() - started
+    return values, latencies
+
+
+def main():
+    argparse = ArgumentParser()
+    argparse.add_argument(
+        '-b',
+        '--benchmark',
+        type=str,
+        required=False,
+        choices=['svm', 'svmmixed'],
+        help='The benchmark to evaluate. Default is svm.',
+        default='svm'
+    )
+    argparse.add_argument(
+        '-n',
+        '--points',
+        type=int,
+        required=False,
+        help='The number of random points to evaluate. Default is 50.',
+        default=50
+    )
+    argparse.add_argument(
+        '--seed',
+        type=int,
+        required=False,
+        help='The seed of the random points. Default is 0.',
+        default=0
+    )
+    argparse.add_argument(
+        '--tolerance',
+        type=float,
+        required=False,
+        help='The largest accepted absolute difference between the RMSEs of both implementations. Tiny differences in '
+             'the kernel values can change the path of the solver, which stops at a tolerance of 1e-3. Default is 1e-4.',
+        default=1e-4
+    )
+    args = argparse.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    if args.benchmark == 'svm':
+        dataset = SvmDataset(*load_split(load_data_388))
+        points = rng.rand(args.points, 388)
+        engine_class = SvrEngine
+    else:
+        dataset = SvmDataset(*load_split(load_data_53))
+        points = rng.rand(args.points, 53)
+        points[:, :-3] = np.round(points[:, :-3])
+        # the RMSE cache would answer repeated points without fitting
+        engine_class = lambda dataset, precomputed_kernel: SvmMixedEngine(
+            dataset, precomputed_kernel=precomputed_kernel, max_cached_results=0
+        )
+    # points that share their length scales or features and only differ in C, gamma, and epsilon
+    repeated = np.repeat(points[:max(1, args.points // 5)], 5, axis=0)
+    repeated[:, -3:] = rng.rand(len(repeated), 3)
+    batches = [("random points", points), ("shared length scales" if args.benchmark == 'svm' else "shared features", repeated)]
+    if args.benchmark == 'svmmixed':
+        # a walk flipping one feature at a time, as a local search over the selection bits would
+        neighbours = points[:1].repeat(len(points), axis=0)
+        for i in range(1, len(neighbours)):
+            neighbours[i] = neighbours[i - 1]
+            feature = rng.randint(50)
+            neighbours[i, feature] = 1 - neighbours[i, feature]
+        neighbours[:, -3:] = rng.rand(len(neighbours), 3)
+        batches.append(("neighbouring features", neighbours))
+
+    for label, batch in batches:
+        baseline_values, baseline_latencies = time_evaluations(engine_class(dataset, precomputed_kernel=False), batch)
+        values, latencies = time_evaluations(engine_class(dataset, precomputed_kernel=True), batch)
+        max_difference = float(np.max(np.abs(values - baseline_values)))
+        print(f"{label} ({len(batch)} evaluations)")
+        print(f"  libsvm RBF kernel:  mean {1000 * baseline_latencies.mean():7.2f} ms, median {1000 * np.median(baseline_latencies):7.2f} ms")
+        print(f"  precomputed kernel: mean {1000 * latencies.mean():7.2f} ms, median {1000 * np.median(latencies):7.2f} ms")
+        print(f"  speedup {baseline_latencies.sum() / latencies.sum():.2f}x, largest RMSE difference {max_difference:.3g}")
+        if max_difference > args.tolerance:
+            print(f"RMSE differs by more than {args.tolerance}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+from svmbenchmarks.datasets import SvmDataset
+from svmbenchmarks.engine import SvmMixedEngine, SvrEngine
+
+
+class SharedArray(NamedTuple):
+    # name of the shared memory block, shape, and dtype string of the array stored in it
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+class SharedDatasets:
+    """
+    Copies the splits of the SVM benchmarks into shared memory blocks, so that worker processes can use them without
+    holding their own copies.
+
+    The blocks belong to the process that created this object and are removed by `close`.
+    """
+
+    def __init__(
+            self,
+            datasets: Dict[str, SvmDataset]
+    ):
+        """
+        :param datasets: The split of each benchmark.
+        """
+        self._blocks: List[SharedMemory] = []
+        # structure: {benchmark_name: (X_train, y_train, X_test, y_test)}, picklable, passed to the workers
+        self.descriptors: Dict[str, Tuple[SharedArray, ...]] = {}
+        for name, dataset in datasets.items():
+            shared_arrays = []
+            for array in dataset:
+                array = np.ascontiguousarray(array)
+                block = SharedMemory(create=True, size=max(array.nbytes, 1))
+                np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+                self._blocks.append(block)
+                shared_arrays.append(SharedArray(block.name, array.shape, array.dtype.str))
+            self.descriptors[name] = tuple(shared_arrays)
+
+    def close(
+            self
+    ):
+        """
+        Removes all shared memory blocks. Workers must not use the datasets afterwards.
+        """
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+
+def attach_datasets(
+        descriptors: Dict[str, Tuple[SharedArray, ...]],
+        blocks: List[SharedMemory]
+) -> Dict[str, SvmDataset]:
+    """
+    Opens the datasets created by `SharedDatasets` in another process, without copying them.
+
+    :param descriptors: The `descriptors` of the `SharedDatasets` object.
+    :param blocks: Receives the attached blocks, which must stay referenced while the arrays are used.
+    :return: The split of each benchmark, as read-only arrays in shared memory.
+    """
+    datasets = dict()
+    for name, shared_arrays in descriptors.items():
+        arrays = []
+        for shared_array in shared_arrays:
+            block = SharedMemory(name=shared_array.name)
+            blocks.append(block)
+            array = np.ndarray(shared_array.shape, dtype=np.dtype(shared_array.dtype), buffer=block.buf)
+            array.setflags(write=False)
+            arrays.append(array)
+        datasets[name] = SvmDataset(*arrays)
+    return datasets
+
+
+# state of the current worker process, set by `_init_worker`
+_worker_blocks: List[SharedMemory] = []
+_worker_engines: Optional[Dict[str, Union[SvrEngine, SvmMixedEngine]]] = None
+
+
+def _init_worker(
+        descriptors: Dict[str, Tuple[SharedArray, ...]]
+):
+    global _worker_engines
+    datasets = attach_datasets(descriptors, _worker_blocks)
+    _worker_engines = {
+        'svm': SvrEngine(datasets['svm']),
+        'svmmixed': SvmMixedEngine(datasets['svmmixed']),
+    }
+
+
+def _evaluate(
+        benchmark_name: str,
+        x: np.ndarray
+) -> float:
+    return _worker_engines[benchmark_name].evaluate(x)
@@ -0,0 +1,106 @@
+import numpy as np
+from sklearn.svm import SVR
+
+from svmbenchmarks.datasets import SvmDataset
+from svmbenchmarks.engine import SvmMixedEngine, SvrEngine, svr_hyperparameters
+
+
+def random_dataset(
+        n_train: int,
+        n_test: int,
+        n_features: int,
+        seed: int = 0
+) -> SvmDataset:
+    rng = np.random.default_rng(seed)
+    X = rng.uniform(size=(n_train + n_test, n_features))
+    y = np.sin(X @ rng.normal(size=n_features)) + 0.1 * rng.normal(size=n_train + n_test)
+    return SvmDataset(X[:n_train], y[:n_train], X[n_train:], y[n_train:])
+
+
+def test_svr_engine_matches_libsvm_kernel():
+    dataset = random_dataset(100, 80, 20)
+    engine = SvrEngine(dataset)
+    for x in np.random.default_rng(1).uniform(size=(3, 23)):
+        C, gamma, epsilon = svr_hyperparameters(x)
+        length_scales = np.exp(4 * x[:-3] - 2)
+        svr = SVR(gamma=gamma, epsilon=epsilon, C=C, tol=0.001)
+        svr.fit(dataset.X_train / length_scales, dataset.y_train)
+        expected = np.sqrt(np.mean(np.square(svr.predict(dataset.X_test / length_scales) - dataset.y_test)))
+        np.testing.assert_allclose(engine.evaluate(x), expected, rtol=1e-6)
+
+
+def test_svr_engine_cache_at_the_real_shape():
+    # the svm split: 250 train and 250 test points with 385 features
+    dataset = random_dataset(250, 250, 385)
+    engine = SvrEngine(dataset, max_cache_bytes=8 * 1024 * 1024)
+    exponents = 4 * np.random.default_rng(2).uniform(size=(10, 385)) - 2
+
+    distances = engine.squared_distances(exponents[0])
+    assert distances.shape == (500, 250)
+    assert engine.squared_distances(exponents[0]) is distances
+    assert (engine._distances.hits, engine._distances.misses) == (1, 1)
+
+    # the budget holds 8 matrices of 1 MB
+    for e in exponents:
+        engine.squared_distances(e)
+    assert len(engine._distances.keys()) == 8
+    assert engine._distances.n_bytes == 8 * distances.nbytes
+    hits = engine._distances.hits
+    for e in exponents[-8:]:
+        engine.squared_distances(e)
+    assert engine._distances.hits == hits + 8
+
+
+def mixed_points(
+        n_points: int,
+        n_features: int,
+        seed: int
+) -> np.ndarray:
+    x = np.random.default_rng(seed).uniform(size=(n_points, n_features + 3))
+    x[:, :-3] = np.round(x[:, :-3])
+    return x
+
+
+def test_svm_mixed_engine_matches_libsvm_kernel():
+    dataset = random_dataset(150, 120, 10)
+    engine = SvmMixedEngine(dataset, chunk_rows=50)
+    for x in mixed_points(4, 10, 3):
+        C, gamma, epsilon = svr_hyperparameters(x)
+        mask = x[:-3] == 1
+        svr = SVR(gamma=gamma, epsilon=epsilon, C=C, tol=0.001)
+        svr.fit(dataset.X_train[:, mask], dataset.y_train)
+        expected = np.sqrt(np.mean(np.square(svr.predict(dataset.X_test[:, mask]) - dataset.y_test)))
+        np.testing.assert_allclose(engine.evaluate(x), expected, rtol=1e-5)
+
+
+def test_svm_mixed_engine_cache_at_the_real_shape():
+    # the svmmixed split: 5000 train and 5000 test points with 50 features
+    dataset = random_dataset(5000, 5000, 50)
+    engine = SvmMixedEngine(dataset, max_cached_results=0)
+    points = mixed_points(6, 50, 4)
+
+    train_distances, test_distances = engine.squared_distances(points[0][:-3] == 1)
+    assert train_distances.shape == test_distances.shape == (5000, 5000)
+    assert train_distances.dtype == test_distances.dtype == np.float32
+    assert train_distances.nbytes + test_distances.nbytes == 200_000_000
+    mask = points[0][:-3] == 1
+    X = dataset.X_test[:10, mask]
+    expected = np.square(X[:, np.newaxis, :] - dataset.X_train[np.newaxis, :, mask]).sum(axis=2)
+    np.testing.assert_allclose(test_distances[:10], expected, rtol=1e-6, atol=1e-5)
+
+    # the default budget holds the distances of 5 subsets
+    for x in points[1:]:
+        engine.squared_distances(x[:-3] == 1)
+    distances_keys = [key for key in engine._arrays.keys() if key[0] == 'distances']
+    assert len(distances_keys) == 5
+    hits = engine._arrays.hits
+    for x in points[-5:]:
+        assert engine.squared_distances(x[:-3] == 1)[0].dtype == np.float32
+    assert engine._arrays.hits == hits + 5
+
+    # points sharing the features of a cached subset fit without computing distances
+    misses = engine._arrays.misses
+    x = points[-1].copy()
+    x[-3:] = [0.5, 0.2, 0.3]
+    assert 0 < engine.evaluate(x) < 2
+    assert engine._arrays.misses == misses
@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+from test_engine import random_dataset
+
+from svmbenchmarks import main
+from svmbenchmarks.datasets import DatasetRegistry
+from svmbenchmarks.main import MAX_DEFAULT_WORKERS, WORKER_MEMORY_BYTES, SvmServiceServicer, default_workers
+
+
+def test_default_workers_is_bounded_by_the_memory(monkeypatch):
+    page_size = 4096
+    memory = {'SC_PAGE_SIZE': page_size, 'SC_PHYS_PAGES': 0}
+    monkeypatch.setattr(os, 'sysconf', lambda name: memory[name])
+    monkeypatch.setattr(os, 'cpu_count', lambda: 64)
+
+    memory['SC_PHYS_PAGES'] = 4 * 1024 ** 3 // page_size
+    assert default_workers() == 1
+    memory['SC_PHYS_PAGES'] = 7 * WORKER_MEMORY_BYTES // page_size
+    assert default_workers() == MAX_DEFAULT_WORKERS
+
+    monkeypatch.setattr(os, 'cpu_count', lambda: 2)
+    assert default_workers() == 2
+
+
+def test_workers_are_started_on_first_use(monkeypatch):
+    def fail():
+        raise AssertionError("the data must not be loaded at construction")
+
+    monkeypatch.setattr(main, 'load_split', lambda loader: fail())
+    service = SvmServiceServicer(port=0, n_workers=3)
+    assert service.shared_datasets is None
+    assert service.n_cores == 3
+    service.close()
+
+
+def test_workers_are_restarted_with_new_shared_memory():
+    service = SvmServiceServicer(port=0, n_workers=2)
+    service.datasets = DatasetRegistry(
+        {
+            'svm': lambda: random_dataset(30, 20, 385),
+            'svmmixed': lambda: random_dataset(30, 20, 50),
+        }
+    )
+    x = np.random.default_rng(0).uniform(size=(3, 388))
+    try:
+        expected = service.submit('svm', x)()
+        descriptors = service.shared_datasets.descriptors
+        for process in list(service.workers.executor()._processes.values()):
+            process.kill()
+
+        np.testing.assert_array_equal(service.submit('svm', x)(), expected)
+        assert service.workers.restarts == 1
+        assert service.shared_datasets.descriptors != descriptors
+        # the shared memory of the dead workers is removed
+        assert not os.path.exists(f"/dev/shm/{descriptors['svm'][0].name}")
+    finally:
+        service.close()
+    assert service.shared_datasets is None
@@ -1,43 +1,354 @@
+import signal
+import socket
 import time
+from argparse import ArgumentParser
 
 from pathlib import Path
 
 import os
 import subprocess
-import threading
-
 
 # please run my action, GitHub
 
-class ServiceThread(threading.Thread):
+# the default port of each service directory. Services are always started with an explicit port, so that the
+# supervisor knows where to probe them.
+SERVICE_PORTS = {
+    "BencherServer": 50051,
+    "LassoBenchmarks": 50053,
+    "NoDependencyBenchmark": 50054,
+    "MaxSATBenchmarks": 50055,
+    "EboBenchmarks": 50056,
+    "MujocoBenchmarks": 50057,
+    "SVMBenchmarks": 50058,
+    "IOHBenchmarks": 50059,
+}
+# the router, started once the benchmark services are ready
+ROUTER_DIR = "BencherServer"
+# a service that ran at least this many seconds before exiting is restarted without backoff
+STABLE_AFTER = 60.0
+# the time in seconds that all processes together get to exit after SIGTERM before they are killed, within the 10 s
+# that docker waits before it kills the container
+STOP_TIMEOUT = 8.0
+
+# client connection preface and an empty SETTINGS frame of HTTP/2, which gRPC servers speak
+HTTP2_PREFACE = b"PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n" + b"\x00\x00\x00\x04\x00\x00\x00\x00\x00"
+
+
+def grpc_ready(
+        port: int,
+        host: str = "127.0.0.1",
+        timeout: float = 1.0
+) -> bool:
+    """
+    Checks whether a gRPC server is serving on a port.
+
+    The entrypoint runs without grpcio, so instead of a gRPC call this opens an HTTP/2 connection and waits for the
+    server's SETTINGS frame. gRPC servers only answer once they are started, i.e., after the service has imported its
+    dependencies and initialized its benchmarks.
+
+    :param port: The port of the server.
+    :param host: The host of the server.
+    :param timeout: The time in seconds to wait for the connection and the answer.
+    :return: Whether the server answered with an HTTP/2 SETTINGS frame.
+    """
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as connection:
+            connection.settimeout(timeout)
+            connection.sendall(HTTP2_PREFACE)
+            header = b""
+            while len(header) < 9:
+                chunk = connection.recv(9 - len(header))
+                if not chunk:
+                    return False
+                header += chunk
+            # frame type SETTINGS on stream 0
+            return header[3] == 0x04 and int.from_bytes(header[5:9], "big") & 0x7FFFFFFF == 0
+    except OSError:
+        return False
+
+
+class ServiceProcess:
+    """
+    One process of a benchmark service or the router, restarted with exponential backoff whenever it exits.
+
+    The output of each process goes to its own `<name>.out` and `<name>.err` files in the log directory.
+    """
+
     def __init__(
             self,
-            service_dir: str
+            service_dir: str,
+            port: int | None,
+            log_dir: str,
+            max_backoff: float = 60.0,
+            args: list[str] | None = None
     ):
-        threading.Thread.__init__(self)
+        """
+        :param service_dir: The directory of the service, with its virtual environment in `.venv`.
+        :param port: The port to start the service on, or None to use its default port without probing it.
+        :param log_dir: The directory of the log files.
+        :param max_backoff: The longest time in seconds to wait before restarting a service that keeps failing.
+        :param args: Further command line arguments of the service.
+        """
         self.dir = service_dir
+        self.port = port
+        self.args = args or []
+        self.max_backoff = max_backoff
+        self.name = Path(service_dir).name if port is None else f"{Path(service_dir).name}-{port}"
+        self.outfile = os.path.join(log_dir, f"{self.name}.out")
+        self.errfile = os.path.join(log_dir, f"{self.name}.err")
+        self.process: subprocess.Popen | None = None
+        self.started_at = 0.0
+        self.ready = False
+        # seconds from the last start until the service answered
+        self.startup_time: float | None = None
+        self.failures = 0
+        self.restart_at: float | None = None
 
-    def run(
+    def start(
             self
     ):
+        args = ([] if self.port is None else ["--port", str(self.port)]) + self.args
+        print(f"Starting {self.name} in directory {Path(self.dir).absolute()} {' '.join(args)}", flush=True)
+        with open(self.outfile, "a+") as out, open(self.errfile, "a+") as err:
+            self.process = subprocess.Popen(
+                [os.path.join(self.dir, ".venv", "bin", "start-benchmark-service"), *args],
+                stdout=out,
+                stderr=err,
+                cwd=self.dir,
+                env=os.environ
+            )
+        self.started_at = time.monotonic()
+        self.ready = False
+        self.restart_at = None
+
+    def check(
+            self
+    ):
+        """
+        Marks the service as ready once it answers, and schedules a restart if it exited.
+        """
+        now = time.monotonic()
+        if self.process is None:
+            if self.restart_at is not None and now >= self.restart_at:
+                self.start()
+            return
+        exit_code = self.process.poll()
+        if exit_code is not None:
+            uptime = now - self.started_at
+            self.failures = 1 if uptime >= STABLE_AFTER else self.failures + 1
+            backoff = min(self.max_backoff, 2.0 ** (self.failures - 1))
+            print(
+                f"{self.name} exited with code {exit_code} after {uptime:.1f} s, restarting in {backoff:.0f} s "
+                f"(see {self.errfile})",
+                flush=True
+            )
+            self.process = None
+            self.ready = False
+            self.restart_at = now + backoff
+        elif not self.ready and (self.port is None or grpc_ready(self.port)):
+            self.ready = True
+            self.startup_time = now - self.started_at
+            print(f"{self.name} ready after {self.startup_time:.1f} s", flush=True)
+
+    def terminate(
+            self
+    ):
+        """
+        Asks the process to exit with SIGTERM, without waiting for it.
+        """
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+    def wait(
+            self,
+            deadline: float
+    ):
+        """
+        Waits for the process to exit until the deadline, and kills it if it did not.
+
+        :param deadline: The `time.monotonic()` until which to wait.
+        """
+        if self.process is None:
+            return
         try:
-            print(f"Starting service in directory {Path(self.dir).absolute()}")
-            # logfile in home directory
-            outfile = os.path.join(os.environ["HOME"], "bencher.out")
-            errfile = os.path.join(os.environ["HOME"], "bencher.err")
+            self.process.wait(timeout=max(0.0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            print(f"{self.name} did not exit in time, killing it", flush=True)
+            self.process.kill()
+            self.process.wait()
+
+
+def stop_all(
+        processes: list[ServiceProcess],
+        timeout: float = STOP_TIMEOUT
+):
+    """
+    Stops all processes at once: sends SIGTERM to every process first, then waits for all of them against one deadline
+    and kills those that did not exit by then.
+
+    :param processes: The processes to stop.
+    :param timeout: The time in seconds that all processes together get to exit.
+    """
+    for process in processes:
+        process.terminate()
+    deadline = time.monotonic() + timeout
+    for process in processes:
+        process.wait(deadline)
+
+
+def supervise(
+        services: list[ServiceProcess],
+        router: ServiceProcess | None,
+        startup_timeout: float,
+        ready_file: str | None = None,
+        interval: float = 0.5
+):
+    """
+    Starts all benchmark services at once, then the router once they are ready, and restarts every process that exits.
+
+    :param services: The benchmark service processes.
+    :param router: The router process, or None if there is none.
+    :param startup_timeout: The longest time in seconds to wait for the benchmark services before starting the router
+        anyway. The router takes services that become ready later into rotation by itself.
+    :param ready_file: A file to create once the router is ready, e.g., for a container health check.
+    :param interval: The time in seconds between two checks of the processes.
+    """
+    started_at = time.monotonic()
+    for service in services:
+        service.start()
+    router_started = router is None
+    reported = False
+    while True:
+        for service in services:
+            service.check()
+        if not router_started:
+            waited = time.monotonic() - started_at
+            if all(service.ready for service in services) or waited >= startup_timeout:
+                not_ready = [service.name for service in services if not service.ready]
+                if not_ready:
+                    print(f"Starting the router after {waited:.1f} s without {', '.join(not_ready)}", flush=True)
+                router.start()
+                router_started = True
+        elif router is not None:
+            router.check()
+        ready = router.ready if router is not None else all(service.ready for service in services)
+        if ready and not reported:
+            reported = True
+            print(f"Bencher ready after {time.monotonic() - started_at:.1f} s. Startup times:", flush=True)
+            for process in services + ([router] if router is not None else []):
+                startup = f"{process.startup_time:.1f} s" if process.startup_time is not None else "not ready"
+                print(f"  {process.name}: {startup}", flush=True)
+        if ready_file is not None:
+            # the file only exists while the router is serving
+            if ready:
+                Path(ready_file).touch()
+            else:
+                Path(ready_file).unlink(missing_ok=True)
+        time.sleep(interval)
+
+
+def prefetch(
+        bencher_dir: str
+):
+    """
+    Runs the `bencher-prefetch` command of every service that has one, which downloads and prepares all benchmark data
+    in the persistent cache (see BENCHER_CACHE_DIR).
+    """
+    for service_dir in sorted(os.listdir(bencher_dir)):
+        executable = os.path.join(bencher_dir, service_dir, ".venv", "bin", "bencher-prefetch")
+        if os.path.isfile(executable):
+            print(f"Prefetching data for {service_dir}")
             subprocess.check_call(
-                [os.path.join(self.dir, ".venv", "bin", "start-benchmark-service")],
-                stdout=open(outfile, 'a+'),
-                stderr=open(errfile, 'a+'),
-                cwd=self.dir,
-                shell=True,
+                [executable],
+                cwd=os.path.join(bencher_dir, service_dir),
                 env=os.environ
             )
-        except subprocess.CalledProcessError as e:
-            raise Exception(f"Service failed in directory {self.dir}") from e
+
+
+def parse_replicas(
+        specs: list[str]
+) -> dict[str, list[int]]:
+    """
+    Parses `--replicas` options of the form `SERVICE=N@PORT`, e.g., `LassoBenchmarks=3@50153`.
+
+    :param specs: The values of the `--replicas` options.
+    :return: The ports of the replicas of each service directory, N consecutive ports starting at PORT.
+    """
+    replicas = dict()
+    for spec in specs:
+        service_dir, _, count_and_port = spec.partition("=")
+        count, _, port = count_and_port.partition("@")
+        if not service_dir or not count.isdigit() or int(count) < 1 or not port.isdigit():
+            raise ValueError(f"Invalid replica specification {spec}, expected SERVICE=N@PORT")
+        if service_dir not in SERVICE_PORTS or service_dir == ROUTER_DIR:
+            raise ValueError(f"Invalid replica specification {spec}, {service_dir} is not a benchmark service")
+        replicas[service_dir] = [int(port) + i for i in range(int(count))]
+    return replicas
+
+
+def router_args(
+        replicas: dict[str, list[int]]
+) -> list[str]:
+    """
+    Returns the command line arguments that make the router send the calls of each replicated service to its replicas
+    instead of its default port.
+
+    :param replicas: The ports of the replicas of each service directory, see `parse_replicas`.
+    :return: One `--replicas DEFAULT_PORT=PORT,...` argument of the router per replicated service.
+    """
+    args = []
+    for service_dir, ports in sorted(replicas.items()):
+        args += ["--replicas", f"{SERVICE_PORTS[service_dir]}={','.join(str(port) for port in ports)}"]
+    return args
 
 
 if __name__ == '__main__':
+    argparse = ArgumentParser()
+    argparse.add_argument(
+        '--prefetch',
+        action='store_true',
+        help='Download and prepare the data of all benchmarks into the persistent cache and exit.'
+    )
+    argparse.add_argument(
+        '--replicas',
+        action='append',
+        default=[],
+        metavar='SERVICE=N@PORT',
+        help='Run N replicas of the service in directory SERVICE on the consecutive ports PORT, PORT+1, ... instead of '
+             'a single instance on its default port. The router balances the calls of the service over them. Can be '
+             'given multiple times.'
+    )
+    argparse.add_argument(
+        '--log-dir',
+        type=str,
+        required=False,
+        help='The directory of the log files, one .out and one .err file per service. Default is ~/bencher-logs.',
+        default=os.path.join(os.environ["HOME"], "bencher-logs")
+    )
+    argparse.add_argument(
+        '--startup-timeout',
+        type=float,
+        required=False,
+        help='The longest time in seconds to wait for the benchmark services before starting the router anyway. '
+             'Default is 600.',
+        default=600.0
+    )
+    argparse.add_argument(
+        '--max-backoff',
+        type=float,
+        required=False,
+        help='The longest time in seconds to wait before restarting a service that keeps crashing. Default is 60.',
+        default=60.0
+    )
+    argparse.add_argument(
+        '--ready-file',
+        type=str,
+        required=False,
+        help='A file that exists while the router is ready, e.g., for a container health check. Default is None.',
+        default=None
+    )
+    args = argparse.parse_args()
+
     os.environ["POETRY_VIRTUALENVS_PATH"] = "/opt/virtualenvs"
     os.environ["POETRY_HOME"] = "/opt/poetry"
     os.environ["PATH"] = "/opt/poetry/bin:" + os.environ["PATH"]
@@ -46,28 +357,48 @@ if __name__ == '__main__':
     bencher_dir = os.path.join("/opt", "bencher")
     # bencher_dir = "."
 
-    threads = []
-    for service_dir in os.listdir(bencher_dir):
-        # check if dir and pyproject.toml exists
+    if args.prefetch:
+        prefetch(bencher_dir)
+        exit(0)
+
+    replicas = parse_replicas(args.replicas)
+    os.makedirs(args.log_dir, exist_ok=True)
+    services = []
+    router = None
+    for service_dir in sorted(os.listdir(bencher_dir)):
+        # check if dir and pyproject.toml exists, and skip packages that are not services, such as BencherCommon
         if os.path.isdir(os.path.join(bencher_dir, service_dir)) and os.path.isfile(
                 os.path.join(bencher_dir, service_dir, "pyproject.toml")
-        ):
-            thread = ServiceThread(os.path.join(bencher_dir, service_dir))
-            thread.start()
-            threads.append(thread)
+        ) and os.path.isfile(os.path.join(bencher_dir, service_dir, ".venv", "bin", "start-benchmark-service")):
+            ports = replicas.get(service_dir, [SERVICE_PORTS.get(service_dir)])
+            processes = [
+                ServiceProcess(
+                    os.path.join(bencher_dir, service_dir),
+                    port,
+                    args.log_dir,
+                    args.max_backoff,
+                    args=router_args(replicas) if service_dir == ROUTER_DIR else None
+                )
+                for port in ports
+            ]
+            if service_dir == ROUTER_DIR:
+                router = processes[0]
+            else:
+                services += processes
 
-    # check threads every 5 seconds
-    while True:
-        # check for keyboard interrupt
-        try:
-            for thread in threads:
-                if not thread.is_alive():
-                    print(f"Thread {thread.dir} is dead. Exiting...")
-                    exit(1)
-            # sleep for 5 seconds
-            time.sleep(5)
-        except KeyboardInterrupt:
-            print("Keyboard interrupt. Exiting...")
-            exit(1)
-        # sleep for 5 seconds
-        time.sleep(5)
+    def terminate(
+            signum,
+            frame
+    ):
+        raise KeyboardInterrupt
+
+    # docker stops containers with SIGTERM
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        supervise(services, router, args.startup_timeout, args.ready_file)
+    except KeyboardInterrupt:
+        print("Stopping all services...")
+        stop_all(services + ([router] if router is not None else []))
+        if args.ready_file is not None:
+            Path(args.ready_file).unlink(missing_ok=True)
+        exit(1)
@@ -4,7 +4,8 @@
 # loop over all dirs in /opt/BencherBenchmarks and execute poetry run start-benchmark-service for each
 
 for dir in ./*; do
-    if [ -d "$dir" ]; then
+    # BencherCommon is a library used by the services, not a service
+    if [ -d "$dir" ] && [ "$dir" != "./BencherCommon" ]; then
         echo "Starting benchmark service for $dir"
         cd $dir
         #poetry run start-benchmark-service &
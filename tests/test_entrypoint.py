@@ -0,0 +1,188 @@
+import subprocess
+
+import pytest
+
+import entrypoint
+from entrypoint import STABLE_AFTER, ServiceProcess, parse_replicas, router_args, stop_all
+
+
+class Clock:
+
+    def __init__(
+            self
+    ):
+        self.now = 0.0
+
+    def __call__(
+            self
+    ) -> float:
+        return self.now
+
+
+class StubPopen:
+    """
+    A process that runs until `exit` is called, or until it is terminated unless it ignores SIGTERM.
+    """
+
+    def __init__(
+            self,
+            clock: Clock,
+            events: list,
+            ignores_sigterm: bool = False
+    ):
+        self.clock = clock
+        self.events = events
+        self.ignores_sigterm = ignores_sigterm
+        self.returncode = None
+
+    def poll(
+            self
+    ):
+        return self.returncode
+
+    def exit(
+            self,
+            code: int = 1
+    ):
+        self.returncode = code
+
+    def terminate(
+            self
+    ):
+        self.events.append(("terminate", self))
+        if not self.ignores_sigterm:
+            self.exit(-15)
+
+    def kill(
+            self
+    ):
+        self.events.append(("kill", self))
+        self.exit(-9)
+
+    def wait(
+            self,
+            timeout=None
+    ):
+        self.events.append(("wait", self, timeout))
+        if self.returncode is None:
+            self.clock.now += timeout
+            raise subprocess.TimeoutExpired("stub", timeout)
+        return self.returncode
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(entrypoint.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def popens(monkeypatch, clock):
+    popens = []
+
+    def popen(*args, **kwargs):
+        popens.append(StubPopen(clock, []))
+        return popens[-1]
+
+    monkeypatch.setattr(entrypoint.subprocess, "Popen", popen)
+    return popens
+
+
+def test_router_gets_the_replica_ports():
+    replicas = parse_replicas(['LassoBenchmarks=3@50153', 'SVMBenchmarks=2@50158'])
+    assert router_args(replicas) == [
+        '--replicas', '50053=50153,50154,50155',
+        '--replicas', '50058=50158,50159',
+    ]
+    assert router_args({}) == []
+
+
+def test_parse_replicas():
+    assert parse_replicas([]) == {}
+    assert parse_replicas(['LassoBenchmarks=1@60000', 'LassoBenchmarks=2@50153']) == {
+        'LassoBenchmarks': [50153, 50154]
+    }
+
+
+@pytest.mark.parametrize(
+    "spec",
+    [
+        'LassoBenchmarks',
+        'LassoBenchmarks=3',
+        'LassoBenchmarks=@50153',
+        'LassoBenchmarks=x@50153',
+        'LassoBenchmarks=3@port',
+        'LassoBenchmarks=-1@50153',
+        'LassoBenchmarks=0@50153',
+        '=3@50153',
+        'UnknownBenchmarks=3@50153',
+        'BencherServer=2@50151',
+    ]
+)
+def test_parse_replicas_rejects_invalid_specs(spec):
+    with pytest.raises(ValueError, match="Invalid replica specification"):
+        parse_replicas([spec])
+
+
+def test_check_restarts_with_backoff(tmp_path, clock, popens):
+    service = ServiceProcess("LassoBenchmarks", None, str(tmp_path), max_backoff=4.0)
+    service.start()
+    service.check()
+    assert service.ready
+
+    # quick failures double the backoff up to max_backoff
+    for backoff in [1.0, 2.0, 4.0, 4.0]:
+        clock.now += 1.0
+        popens[-1].exit()
+        service.check()
+        assert not service.ready and service.process is None
+        assert service.restart_at == clock.now + backoff
+        clock.now += backoff - 0.1
+        service.check()
+        assert service.process is None
+        clock.now += 0.1
+        service.check()
+        assert service.process is popens[-1]
+    assert len(popens) == 5
+
+    # a failure after a stable run starts over without backoff growth
+    clock.now += STABLE_AFTER
+    popens[-1].exit()
+    service.check()
+    assert service.failures == 1
+    assert service.restart_at == clock.now + 1.0
+    clock.now += 1.0
+    service.check()
+    clock.now += 1.0
+    popens[-1].exit()
+    service.check()
+    assert service.restart_at == clock.now + 2.0
+
+
+def test_stop_all_terminates_all_processes_before_waiting(tmp_path, clock, popens):
+    processes = [ServiceProcess(f"Service{i}", None, str(tmp_path)) for i in range(3)]
+    for process in processes:
+        process.start()
+    events = []
+    for popen in popens:
+        popen.events = events
+    popens[0].ignores_sigterm = True
+    popens[1].ignores_sigterm = True
+    popens[2].exit(0)
+
+    stop_all(processes, timeout=8.0)
+    # both stuck processes are killed within one shared deadline instead of one timeout each
+    assert events == [
+        ("terminate", popens[0]),
+        ("terminate", popens[1]),
+        ("wait", popens[0], 8.0),
+        ("kill", popens[0]),
+        ("wait", popens[0], None),
+        ("wait", popens[1], 0.0),
+        ("kill", popens[1]),
+        ("wait", popens[1], None),
+        ("wait", popens[2], 0.0),
+    ]
+    assert clock.now == 8.0
+    assert all(popen.returncode is not None for popen in popens)